@@ -0,0 +1,95 @@
+#!/usr/bin/env python2.5
+# -*- coding: utf-8 -*-
+from mediacore.lib.commands import LoadAppCommand, load_app
+
+_script_name = "XHTML Sanitizer Benchmark"
+_script_description = """Use this script to time sanitizing the media
+descriptions in the database with the two-pass BeautifulSoup Cleaner, the
+single-pass sanitizer, and the sanitized output cache.
+
+Each description is repeated until it's at least the given number of
+characters long, and all of them are cleaned the given number of times, as
+if they were saved again. The database isn't modified.
+"""
+DEBUG = False
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option('-l', '--length',
+        dest='length',
+        type='int',
+        help='The minimum length of each description. Defaults to 20000.',
+        default=20000
+    )
+    cmd.parser.add_option('-r', '--repeat',
+        dest='repeat',
+        type='int',
+        help='The number of times to clean every description. Defaults to 3.',
+        default=3
+    )
+    cmd.parser.add_option('--debug',
+        action='store_true',
+        dest='debug',
+        help='Write debug output to STDOUT.',
+        default=False
+    )
+    load_app(cmd)
+    DEBUG = cmd.options.debug
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import sys
+import time
+
+from mediacore.lib.cache_stats import cache_stats
+from mediacore.lib.xhtml import (_clean_xhtml, clean_cache, clean_xhtml,
+    cleaner_settings)
+from mediacore.model import DBSession, Media
+
+def timed(descriptions, repeat, clean):
+    start = time.time()
+    results = []
+    for i in range(repeat):
+        results = [clean(description) for description in descriptions]
+    return time.time() - start, results
+
+def count_fallbacks():
+    return cache_stats.snapshot().get('clean_xhtml', {}).get('fallback', 0)
+
+def main(parser, options, args):
+    descriptions = [description for description,
+                    in DBSession.query(Media.description)
+                    if description and description.strip()]
+    if not descriptions:
+        print "There are no media descriptions in the database."
+        sys.exit(1)
+    descriptions = [
+        u'\n\n'.join([description] * (options.length // len(description) + 1))
+        for description in descriptions]
+    total = sum(len(description) for description in descriptions)
+
+    cleaner_time, cleaner = timed(descriptions, options.repeat,
+        lambda description: _clean_xhtml(description, True, cleaner_settings,
+                                         _single_pass=False))
+    fallbacks = count_fallbacks()
+    single_pass_time, single_pass = timed(descriptions, options.repeat,
+        lambda description: _clean_xhtml(description, True, cleaner_settings))
+    fallbacks = count_fallbacks() - fallbacks
+    clean_cache.clear()
+    cached_time, cached = timed(descriptions, options.repeat, clean_xhtml)
+
+    mismatches = [i for i, (a, b, c)
+                  in enumerate(zip(cleaner, single_pass, cached))
+                  if not a == b == c]
+    if DEBUG:
+        for i in mismatches[:20]:
+            print repr(descriptions[i][:200])
+    print "%d descriptions, %d characters, cleaned %d times." % \
+        (len(descriptions), total, options.repeat)
+    print "Cleaner:            %.2f seconds" % cleaner_time
+    print "Single pass:        %.2f seconds" % single_pass_time
+    print "With the cache:     %.2f seconds" % cached_time
+    print "Cleaner fallbacks:  %d" % fallbacks
+    print "Mismatched output:  %d" % len(mismatches)
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
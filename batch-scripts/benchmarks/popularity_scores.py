@@ -0,0 +1,70 @@
+#!/usr/bin/env python2.5
+# -*- coding: utf-8 -*-
+from mediacore.lib.commands import LoadAppCommand, load_app
+
+_script_name = "Popularity Score Benchmark"
+_script_description = """Use this script to time the bulk popularity calculation
+against calling calculate_popularity once per media, and to check that they
+give the same results.
+
+Random publish dates and ratings are generated, the database isn't touched.
+"""
+DEBUG = False
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option('-n', '--rows',
+        dest='rows',
+        type='int',
+        help='The number of media to score. Defaults to 1000000.',
+        default=1000000
+    )
+    cmd.parser.add_option('--debug',
+        action='store_true',
+        dest='debug',
+        help='Write debug output to STDOUT.',
+        default=False
+    )
+    load_app(cmd)
+    DEBUG = cmd.options.debug
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from mediacore.lib import util
+
+def main(parser, options, args):
+    if not util.numpy:
+        print "NumPy isn't installed, both runs would use pure Python math."
+        sys.exit(1)
+    exponent, lifetime = 4, 36
+    now = datetime.now()
+    span = (now - datetime(2000, 1, 1)).days * 86400
+    dates = [now - timedelta(seconds=random.randint(0, span))
+             for i in xrange(options.rows)]
+    scores = [random.randint(-50, 5000) for i in xrange(options.rows)]
+
+    start = time.time()
+    scalar = [util.calculate_popularity(date, score, exponent, lifetime)
+              for date, score in zip(dates, scores)]
+    scalar_time = time.time() - start
+
+    start = time.time()
+    vector, = util.calculate_popularity_scores(dates, [scores],
+                                               exponent, lifetime)
+    vector_time = time.time() - start
+
+    mismatches = [i for i, (a, b) in enumerate(zip(scalar, vector)) if a != b]
+    if DEBUG:
+        for i in mismatches[:20]:
+            print dates[i], scores[i], scalar[i], vector[i]
+    print "calculate_popularity:        %.2f seconds" % scalar_time
+    print "calculate_popularity_scores: %.2f seconds" % vector_time
+    print "%d of %d scores differ." % (len(mismatches), options.rows)
+    sys.exit(mismatches and 1 or 0)
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
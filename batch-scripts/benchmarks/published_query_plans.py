@@ -0,0 +1,106 @@
+#!/usr/bin/env python2.5
+# -*- coding: utf-8 -*-
+from mediacore.lib.commands import LoadAppCommand, load_app
+
+_script_name = "Published Media Query Plan Benchmark"
+_script_description = """Use this script to compare the query plans and timings
+of the public listings before and after the materialized publication state.
+
+The 'before' queries evaluate the full publication criteria on every row,
+the 'after' queries use the indexed media.live flag.
+"""
+DEBUG = False
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option('-n', '--repeat',
+        dest='repeat',
+        type='int',
+        help='Run each query this many times to time it. Defaults to 20.',
+        default=20
+    )
+    cmd.parser.add_option('--debug',
+        action='store_true',
+        dest='debug',
+        help='Write debug output to STDOUT.',
+        default=False
+    )
+    load_app(cmd)
+    DEBUG = cmd.options.debug
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import sql
+
+from mediacore.model.meta import DBSession
+from mediacore.model.comments import comments
+from mediacore.model.media import _live_clause, media
+
+explain_prefixes = {
+    'mysql': 'EXPLAIN ',
+    'postgresql': 'EXPLAIN ',
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+}
+
+def listing_queries(published):
+    """Return the queries run by the explore, index and API pages."""
+    comment_count = sql.select(
+        [sql.func.count(comments.c.id)],
+        sql.and_(comments.c.media_id == media.c.id,
+                 comments.c.publishable == True),
+    ).label('comment_count_published')
+    return [
+        ('explore (latest)', sql.select([media.c.id], published)
+            .order_by(media.c.publish_on.desc()).limit(8)),
+        ('explore (popular)', sql.select([media.c.id], published)
+            .order_by(media.c.popularity_points.desc()).limit(5)),
+        ('index (page)', sql.select([media.c.id], published)
+            .order_by(media.c.publish_on.desc()).limit(10).offset(100)),
+        ('index (count)', sql.select([sql.func.count(media.c.id)], published)),
+        ('api (page)', sql.select([media.c.id, comment_count], published)
+            .order_by(media.c.publish_on.desc()).limit(50)),
+    ]
+
+def compile_query(query, conn):
+    compiled = query.compile(bind=conn)
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = [params[key] for key in compiled.positiontup]
+    return unicode(compiled), params
+
+def explain(conn, query):
+    prefix = explain_prefixes.get(conn.dialect.name)
+    if prefix is None:
+        return []
+    statement, params = compile_query(query, conn)
+    return conn.execute(prefix + statement, params).fetchall()
+
+def time_query(conn, query, repeat):
+    start = time.time()
+    for i in xrange(repeat):
+        conn.execute(query).fetchall()
+    return (time.time() - start) / repeat * 1000
+
+def main(parser, options, args):
+    conn = DBSession.connection()
+    before_queries = listing_queries(_live_clause(datetime.now()))
+    after_queries = dict(listing_queries(media.c.live == True))
+    for title, before in before_queries:
+        after = after_queries[title]
+        print "=" * 79
+        print title
+        for label, query in (('before', before), ('after', after)):
+            print "-" * 79
+            if DEBUG:
+                print compile_query(query, conn)[0]
+            for row in explain(conn, query):
+                print "  ", " | ".join(unicode(col) for col in row)
+            print "  %s: %.2f ms average over %d runs" % (
+                label, time_query(conn, query, options.repeat), options.repeat)
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python2.5
+# -*- coding: utf-8 -*-
+from mediacore.lib.commands import LoadAppCommand, load_app
+
+_script_name = "Thumbnail Pipeline Benchmark"
+_script_description = """Use this script to time creating the media and podcast
+thumbs from a large upload, compared to resizing the full image once for every
+size, and to check that the thumbs look the same.
+
+Unless an image is given, a 20 megapixel JPEG is generated. The thumbs are
+written to a temporary directory, not the image_dir.
+"""
+DEBUG = False
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option('-f', '--file',
+        dest='file',
+        help='The image to create thumbs from.',
+        default=None
+    )
+    cmd.parser.add_option('-r', '--repeat',
+        dest='repeat',
+        type='int',
+        help='The number of times to create the thumbs. Defaults to 5.',
+        default=5
+    )
+    cmd.parser.add_option('--debug',
+        action='store_true',
+        dest='debug',
+        help='Write debug output to STDOUT.',
+        default=False
+    )
+    load_app(cmd)
+    DEBUG = cmd.options.debug
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import os
+import random
+import shutil
+import tempfile
+import time
+from StringIO import StringIO
+
+from PIL import Image, ImageChops, ImageDraw, ImageStat
+from pylons import config
+
+from mediacore.lib.thumbnails import create_thumbs_for, resize_thumb, thumb_path
+
+def generate_image(size=(5472, 3648)):
+    """Return a JPEG with plenty of edges, as a string."""
+    img = Image.new('RGB', size, (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    rand = random.Random(0)
+    for i in range(500):
+        x = rand.randint(0, size[0])
+        y = rand.randint(0, size[1])
+        draw.ellipse([x, y, x + rand.randint(10, 1000), y + rand.randint(10, 1000)],
+                     fill=(rand.randint(0, 255), rand.randint(0, 255),
+                           rand.randint(0, 255)))
+    buffer = StringIO()
+    img.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+def old_thumbs(data, sizes):
+    """Resize the full image for every size, as create_thumbs_for used to."""
+    img = Image.open(StringIO(data))
+    thumbs = {}
+    for key, xy in sizes.iteritems():
+        thumb_img = resize_thumb(img, xy)
+        if thumb_img.mode != "RGB":
+            thumb_img = thumb_img.convert("RGB")
+        thumbs[key] = thumb_img
+    return thumbs
+
+def save_thumbs(thumbs, dir):
+    for key, thumb_img in thumbs.iteritems():
+        thumb_img.save(os.path.join(dir, 'old%s.jpg' % key))
+
+def main(parser, options, args):
+    if options.file:
+        data = open(options.file, 'rb').read()
+    else:
+        data = generate_image()
+    size = Image.open(StringIO(data)).size
+
+    image_dir = config['image_dir']
+    tmp_dir = config['image_dir'] = tempfile.mkdtemp()
+    try:
+        print "%dx%d image, %d bytes, %d runs." % \
+            (size[0], size[1], len(data), options.repeat)
+        for thumb_dir, sizes in sorted(config['thumb_sizes'].iteritems()):
+            os.mkdir(os.path.join(tmp_dir, thumb_dir))
+            item = (thumb_dir, 'benchmark')
+
+            start = time.time()
+            for i in range(options.repeat):
+                save_thumbs(old_thumbs(data, sizes),
+                            os.path.join(tmp_dir, thumb_dir))
+            old_time = (time.time() - start) / options.repeat
+
+            totals = {}
+            start = time.time()
+            for i in range(options.repeat):
+                timings = create_thumbs_for(item, StringIO(data), 'benchmark.jpg')
+                for stage, seconds in timings.iteritems():
+                    totals[stage] = totals.get(stage, 0) + seconds
+            new_time = (time.time() - start) / options.repeat
+
+            print "%s thumbs:" % thumb_dir
+            print "  Resizing every size:  %.3f seconds" % old_time
+            print "  Pipeline:             %.3f seconds (%s)" % (new_time,
+                ', '.join('%s %.3f' % (stage, totals[stage] / options.repeat)
+                          for stage in ('decode', 'resize', 'save', 'backup')))
+            for key in sorted(sizes):
+                old_img = Image.open(os.path.join(tmp_dir, thumb_dir,
+                                                  'old%s.jpg' % key))
+                new_img = Image.open(thumb_path(item, key))
+                diff = ImageStat.Stat(ImageChops.difference(
+                    old_img.convert('RGB'), new_img.convert('RGB')))
+                print "  %s %dx%d: mean difference %s" % (key,
+                    new_img.size[0], new_img.size[1],
+                    ' '.join('%.2f' % band for band in diff.mean))
+                if DEBUG:
+                    print "    max difference %s" % ' '.join(
+                        '%d' % hi for lo, hi in diff.extrema)
+    finally:
+        config['image_dir'] = image_dir
+        shutil.rmtree(tmp_dir)
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python2.5
+# -*- coding: utf-8 -*-
+from mediacore.lib.commands import LoadAppCommand, load_app
+
+_script_name = "URI Cache Benchmark"
+_script_description = """Use this script to time building and picking the URIs
+of a large feed, with and without the URI cache.
+
+The media files in the database are repeated until the feed has the given
+number of items. The database isn't modified.
+"""
+DEBUG = False
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option('-n', '--items',
+        dest='items',
+        type='int',
+        help='The number of feed items. Defaults to 10000.',
+        default=10000
+    )
+    cmd.parser.add_option('--debug',
+        action='store_true',
+        dest='debug',
+        help='Write debug output to STDOUT.',
+        default=False
+    )
+    load_app(cmd)
+    DEBUG = cmd.options.debug
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import sys
+import time
+
+from mediacore.lib.uri import pick_uris, uri_cache
+from mediacore.model import MediaFile
+
+def feed_uris(files, get_uris):
+    """Pick the URIs a feed item uses, as the RSS templates do."""
+    for file in files:
+        uris = get_uris(file)
+        pick_uris(uris, scheme='http')
+        pick_uris(uris, scheme='download', type=file.type)
+        pick_uris(uris, container=file.container)
+
+def timed(files, get_uris):
+    start = time.time()
+    feed_uris(files, get_uris)
+    return time.time() - start
+
+def main(parser, options, args):
+    unique = MediaFile.query.all()
+    if not unique:
+        print "There are no media files in the database."
+        sys.exit(1)
+    # Load the media and storage of each file up front, so that the
+    # first run doesn't pay for the queries.
+    for file in unique:
+        file.media, file.storage
+    files = (unique * (options.items // len(unique) + 1))[:options.items]
+
+    uncached_time = timed(files, lambda file: file.storage.get_uris(file))
+    uri_cache.clear()
+    cold_time = timed(files, uri_cache.get_uris)
+    warm_time = timed(files, uri_cache.get_uris)
+
+    if DEBUG:
+        for file in unique[:20]:
+            print file, uri_cache.get_uris(file)
+    print "%d feed items, %d distinct files." % (len(files), len(unique))
+    print "Without the cache:  %.2f seconds" % uncached_time
+    print "Cold cache:         %.2f seconds" % cold_time
+    print "Warm cache:         %.2f seconds" % warm_time
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
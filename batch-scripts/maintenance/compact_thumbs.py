@@ -0,0 +1,186 @@
+#!/usr/bin/env python2.5
+# -*- coding: utf-8 -*-
+from mediacore.lib.commands import LoadAppCommand, load_app
+
+_script_name = "Thumbnail Compaction Script"
+_script_description = """Use this script to replace the copies of the default
+thumbs with references to the shared default files, and optionally to delete
+uploaded thumbs that are no longer used.
+
+Before thumb names were stored, every media and podcast without a thumb of its
+own got a copy of the default thumbs. Items whose thumbs are identical to the
+defaults now refer to the 'new' thumbs instead, and their copies are deleted.
+Their thumb URLs change accordingly, so the cached pages of those items are
+invalidated.
+
+Thumbs named after the hash of an uploaded image may be shared by several
+items, so they aren't deleted along with an item. With --gc, those that no
+item refers to any more, and that are older than an hour, are deleted, or
+moved to the deleted_files_dir if one is configured. So are the old thumbs
+named after the ID of an item that has since been given a new thumb.
+"""
+DEBUG = False
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option('-c', '--chunk-size',
+        dest='chunk_size',
+        type='int',
+        help='The number of items to read at once. Defaults to 500.',
+        default=500
+    )
+    cmd.parser.add_option('--gc',
+        action='store_true',
+        dest='gc',
+        help='Delete the uploaded thumbs that no item uses.',
+        default=False
+    )
+    cmd.parser.add_option('--debug',
+        action='store_true',
+        dest='debug',
+        help='Write debug output to STDOUT.',
+        default=False
+    )
+    load_app(cmd)
+    DEBUG = cmd.options.debug
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import os
+import re
+import sys
+import time
+
+from pylons import config
+from sqlalchemy import sql
+
+from mediacore.lib.cache_tags import cache_tags
+from mediacore.lib.util import delete_files
+from mediacore.model import Media, Podcast
+from mediacore.model.media import media as media_table
+from mediacore.model.meta import DBSession
+from mediacore.model.podcasts import podcasts as podcasts_table
+
+_hash_filename = re.compile(r'^([0-9a-f]{40})\w+\.[a-z0-9]*$')
+_id_filename = re.compile(r'^(\d+)[a-z]+\.[a-z0-9]*$')
+
+def read_file(path):
+    f = open(path, 'rb')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+def is_copy(path, data):
+    """Return True if the file at the given path contains the given data."""
+    try:
+        if os.path.getsize(path) != len(data):
+            return False
+        return read_file(path) == data
+    except (IOError, OSError):
+        return False
+
+def share_defaults(thumb_dir, table, tag, chunk_size):
+    """Refer to the default thumbs instead of identical copies of them.
+
+    :returns: The number of items that now share the defaults.
+    """
+    path = os.path.join(config['image_dir'], thumb_dir)
+    sizes = config['thumb_sizes'][thumb_dir].keys()
+    defaults = dict((key, read_file(os.path.join(path, 'new%s.jpg' % key)))
+                    for key in sizes)
+
+    select = sql.select([table.c.id])\
+        .where(table.c.thumb_name == None)\
+        .order_by(table.c.id)\
+        .limit(chunk_size)
+    # The modification date is left alone, the thumbs still look the same.
+    # Items given a new thumb since they were selected are skipped.
+    update = table.update()\
+        .where(sql.and_(table.c.id == sql.bindparam('_id'),
+                        table.c.thumb_name == None))\
+        .values({table.c.thumb_name: u'new',
+                 table.c.modified_on: table.c.modified_on})
+
+    shared = 0
+    last_id = 0
+    while True:
+        conn = DBSession.connection()
+        ids = [id for id, in conn.execute(select.where(table.c.id > last_id))]
+        if not ids:
+            break
+        last_id = ids[-1]
+        copies = []
+        for id in ids:
+            paths = [os.path.join(path, '%d%s.jpg' % (id, key)) for key in sizes]
+            if all([is_copy(p, defaults[key]) for p, key in zip(paths, sizes)]):
+                copies.append((id, paths))
+        copies = [copy for copy in copies
+                  if conn.execute(update, {'_id': copy[0]}).rowcount]
+        if copies:
+            DBSession.commit()
+            cache_tags.invalidate(*['%s:%d' % (tag, item_id)
+                                    for item_id, _ in copies])
+            for id, paths in copies:
+                # Nothing is lost, so the copies needn't be kept around
+                for copy_path in paths:
+                    os.remove(copy_path)
+                if DEBUG:
+                    print "%s/%d now shares the default thumbs." % (thumb_dir, id)
+            shared += len(copies)
+        else:
+            DBSession.commit()
+    return shared
+
+def collect_garbage(thumb_dir, table, min_age=3600):
+    """Delete the thumbs and originals that no item refers to.
+
+    These are the hash-named files that no item's thumb name refers to,
+    and the ID-named files of items that no longer use them, because they
+    have a thumb name or have been deleted. Files younger than ``min_age``
+    seconds are kept, since they may belong to an upload that hasn't been
+    committed yet.
+
+    :returns: The number of files deleted.
+    """
+    path = os.path.join(config['image_dir'], thumb_dir)
+    in_use = set([name for name, in DBSession.execute(
+        sql.select([table.c.thumb_name]).distinct())])
+    ids_in_use = set([str(item_id) for item_id, in DBSession.execute(
+        sql.select([table.c.id], table.c.thumb_name == None))])
+    DBSession.commit()
+    now = time.time()
+    garbage = []
+    for filename in os.listdir(path):
+        match = _hash_filename.match(filename)
+        if match:
+            unused = match.group(1) not in in_use
+        else:
+            match = _id_filename.match(filename)
+            unused = match is not None and match.group(1) not in ids_in_use
+        if unused:
+            file_path = os.path.join(path, filename)
+            if now - os.path.getmtime(file_path) > min_age:
+                garbage.append(file_path)
+    delete_files(garbage, thumb_dir)
+    if DEBUG:
+        for file_path in garbage:
+            print "Deleted %s" % file_path
+    return len(garbage)
+
+def main(parser, options, args):
+    start = time.time()
+    for thumb_dir, table, tag, listing_tag in (
+            (Media._thumb_dir, media_table, 'media', 'catalog'),
+            (Podcast._thumb_dir, podcasts_table, 'podcast', 'podcasts')):
+        shared = share_defaults(thumb_dir, table, tag, options.chunk_size)
+        if shared:
+            cache_tags.invalidate(listing_tag)
+        print "%s: %d items now share the default thumbs." % (thumb_dir, shared)
+        if options.gc:
+            deleted = collect_garbage(thumb_dir, table)
+            print "%s: deleted %d unused files." % (thumb_dir, deleted)
+    print "Done in %.1f seconds." % (time.time() - start)
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
@@ -0,0 +1,46 @@
+#!/usr/bin/env python2.5
+# -*- coding: utf-8 -*-
+from mediacore.lib.commands import LoadAppCommand, load_app
+
+_script_name = "Related Media Rebuild Script"
+_script_description = """Use this script to recompute the related media of all
+media.
+
+Worker processes keep the related media up to date as media are saved, but the
+similarity weights drift as the library grows. Run this after upgrading, and
+from cron every so often after that.
+"""
+DEBUG = False
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option('--debug',
+        action='store_true',
+        dest='debug',
+        help='Write debug output to STDOUT.',
+        default=False
+    )
+    load_app(cmd)
+    DEBUG = cmd.options.debug
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import sys
+import time
+
+from mediacore.lib.related import related_media
+from mediacore.model.meta import DBSession
+
+def main(parser, options, args):
+    start = time.time()
+    conn = DBSession.connection()
+    written = related_media.rebuild(conn)
+    DBSession.commit()
+    if DEBUG:
+        print "Indexed %d media with %d distinct features." % (
+            len(related_media.features), len(related_media.postings))
+    print "Found related media for %d media in %.1f seconds." % (
+        written, time.time() - start)
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
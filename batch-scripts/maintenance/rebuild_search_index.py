@@ -0,0 +1,44 @@
+#!/usr/bin/env python2.5
+# -*- coding: utf-8 -*-
+from mediacore.lib.commands import LoadAppCommand, load_app
+
+_script_name = "Search Index Rebuild Script"
+_script_description = """Use this script to rebuild the on-disk search index used
+when MySQL FULLTEXT search isn't available.
+
+Worker processes add changes to the index as media are saved, so this only
+needs to be run once, and again if the index is lost. Restart the server after
+building the index for the first time so that it starts using it.
+"""
+DEBUG = False
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option('--debug',
+        action='store_true',
+        dest='debug',
+        help='Write debug output to STDOUT.',
+        default=False
+    )
+    load_app(cmd)
+    DEBUG = cmd.options.debug
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import sys
+import time
+
+from mediacore.lib.search import get_backends
+from mediacore.model.meta import DBSession
+
+def main(parser, options, args):
+    conn = DBSession.connection()
+    for backend in get_backends():
+        start = time.time()
+        count = backend.rebuild(conn)
+        if count or DEBUG:
+            print "Indexed %d media for the %s search backend in %.1f seconds." \
+                % (count, backend.backend_type, time.time() - start)
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
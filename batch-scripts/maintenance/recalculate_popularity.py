@@ -0,0 +1,52 @@
+#!/usr/bin/env python2.5
+# -*- coding: utf-8 -*-
+from mediacore.lib.commands import LoadAppCommand, load_app
+
+_script_name = "Popularity Recalculation Script"
+_script_description = """Use this script to recalculate the popularity_points,
+popularity_likes and popularity_dislikes of all media.
+
+Popularity scores decay over time, so this should be run regularly. Worker
+processes do this themselves every popularity_recalculation_interval seconds,
+set that to 0 in your config if you'd rather run this script from cron.
+"""
+DEBUG = False
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option('--chunk-size',
+        dest='chunk_size',
+        type='int',
+        help='The number of media to process at a time. Defaults to 10000.',
+        default=10000
+    )
+    cmd.parser.add_option('--debug',
+        action='store_true',
+        dest='debug',
+        help='Write debug output to STDOUT.',
+        default=False
+    )
+    load_app(cmd)
+    DEBUG = cmd.options.debug
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import sys
+import time
+
+from mediacore.lib import util
+from mediacore.model.meta import DBSession
+from mediacore.model.media import recalculate_popularity
+
+def main(parser, options, args):
+    if DEBUG:
+        print "Using %s." % (util.numpy and "NumPy" or "pure Python math")
+    start = time.time()
+    conn = DBSession.connection()
+    scanned, updated = recalculate_popularity(conn, chunk_size=options.chunk_size)
+    DBSession.commit()
+    print "Updated the popularity of %d of %d media in %.1f seconds." % (
+        updated, scanned, time.time() - start)
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
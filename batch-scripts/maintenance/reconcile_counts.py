@@ -0,0 +1,46 @@
+#!/usr/bin/env python2.5
+# -*- coding: utf-8 -*-
+from mediacore.lib.commands import LoadAppCommand, load_app
+
+_script_name = "Count Reconciliation Script"
+_script_description = """Use this script to recount the media_count and
+media_count_published of all tags and categories, and the comment_count and
+comment_count_published of all media.
+
+These counts are adjusted as media, comments and their associations are
+saved, so they should only drift if rows are modified outside of MediaCore.
+Run this script after such changes, or from cron as a safety net.
+"""
+DEBUG = False
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option('--debug',
+        action='store_true',
+        dest='debug',
+        help='Write debug output to STDOUT.',
+        default=False
+    )
+    load_app(cmd)
+    DEBUG = cmd.options.debug
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import sys
+import time
+
+from mediacore.model.meta import DBSession
+from mediacore.model.media import reconcile_counts
+
+def main(parser, options, args):
+    start = time.time()
+    corrected = reconcile_counts(DBSession.connection())
+    DBSession.commit()
+    if DEBUG:
+        for table, count in sorted(corrected.iteritems()):
+            print "%s: %d rows corrected" % (table, count)
+    print "Corrected %d rows in %.1f seconds." % (
+        sum(corrected.itervalues()), time.time() - start)
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
@@ -0,0 +1,287 @@
+#!/usr/bin/env python2.5
+# -*- coding: utf-8 -*-
+from mediacore.lib.commands import LoadAppCommand, load_app
+
+_script_name = "Thumbnail Regeneration Script"
+_script_description = """Use this script to recreate the thumbs of all media and
+podcasts from their original images, after changing the thumb_sizes.
+
+Thumbs are made from the <name>orig.<ext> images that are kept in the
+image_dir when a thumb is uploaded. Items without an original, such as those
+with the default thumbs, are left alone. The source and sizes of every item's
+thumbs are recorded in image_dir/thumbs.manifest, so items whose thumbs are
+already up to date are skipped, and an interrupted run can simply be started
+again.
+"""
+DEBUG = False
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option('-p', '--processes',
+        dest='processes',
+        type='int',
+        help='The number of worker processes. Defaults to the number of CPUs.',
+        default=None
+    )
+    cmd.parser.add_option('-b', '--batch-size',
+        dest='batch_size',
+        type='int',
+        help='The most images to queue for the workers at once. Defaults to 100.',
+        default=100
+    )
+    cmd.parser.add_option('-f', '--force',
+        action='store_true',
+        dest='force',
+        help='Recreate all thumbs, even those that are up to date.',
+        default=False
+    )
+    cmd.parser.add_option('--debug',
+        action='store_true',
+        dest='debug',
+        help='Write debug output to STDOUT.',
+        default=False
+    )
+    load_app(cmd)
+    DEBUG = cmd.options.debug
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import itertools
+import os
+import re
+import signal
+import sys
+import time
+
+try:
+    import multiprocessing
+except ImportError:
+    # Python 2.5 rebuilds in this process only
+    multiprocessing = None
+
+from pylons import config
+
+from mediacore.lib.compat import sha1
+from mediacore.lib.thumbnails import save_thumbs_for
+from mediacore.model import Media, Podcast
+from mediacore.model.meta import DBSession
+
+_orig_filename = re.compile(r'^(\w+)orig\.[a-z0-9]*$')
+
+class Manifest(object):
+    """The source image and thumb sizes each item's thumbs were made from.
+
+    Entries are appended to the file as soon as an item is done, and the
+    last entry of each item wins, so nothing is lost when interrupted.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            f = open(path)
+            try:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) == 6:
+                        thumb_dir, item_id, sizes_key, digest, size, mtime = fields
+                        self.entries[(thumb_dir, item_id)] = \
+                            (sizes_key, digest, int(size), int(mtime))
+            finally:
+                f.close()
+        self._file = open(path, 'a')
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def record(self, key, entry):
+        self.entries[key] = entry
+        self._file.write(self._format(key, entry))
+        self._file.flush()
+
+    def compact(self):
+        """Rewrite the file with only the last entry of every item."""
+        self._file.close()
+        tmp_path = '%s.%d' % (self.path, os.getpid())
+        f = open(tmp_path, 'w')
+        try:
+            for key in sorted(self.entries):
+                f.write(self._format(key, self.entries[key]))
+        finally:
+            f.close()
+        os.rename(tmp_path, self.path)
+        self._file = open(self.path, 'a')
+
+    def close(self):
+        self._file.close()
+
+    def _format(self, key, entry):
+        return '%s %s %s %s %d %d\n' % (key + entry)
+
+def sizes_key(sizes):
+    """Return a short hash of the thumb sizes of one type of item."""
+    sizes = sorted((key, tuple(size)) for key, size in sizes.iteritems())
+    return sha1(repr(sizes)).hexdigest()[:16]
+
+def file_digest(f, block_size=65536):
+    digest = sha1()
+    while True:
+        block = f.read(block_size)
+        if not block:
+            break
+        digest.update(block)
+    return digest.hexdigest()
+
+def scan(thumb_dir, item_ids, manifest, force=False):
+    """Return the items of the given type whose thumbs must be recreated.
+
+    :returns: The tasks for :func:`rebuild`, and the number of items
+        without an original and the number of items that are up to date.
+    """
+    path = os.path.join(config['image_dir'], thumb_dir)
+    sizes = config['thumb_sizes'][thumb_dir]
+    current_sizes = sizes_key(sizes)
+    filenames = set(os.listdir(path))
+    originals = {}
+    for filename in filenames:
+        match = _orig_filename.match(filename)
+        if match:
+            originals[match.group(1)] = os.path.join(path, filename)
+
+    tasks = []
+    no_original = up_to_date = 0
+    for item_id in item_ids:
+        source = originals.get(item_id)
+        if source is None:
+            no_original += 1
+            continue
+        # With an unchanged size and mtime, the source is assumed to be
+        # unchanged. Otherwise the worker compares the hash of the source.
+        known_digest = None
+        entry = manifest.get((thumb_dir, item_id))
+        if not force and entry is not None and entry[0] == current_sizes \
+        and all(['%s%s.jpg' % (item_id, key) in filenames for key in sizes]):
+            stat = os.stat(source)
+            if (stat.st_size, int(stat.st_mtime)) == entry[2:]:
+                up_to_date += 1
+                continue
+            known_digest = entry[1]
+        tasks.append((thumb_dir, item_id, source, current_sizes, known_digest))
+    return tasks, no_original, up_to_date
+
+def rebuild(task):
+    """Recreate the thumbs of one item, in a worker process.
+
+    :returns: The manifest key and entry, whether the thumbs were recreated,
+        and an error message or None.
+    """
+    thumb_dir, item_id, source, current_sizes, known_digest = task
+    key = (thumb_dir, item_id)
+    try:
+        stat = os.stat(source)
+        f = open(source, 'rb')
+        try:
+            digest = file_digest(f)
+            rebuilt = digest != known_digest
+            if rebuilt:
+                f.seek(0)
+                save_thumbs_for(key, f)
+        finally:
+            f.close()
+    except Exception, e:
+        return key, None, False, '%s: %s' % (e.__class__.__name__, e)
+    entry = (current_sizes, digest, stat.st_size, int(stat.st_mtime))
+    return key, entry, rebuilt, None
+
+def _ignore_interrupts():
+    # Only the parent process handles ^C, and stops the workers.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def format_eta(seconds):
+    seconds = int(seconds)
+    return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+def main(parser, options, args):
+    manifest = Manifest(os.path.join(config['image_dir'], 'thumbs.manifest'))
+    tasks = []
+    for thumb_dir, model in (('media', Media), ('podcasts', Podcast)):
+        # Items with the same image share their thumbs, which are named
+        # after its hash, so each name is only recreated once.
+        names = set([str(thumb_name or id) for id, thumb_name
+                     in DBSession.query(model.id, model.thumb_name)])
+        # The defaults are recreated too, if they have an original
+        names.add('new')
+        item_ids = sorted(names)
+        dir_tasks, no_original, up_to_date = \
+            scan(thumb_dir, item_ids, manifest, options.force)
+        tasks.extend(dir_tasks)
+        print "%s: %d to recreate, %d up to date, %d without an original." % (
+            thumb_dir, len(dir_tasks), up_to_date, no_original)
+    # The workers don't use the database, so don't share its connections.
+    DBSession.remove()
+    if not tasks:
+        manifest.close()
+        sys.exit(0)
+
+    processes = options.processes
+    if processes is None:
+        processes = multiprocessing and multiprocessing.cpu_count() or 1
+    pool = None
+    if multiprocessing and processes > 1:
+        pool = multiprocessing.Pool(processes, _ignore_interrupts)
+
+    start = last_report = time.time()
+    done = rebuilt = failed = 0
+    interrupted = False
+    try:
+        try:
+            for offset in range(0, len(tasks), options.batch_size):
+                # Only queue a batch at a time, so that the pool doesn't hold
+                # on to every task and result at once.
+                batch = tasks[offset:offset + options.batch_size]
+                if pool is None:
+                    results = itertools.imap(rebuild, batch)
+                else:
+                    results = pool.imap_unordered(rebuild, batch)
+                for i in range(len(batch)):
+                    if pool is None:
+                        result = results.next()
+                    else:
+                        # Waiting with a timeout lets ^C through.
+                        result = results.next(86400)
+                    key, entry, was_rebuilt, error = result
+                    done += 1
+                    if error is not None:
+                        failed += 1
+                        print "Couldn't recreate the thumbs of %s/%s: %s" % (
+                            key + (error,))
+                    else:
+                        rebuilt += was_rebuilt
+                        manifest.record(key, entry)
+                        if DEBUG:
+                            print "%s/%s %s" % (key + (
+                                was_rebuilt and 'recreated' or 'unchanged',))
+                    now = time.time()
+                    if now - last_report >= 5 or done == len(tasks):
+                        last_report = now
+                        rate = done / max(now - start, 0.001)
+                        print "%d/%d items, %.1f items/s, ETA %s" % (
+                            done, len(tasks), rate,
+                            format_eta((len(tasks) - done) / rate))
+        except KeyboardInterrupt:
+            interrupted = True
+            if pool is not None:
+                pool.terminate()
+                pool = None
+            print "Interrupted. Run this script again to resume."
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        manifest.compact()
+        manifest.close()
+
+    print "Recreated the thumbs of %d items in %.1f seconds, %d failed." % (
+        rebuilt, time.time() - start, failed)
+    sys.exit((failed or interrupted) and 1 or 0)
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python2.5
+# -*- coding: utf-8 -*-
+from mediacore.lib.commands import LoadAppCommand, load_app
+
+_script_name = "Comment Rescan Script"
+_script_description = """Use this script to star out the words in the current
+vulgarity filter from the author names and bodies of all existing comments.
+
+Comments are read in chunks and only those that change are updated. The
+admin settings page does this too when the filtered words are changed, but
+this script can be used for large comment tables or a changed word list
+that was imported outside of MediaCore.
+"""
+DEBUG = False
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option('-c', '--chunk-size',
+        dest='chunk_size',
+        type='int',
+        help='The number of comments to read at once. Defaults to 500.',
+        default=500
+    )
+    cmd.parser.add_option('--debug',
+        action='store_true',
+        dest='debug',
+        help='Write debug output to STDOUT.',
+        default=False
+    )
+    load_app(cmd)
+    DEBUG = cmd.options.debug
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import sys
+import time
+
+from mediacore.lib.cache_tags import cache_tags
+from mediacore.lib.vulgarity import get_vulgarity_filter
+from mediacore.model import Setting
+from mediacore.model.comments import rescan_comments
+from mediacore.model.meta import DBSession
+
+def main(parser, options, args):
+    words = DBSession.query(Setting.value)\
+        .filter(Setting.key == u'vulgarity_filtered_words')\
+        .scalar()
+    if not words:
+        print "No words are filtered."
+        sys.exit(0)
+    vulgarity_filter = get_vulgarity_filter(words)
+    if DEBUG:
+        print "Filtering: %s" % u', '.join(sorted(vulgarity_filter.words))
+
+    start = time.time()
+    media_ids = rescan_comments(DBSession.connection(), vulgarity_filter,
+                                chunk_size=options.chunk_size)
+    DBSession.commit()
+    cache_tags.invalidate(*['media:%d' % media_id for media_id in media_ids])
+    print "Updated the comments of %d media in %.1f seconds." % (
+        len(media_ids), time.time() - start)
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
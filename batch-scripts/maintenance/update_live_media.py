@@ -0,0 +1,67 @@
+#!/usr/bin/env python2.5
+# -*- coding: utf-8 -*-
+from mediacore.lib.commands import LoadAppCommand, load_app
+
+_script_name = "Media Publication State Script"
+_script_description = """Use this script to backfill or verify the materialized
+publication state (the media.live column) of all media.
+
+By default, any media whose live flag disagrees with its review, encoding and
+publish date settings is updated. Use --verify to only report the mismatches.
+"""
+DEBUG = False
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option('--verify',
+        action='store_true',
+        dest='verify',
+        help='Report mismatched rows without updating them. Exits with a '\
+             'nonzero status if any are found.',
+        default=False
+    )
+    cmd.parser.add_option('--debug',
+        action='store_true',
+        dest='debug',
+        help='Write debug output to STDOUT.',
+        default=False
+    )
+    load_app(cmd)
+    DEBUG = cmd.options.debug
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import sys
+from datetime import datetime
+
+from sqlalchemy import sql
+
+from mediacore.model.meta import DBSession
+from mediacore.model.media import _live_clause, media, update_live_flags
+
+def find_mismatches(now):
+    live = _live_clause(now)
+    query = sql.select([media.c.id, media.c.live], sql.or_(
+        sql.and_(media.c.live == True, sql.not_(live)),
+        sql.and_(media.c.live == False, live),
+    )).order_by(media.c.id)
+    return DBSession.execute(query).fetchall()
+
+def main(parser, options, args):
+    now = datetime.now()
+    mismatches = find_mismatches(now)
+    if DEBUG or options.verify:
+        for media_id, live in mismatches:
+            print "Media %d is marked %s" % (
+                media_id, live and 'live' or 'not live')
+
+    if options.verify:
+        print "%d media have an incorrect publication state." % len(mismatches)
+        sys.exit(mismatches and 1 or 0)
+
+    updated = update_live_flags(DBSession, now)
+    DBSession.commit()
+    print "Updated the publication state of %d media." % updated
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
@@ -18,6 +18,7 @@ import re
 
 from formencode.api import get_localedir as get_formencode_localedir
 from genshi.filters.i18n import Translator
+from paste.deploy.converters import asbool
 from pylons import translator
 from pylons.configuration import PylonsConfig
 from sqlalchemy import engine_from_config
@@ -71,12 +72,20 @@ def load_environment(global_conf, app_conf):
         translations = Translator(translator)
         translations.setup(template)
 
-    # Create the Genshi TemplateLoader
+    # Persist parsed templates so that new workers needn't parse them again
+    compiled_dir = None
+    if asbool(config.get('templates_compiled_cache', 'false')):
+        compiled_dir = os.path.join(config['app_conf']['cache_dir'],
+                                    'templates')
+
+    # Create the Genshi TemplateLoader. Its cache is large enough to hold
+    # all core, plugin and ToscaWidgets templates when they're precompiled.
     config['pylons.app_globals'].genshi_loader = TemplateLoader(
         search_path=paths['templates'] + plugin_mgr.template_loaders(),
         auto_reload=True,
-        max_cache_size=100,
+        max_cache_size=300,
         callback=enable_i18n_for_template,
+        compiled_dir=compiled_dir,
     )
 
     # Setup the SQLAlchemy database engine
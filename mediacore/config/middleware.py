@@ -14,11 +14,13 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 """Pylons middleware initialization"""
+import logging
 import os
 
 from beaker.middleware import SessionMiddleware
 from genshi.template import loader
 from genshi.template.plugin import MarkupTemplateEnginePlugin
+from pkg_resources import resource_listdir
 from paste import gzipper
 from paste.cascade import Cascade
 from paste.registry import RegistryManager
@@ -36,8 +38,24 @@ import tw.api
 from mediacore import monkeypatch_method
 from mediacore.config.environment import load_environment
 from mediacore.lib.auth import add_auth
+from mediacore.lib.cache_tags import cache_tags
+from mediacore.lib.count_cache import count_cache
+from mediacore.lib.counters import media_counters
+from mediacore.lib.page_cache import PageCacheMiddleware, page_cache
+from mediacore.lib.player_cache import player_cache
+from mediacore.lib.related import related_media
+from mediacore.lib.scheduler import PeriodicTask, publication_scheduler
+from mediacore.lib.search import get_backends, update_search_indexes
+from mediacore.lib.templating import find_templates, precompile_templates
+from mediacore.lib.uri import uri_cache
+from mediacore.lib.xhtml import clean_cache
+from mediacore.model import meta
+from mediacore.model.media import recalculate_popularity
+from mediacore.model.players import enabled_players
 from mediacore.model.meta import DBSession
 
+log = logging.getLogger(__name__)
+
 def setup_prefix_middleware(app, global_conf, proxy_prefix):
     """Add prefix middleware.
 
@@ -120,6 +138,39 @@ def setup_tw_middleware(app, config):
     })
     return app
 
+def precompile_app_templates(config):
+    """Parse all core, plugin and ToscaWidgets templates.
+
+    Workers forked after this share the parsed templates, so the first
+    requests they serve aren't slowed down by parsing.
+
+    :rtype: int
+    :returns: The number of templates loaded.
+    """
+    app_globs = config['pylons.app_globals']
+    plugin_mgr = app_globs.plugin_mgr
+    templates = []
+    for templates_dir in config['pylons.paths']['templates']:
+        for template in find_templates(templates_dir):
+            templates.append(template)
+            # Find the plugin templates that extend this one, too
+            templates.extend(plugin_mgr.match_templates(template))
+    for name, plugin in plugin_mgr.plugins.iteritems():
+        if plugin.templates_path:
+            templates.extend(os.path.sep + os.path.join(name, template)
+                             for template
+                             in find_templates(plugin.templates_path))
+    templates.extend('tw.forms.templates.' + filename[:-len('.html')]
+                     for filename
+                     in resource_listdir('tw.forms', 'templates')
+                     if filename.endswith('.html'))
+    # Core templates may be extended by more than one plugin
+    unique = []
+    for template in templates:
+        if template not in unique:
+            unique.append(template)
+    return precompile_templates(app_globs.genshi_loader, unique)
+
 def setup_gzip_middleware(app, global_conf):
     """Make paste.gzipper middleware with a monkeypatch to exempt SWFs.
 
@@ -148,6 +199,12 @@ def setup_gzip_middleware(app, global_conf):
         return self.buffer.write
     return gzipper.make_gzip_middleware(app, global_conf)
 
+popularity_task = PeriodicTask('PopularityRecalculation',
+                               recalculate_popularity)
+related_media_task = PeriodicTask('RelatedMediaUpdate',
+                                  related_media.update_queued)
+search_index_task = PeriodicTask('SearchIndexUpdate', update_search_indexes)
+
 def make_app(global_conf, full_stack=True, static_files=True, **app_conf):
     """Create a Pylons WSGI application and return it
 
@@ -175,6 +232,64 @@ def make_app(global_conf, full_stack=True, static_files=True, **app_conf):
     config = load_environment(global_conf, app_conf)
     plugin_mgr = config['pylons.app_globals'].plugin_mgr
 
+    # Flip the published state of media as their publish dates are reached
+    if asbool(config.get('publication_scheduler', 'true')):
+        publication_scheduler.start(meta.engine,
+            config.get('publication_scheduler_interval', 60))
+
+    # Share the counts of paginated listings between all workers
+    if asbool(config.get('count_cache', 'true')):
+        count_cache.configure(config['pylons.app_globals'].cache,
+            type=config.get('count_cache_type', 'file'),
+            expire=config.get('count_cache_expire', 60))
+
+    # Rebuild cached feeds when the rows they were built from change
+    if asbool(config.get('cache_tags', 'true')):
+        cache_tags.configure(config['pylons.app_globals'].cache,
+            type=config.get('cache_tags_type', 'file'))
+
+    # Reload the enabled players in every worker when they're changed
+    enabled_players.configure(
+        os.path.join(config['app_conf']['cache_dir'], 'players.version'),
+        config.get('settings_check_interval', 1))
+
+    # Share rendered players between all workers
+    if asbool(config.get('player_cache', 'true')):
+        player_cache.configure(config['pylons.app_globals'].cache,
+            type=config.get('player_cache_type', 'file'),
+            expire=config.get('player_cache_expire', 3600))
+
+    # Remember the playback URIs of recently rendered files
+    uri_cache.configure(config.get('uri_cache_size', 10000))
+
+    # Remember recently sanitized descriptions and comments
+    clean_cache.configure(config.get('clean_cache_size', 1000))
+
+    # Buffer view/like/dislike counts and write them in bulk
+    if asbool(config.get('counters_buffered', 'true')):
+        media_counters.start(meta.engine,
+            spill_dir=os.path.join(config['app_conf']['cache_dir'], 'counters'),
+            flush_interval=config.get('counters_flush_interval', 10),
+            flush_threshold=config.get('counters_flush_threshold', 1000))
+
+    # Recalculate the decaying popularity scores of all media
+    popularity_interval = int(config.get('popularity_recalculation_interval', 0))
+    if popularity_interval > 0:
+        popularity_task.start(meta.engine, popularity_interval,
+            lock_path=os.path.join(config['app_conf']['cache_dir'],
+                                   'popularity.lock'))
+
+    # Update the related media of media saved by this process
+    related_media_interval = int(config.get('related_media_interval', 10))
+    if related_media_interval > 0:
+        related_media_task.start(meta.engine, related_media_interval)
+
+    # Configure the search backends and update their indexes as media change
+    get_backends(config)
+    search_index_interval = int(config.get('search_index_interval', 10))
+    if search_index_interval > 0:
+        search_index_task.start(meta.engine, search_index_interval)
+
     # The Pylons WSGI app
     app = PylonsApp(config=config)
 
@@ -194,6 +309,11 @@ def make_app(global_conf, full_stack=True, static_files=True, **app_conf):
     # ToscaWidgets Middleware
     app = setup_tw_middleware(app, config)
 
+    # Parse all templates now, rather than on the first request for each
+    if asbool(config.get('templates_precompile', 'false')):
+        log.info('Precompiled %d templates',
+                 precompile_app_templates(config))
+
     # Strip the name of the .fcgi script, if using one, from the SCRIPT_NAME
     app = FastCGIScriptStripperMiddleware(app)
 
@@ -221,6 +341,15 @@ def make_app(global_conf, full_stack=True, static_files=True, **app_conf):
     # Establish the Registry for this application
     app = RegistryManager(app)
 
+    # Answer anonymous requests for cacheable pages without the controllers
+    if asbool(config.get('page_cache', 'false')):
+        page_cache.configure(config['pylons.app_globals'].cache,
+            type=config.get('page_cache_type', 'file'),
+            expire=config.get('page_cache_expire', 300),
+            bypass_cookies=[config.get('beaker.session.key',
+                                       'beaker.session.id')])
+        app = PageCacheMiddleware(app, page_cache)
+
     if asbool(static_files):
         # Serve static files from our public directory
         public_app = StaticURLParser(config['pylons.paths']['static_files'])
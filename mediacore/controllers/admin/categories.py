@@ -15,7 +15,7 @@
 
 from pylons import request, response, session, tmpl_context
 from repoze.what.predicates import has_permission
-from sqlalchemy import orm, sql
+from sqlalchemy import sql
 
 from mediacore.forms.admin.categories import CategoryForm, CategoryRowForm
 from mediacore.forms.admin.tags import TagForm, TagRowForm
@@ -53,7 +53,6 @@ class CategoriesController(BaseController):
         """
         categories = Category.query\
             .order_by(Category.name)\
-            .options(orm.undefer('media_count'))\
             .populated_tree()
 
         return dict(
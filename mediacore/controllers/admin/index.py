@@ -13,12 +13,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import webhelpers.paginate
 
 from pylons import request, response, session, tmpl_context
 from repoze.what.predicates import has_permission
 
 from mediacore.lib.base import BaseController
+from mediacore.lib.cache_stats import cache_stats
 from mediacore.lib.decorators import expose, expose_xhr, observable, paginate, validate
 from mediacore.lib.helpers import redirect, url_for
 from mediacore.model import Comment, Media, fetch_row
@@ -113,3 +115,21 @@ class IndexController(BaseController):
             query = query.filter_by(reviewed=True, encoded=True, publishable=False)
 
         return webhelpers.paginate.Page(query, page, items_per_page)
+
+    @expose('json', permission='admin')
+    def cache_stats(self, **kwargs):
+        """Return the cache counters of the worker process serving the request.
+
+        :rtype: JSON dict
+        :returns:
+            pid
+                The process ID of the worker.
+            caches
+                A dict of cache names to dicts of hit, miss, stale and
+                regeneration counts.
+
+        """
+        return dict(
+            pid = os.getpid(),
+            caches = cache_stats.snapshot(),
+        )
@@ -23,7 +23,6 @@ from itertools import izip
 from formencode import Invalid, validators
 from pylons import config, request, response, session, tmpl_context
 from repoze.what.predicates import has_permission
-from sqlalchemy import orm
 
 from mediacore.forms.admin import SearchForm, ThumbForm
 from mediacore.forms.admin.media import AddFileForm, EditFileForm, MediaForm, UpdateStatusForm
@@ -35,7 +34,7 @@ from mediacore.lib.helpers import redirect, url_for
 from mediacore.lib.i18n import _
 from mediacore.lib.storage import add_new_media_file
 from mediacore.lib.templating import render
-from mediacore.lib.thumbnails import thumb_path, thumb_paths, create_thumbs_for, create_default_thumbs_for, has_thumbs, has_default_thumbs
+from mediacore.lib.thumbnails import thumb_path, thumb_paths, create_thumbs_for, create_default_thumbs_for, has_thumbs, has_default_thumbs, owned_thumb_paths
 from mediacore.model import Author, Category, Media, Podcast, Tag, fetch_row, get_available_slug
 from mediacore.model.meta import DBSession
 from mediacore.plugin import events
@@ -79,7 +78,7 @@ class MediaController(BaseController):
                 The podcast object for rendering if filtering by podcast.
 
         """
-        media = Media.query.options(orm.undefer('comment_count_published'))
+        media = Media.query
 
         if search:
             media = media.admin_search(search)
@@ -481,10 +480,15 @@ class MediaController(BaseController):
         elif input.slug.startswith('_stub_') \
         and has_default_thumbs(orig) \
         and not has_default_thumbs(input):
-            for key, dst_path in thumb_paths(orig).iteritems():
-                src_path = thumb_path(input, key)
-                # This will raise an OSError on Windows, but not *nix
-                os.rename(src_path, dst_path)
+            if input.thumb_name is not None:
+                # The thumbs are named after their hash, so simply share them
+                orig.thumb_name = input.thumb_name
+            else:
+                orig.thumb_name = None
+                for key, dst_path in thumb_paths(orig).iteritems():
+                    src_path = thumb_path(input, key)
+                    # This will raise an OSError on Windows, but not *nix
+                    os.rename(src_path, dst_path)
             DBSession.delete(input)
 
         # Report an error
@@ -704,5 +708,5 @@ class MediaController(BaseController):
         DBSession.delete(media)
         DBSession.flush()
         # Cleanup the thumbnails
-        thumbs = thumb_paths(media).values()
+        thumbs = owned_thumb_paths(media)
         helpers.delete_files(thumbs, Media._thumb_dir)
@@ -28,7 +28,7 @@ from mediacore.lib.decorators import (autocommit, expose, expose_xhr,
     observable, paginate, validate)
 from mediacore.lib.helpers import redirect, url_for
 from mediacore.lib.i18n import _
-from mediacore.lib.thumbnails import thumb_paths, create_thumbs_for, create_default_thumbs_for
+from mediacore.lib.thumbnails import create_thumbs_for, create_default_thumbs_for, owned_thumb_paths
 from mediacore.model import Author, AuthorWithIP, Podcast, fetch_row, get_available_slug
 from mediacore.model.meta import DBSession
 from mediacore.plugin import events
@@ -148,7 +148,7 @@ class PodcastsController(BaseController):
         podcast = fetch_row(Podcast, id)
 
         if delete:
-            file_paths = thumb_paths(podcast).values()
+            file_paths = owned_thumb_paths(podcast)
             DBSession.delete(podcast)
             DBSession.commit()
             helpers.delete_files(file_paths, Podcast._thumb_dir)
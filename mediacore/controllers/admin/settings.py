@@ -29,12 +29,15 @@ from mediacore.forms.admin.settings import (AdvertisingForm, AppearanceForm,
     APIForm, AnalyticsForm, CommentsForm, GeneralForm, NotificationsForm,
     PopularityForm, SiteMapsForm, UploadForm)
 from mediacore.lib.base import BaseSettingsController
+from mediacore.lib.cache_tags import cache_tags
 from mediacore.lib.decorators import (autocommit, expose, expose_xhr,
     paginate, validate)
-from mediacore.lib.helpers import filter_vulgarity, redirect, url_for
+from mediacore.lib.helpers import redirect, url_for
 from mediacore.lib.i18n import LanguageError, Translator
 from mediacore.lib.templating import render
-from mediacore.model import Comment, Media, MultiSetting, Setting, fetch_row
+from mediacore.lib.vulgarity import get_vulgarity_filter
+from mediacore.model import Media, MultiSetting, Setting, fetch_row
+from mediacore.model.comments import rescan_comments
 from mediacore.model.meta import DBSession
 from mediacore.websetup import appearance_settings, generate_appearance_css
 
@@ -109,9 +112,13 @@ class SettingsController(BaseSettingsController):
         self._save(comments_form, values=kwargs)
 
         # Run the filter now if it has changed
-        if old_vulgarity_filter != c.settings['vulgarity_filtered_words'].value:
-            for comment in DBSession.query(Comment):
-                comment.body = filter_vulgarity(comment.body)
+        new_vulgarity_filter = c.settings['vulgarity_filtered_words'].value
+        if new_vulgarity_filter \
+        and old_vulgarity_filter != new_vulgarity_filter:
+            media_ids = rescan_comments(DBSession.connection(),
+                get_vulgarity_filter(new_vulgarity_filter))
+            cache_tags.invalidate(*['media:%d' % media_id
+                                    for media_id in media_ids])
 
         redirect(action='comments')
 
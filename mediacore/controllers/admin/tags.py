@@ -17,7 +17,7 @@ import tw.forms.fields
 
 from pylons import request, response, session, tmpl_context
 from repoze.what.predicates import has_permission
-from sqlalchemy import orm, sql
+from sqlalchemy import sql
 
 from mediacore.forms.admin.tags import TagForm, TagRowForm
 from mediacore.lib import helpers
@@ -56,7 +56,6 @@ class TagsController(BaseController):
 
         """
         tags = DBSession.query(Tag)\
-            .options(orm.undefer('media_count'))\
             .order_by(Tag.name)
 
         return dict(
@@ -21,9 +21,13 @@ class APIException(Exception):
     TODO: Actually display these messages!!
     """
 
-def get_order_by(order, columns):
-    """ Discover the order by passed in """
+def parse_order(order, columns):
+    """Split the order passed in into a column name and direction.
 
+    :raises APIException: If the order is malformed or not allowed.
+    :rtype: tuple
+    :returns: The column name, and 'asc' or 'desc'.
+    """
     # Split the order into two parts, column and direction
     if not order:
         order_col, order_dir = 'publish_on', 'desc'
@@ -34,11 +38,16 @@ def get_order_by(order, columns):
         except:
             raise APIException, 'Invalid order format, must be "column asc/desc", given "%s"' % order
 
-    # Get the order clause for the given column name
-    try:
-        order_attr = columns[order_col]
-    except KeyError:
+    if order_col not in columns:
         raise APIException, 'Not allowed to order by "%s", please pick one of %s' % (order_col, ', '.join(columns.keys()))
+    return order_col, order_dir
+
+def get_order_by(order, columns):
+    """ Discover the order by passed in """
+    order_col, order_dir = parse_order(order, columns)
+
+    # Get the order clause for the given column name
+    order_attr = columns[order_col]
 
     # Normalize to something that can be used in a query
     if isinstance(order_attr, basestring):
@@ -28,6 +28,7 @@ from mediacore.lib.decorators import expose
 from mediacore.lib.helpers import get_featured_category, url_for
 from mediacore.lib.thumbnails import thumb
 from mediacore.model import Category
+from mediacore.model.categories import populate_descendants
 from mediacore.model.meta import DBSession
 
 log = logging.getLogger(__name__)
@@ -36,7 +37,7 @@ order_columns = {
     'id': Category.id,
     'name': Category.name,
     'slug': Category.slug,
-    'media_count': 'media_count %s',
+    'media_count': Category.media_count_published,
 }
 
 class CategoriesController(BaseController):
@@ -170,7 +171,10 @@ class CategoriesController(BaseController):
         count = query.count()
 
         query = query.offset(start).limit(limit)
-        categories = self._expand(query.all(), asbool(tree), depth)
+        categories = query.all()
+        if asbool(tree):
+            populate_descendants(categories, depth)
+        categories = self._expand(categories, asbool(tree), depth)
 
         return dict(
            categories = categories,
@@ -194,6 +198,9 @@ class CategoriesController(BaseController):
         except (orm.exc.NoResultFound, orm.exc.MultipleResultsFound):
             return dict(error='No Match found')
 
+        if tree:
+            populate_descendants([category], depth)
+
         return dict(
             category = self._expand(category, tree, depth=depth),
         )
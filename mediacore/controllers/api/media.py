@@ -20,11 +20,13 @@ from paste.util.converters import asbool
 from pylons import app_globals, config, request, response, session, tmpl_context
 from sqlalchemy import orm, sql
 
-from mediacore.controllers.api import APIException, get_order_by
+from mediacore.controllers.api import APIException, get_order_by, parse_order
 from mediacore.lib import helpers
 from mediacore.lib.base import BaseController
+from mediacore.lib.count_cache import count_cache
 from mediacore.lib.decorators import expose, expose_xhr, observable, paginate, validate
 from mediacore.lib.helpers import get_featured_category, url_for
+from mediacore.lib.paginate import KeysetPage, cursor_for
 from mediacore.lib.thumbnails import thumb
 from mediacore.model import Category, Media, Podcast, Tag, fetch_row, get_available_slug
 from mediacore.model.meta import DBSession
@@ -43,9 +45,16 @@ order_columns = {
     'popularity': Media.popularity_points,
     'description': Media.description,
     'description_plain': Media.description_plain,
-    'comment_count': 'comment_count_published %s'
+    'comment_count': Media.comment_count_published,
 }
 
+cursor_columns = ('id', 'slug', 'publish_on', 'duration', 'views', 'likes',
+                  'popularity', 'comment_count')
+"""The order columns that results can be paged through by cursor.
+
+These are never NULL for published media, so they can be compared.
+"""
+
 AUTHERROR = "Authentication Error"
 INVALIDFORMATERROR = "Invalid format (%s). Only json and mrss are supported"
 
@@ -59,7 +68,8 @@ class MediaController(BaseController):
     def index(self, type=None, podcast=None, tag=None, category=None, search=None,
               max_age=None, min_age=None, order=None, offset=0, limit=10,
               published_after=None, published_before=None, featured=False,
-              id=None, slug=None, include_embed=False, api_key=None, format="json", **kwargs):
+              id=None, slug=None, related=None, include_embed=False, api_key=None, format="json",
+              cursor=None, count=None, **kwargs):
         """Query for a list of media.
 
         :param type:
@@ -111,9 +121,23 @@ class MediaController(BaseController):
             Where in the complete resultset to start returning results.
             Defaults to 0, the very beginning. This is useful if you've
             already fetched the first 50 results and want to fetch the
-            next 50 and so on.
+            next 50 and so on. Deep offsets are slow, use cursors
+            instead when crawling many results.
         :type offset: int
 
+        :param cursor:
+            The next_cursor returned with the previous results, or an
+            empty string to start at the beginning. When given, the
+            offset is ignored and each page takes the same time to
+            fetch no matter how deep it is. Cursors can't be used with
+            search or related, or when ordering by the description.
+        :type cursor: unicode or None
+
+        :param count:
+            If nonzero, the total number of results is counted. Defaults
+            to true unless a cursor is given.
+        :type count: bool
+
         :param limit:
             Number of results to return in each query. Defaults to 10.
             The maximum allowed value defaults to 50 and is set via
@@ -140,6 +164,11 @@ class MediaController(BaseController):
             Note that we still return a list.
         :type slug: unicode or None
 
+        :param related:
+            A media slug. If given, only the media most related to it are
+            returned, most similar first. This supercedes the order.
+        :type related: unicode or None
+
         :param api_key:
             The api access key if required in settings
         :type api_key: unicode or None
@@ -152,6 +181,12 @@ class MediaController(BaseController):
 
             count (int)
                 The total number of results that match this query.
+                Only included if counting was requested, or by default
+                when no cursor was given.
+            next_cursor (unicode or None)
+                The cursor for fetching the next results, or None if
+                there are no more, or the results can't be paged by
+                cursor.
             media (list of dicts)
                 A list of **media_info** dicts, as generated by the
                 :meth:`_info <mediacore.controllers.api.media.MediaController._info>`
@@ -170,9 +205,7 @@ class MediaController(BaseController):
         if format not in ("json", "mrss"):
             return dict(error= INVALIDFORMATERROR % format)
 
-        query = Media.query\
-            .published()\
-            .options(orm.undefer('comment_count_published'))
+        query = Media.query.published()
 
         # Basic filters
         if id:
@@ -212,10 +245,25 @@ class MediaController(BaseController):
 
         query = query.order_by(get_order_by(order, order_columns))
 
+        # Ties are broken by ID so that results can be paged through by
+        # cursor, which requires a stable order on columns that aren't NULL
+        sort_keys = None
+        if not search and not related:
+            order_col, order_dir = parse_order(order, order_columns)
+            if order_col in cursor_columns:
+                sort_keys = [(order_columns[order_col], order_dir)]
+                if order_col != 'id':
+                    sort_keys.append((Media.id, order_dir))
+                    query = query.order_by(getattr(Media.id, order_dir)())
+
         # Search will supercede the ordering above
         if search:
             query = query.search(search)
 
+        if related:
+            related = fetch_row(Media, slug=related)
+            query = query.related(related)
+
         if featured:
             featured_cat = get_featured_category()
             if featured_cat:
@@ -224,23 +272,44 @@ class MediaController(BaseController):
         # Preload podcast slugs so we don't do n+1 queries
         podcast_slugs = dict(DBSession.query(Podcast.id, Podcast.slug))
 
-        # Rudimentary pagination support
-        start = int(offset)
-        end = start + min(int(limit), int(app_globals.settings['api_media_max_results']))
+        limit = min(int(limit), int(app_globals.settings['api_media_max_results']))
+
+        if cursor is not None:
+            if sort_keys is None:
+                raise APIException, 'Cursors can only be used when ordering by one of %s, and not with search or related' % ', '.join(cursor_columns)
+            try:
+                results = KeysetPage(query, sort_keys, cursor, items_per_page=limit)
+            except ValueError:
+                raise APIException, 'Invalid cursor "%s"' % cursor
+            next_cursor = results.next_cursor
+        else:
+            # Fetch one extra item to find out if there's a next page
+            start = int(offset)
+            results = query[start:start + limit + 1]
+            next_cursor = None
+            if sort_keys and len(results) > limit:
+                next_cursor = cursor_for(results[limit - 1], sort_keys)
+            results = results[:limit]
 
         if format == "mrss":
             request.override_template = "sitemaps/mrss.xml"
             return dict(
-                media = query[start:end],
+                media = results,
                 title = "Media Feed",
             )
 
-        media = [self._info(m, podcast_slugs, include_embed) for m in query[start:end]]
+        media = [self._info(m, podcast_slugs, include_embed) for m in results]
 
-        return dict(
+        data = dict(
             media = media,
-            count = query.count(),
+            next_cursor = next_cursor,
         )
+        if (count is None and cursor is None) or asbool(count):
+            if search or related:
+                data['count'] = query.count()
+            else:
+                data['count'] = count_cache.count(query)
+        return data
 
 
     @expose('json')
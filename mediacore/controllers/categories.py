@@ -16,12 +16,14 @@ from paste.util import mimeparse
 from pylons import (app_globals, config, request, response, session,
     tmpl_context as c)
 from pylons.controllers.util import abort
-from sqlalchemy import orm, sql
+from sqlalchemy import sql
 
 from mediacore.lib.base import BaseController
-from mediacore.lib.decorators import (beaker_cache, expose, expose_xhr,
-    observable, paginate, validate)
-from mediacore.lib.helpers import redirect, url_for
+from mediacore.lib.cache_tags import cache_tags
+from mediacore.lib.count_cache import count_cache
+from mediacore.lib.decorators import (beaker_cache, cache_page, expose,
+    expose_xhr, observable, paginate, validate)
+from mediacore.lib.helpers import library_sort_keys, redirect, url_for
 from mediacore.model import Category, Media, Podcast, fetch_row
 from mediacore.model.meta import DBSession
 from mediacore.plugin import events
@@ -45,17 +47,21 @@ class CategoriesController(BaseController):
 
         c.categories = Category.query\
             .order_by(Category.name)\
-            .options(orm.undefer('media_count_published'))\
             .populated_tree()
 
         counts = dict((cat.id, cat.media_count_published)
                       for cat, depth in c.categories.traverse())
         c.category_counts = counts.copy()
+        # The tree is already loaded, so track the ancestors as we go
+        # rather than looking them up for each category.
+        path = []
         for cat, depth in c.categories.traverse():
+            del path[depth:]
             count = counts[cat.id]
             if count:
-                for ancestor in cat.ancestors():
+                for ancestor in path:
                     c.category_counts[ancestor.id] += count
+            path.append(cat)
 
         category_slug = request.environ['pylons.routes_dict'].get('slug', None)
         if category_slug:
@@ -64,11 +70,13 @@ class CategoriesController(BaseController):
             c.breadcrumb.append(c.category)
 
     @expose('categories/index.html')
+    @cache_page(tags=['catalog'])
     @observable(events.CategoriesController.index)
     def index(self, slug=None, **kwargs):
         media = Media.query.published()
 
         if c.category:
+            cache_tags.depend_on('category:%d' % c.category.id)
             media = media.in_category(c.category)
 
         latest = media.order_by(Media.publish_on.desc())
@@ -83,7 +91,8 @@ class CategoriesController(BaseController):
         )
 
     @expose('categories/more.html')
-    @paginate('media', items_per_page=20)
+    @paginate('media', items_per_page=20, keyset='sort_keys',
+              item_count='result_count')
     @observable(events.CategoriesController.more)
     def more(self, slug, order, page=1, **kwargs):
         media = Media.query.published()\
@@ -91,15 +100,19 @@ class CategoriesController(BaseController):
 
         if order == 'latest':
             media = media.order_by(Media.publish_on.desc())
+            sort_keys = library_sort_keys('latest')
         else:
             media = media.order_by(Media.popularity_points.desc())
+            sort_keys = library_sort_keys('popular')
 
         return dict(
             media = media,
             order = order,
+            result_count = count_cache.count(media),
+            sort_keys = sort_keys,
         )
 
-    @beaker_cache(expire=60 * 3, query_args=True)
+    @beaker_cache(expire=60 * 60 * 24, query_args=True)
     @expose('sitemaps/mrss.xml')
     def feed(self, limit=30, **kwargs):
         """ Generate a media rss feed of the latest media
@@ -118,6 +131,7 @@ class CategoriesController(BaseController):
         media = Media.query.published()
 
         if c.category:
+            cache_tags.depend_on('category:%d' % c.category.id)
             media = media.in_category(c.category)
 
         media = media.order_by(Media.publish_on.desc()).limit(limit)
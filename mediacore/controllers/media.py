@@ -27,18 +27,21 @@ from paste.fileapp import FileApp
 from paste.util import mimeparse
 from pylons import app_globals, config, request, response
 from pylons.controllers.util import forward
-from sqlalchemy import orm, sql
 from webob.exc import HTTPNotAcceptable, HTTPNotFound
 
 from mediacore import USER_AGENT
 from mediacore.forms.comments import PostCommentSchema
 from mediacore.lib import helpers
 from mediacore.lib.base import BaseController
-from mediacore.lib.decorators import expose, expose_xhr, observable, paginate, validate, validate_xhr, autocommit
+from mediacore.lib.cache_tags import cache_tags
+from mediacore.lib.count_cache import count_cache
+from mediacore.lib.decorators import expose, expose_xhr, observable, paginate, validate, validate_xhr, autocommit, cache_page
 from mediacore.lib.email import send_comment_notification
 from mediacore.lib.helpers import (file_path, filter_vulgarity, redirect,
     store_transient_message, url_for)
 from mediacore.lib.i18n import _
+from mediacore.lib.page_cache import page_cache
+from mediacore.lib.random_media import random_media
 from mediacore.lib.templating import render
 from mediacore.model import (DBSession, fetch_row, get_available_slug,
     Media, MediaFile, Comment, Tag, Category, Author, AuthorWithIP, Podcast)
@@ -54,15 +57,19 @@ class MediaController(BaseController):
     """
 
     @expose('media/index.html')
-    @paginate('media', items_per_page=10)
+    @cache_page(tags=['catalog'])
+    @paginate('media', items_per_page=10, keyset='sort_keys',
+              item_count='result_count')
     @observable(events.MediaController.index)
     def index(self, page=1, show='latest', q=None, tag=None, **kwargs):
         """List media with pagination.
 
         The media paginator may be accessed in the template with
-        :attr:`c.paginators.media`, see :class:`webhelpers.paginate.Page`.
+        :attr:`c.paginators.media`, see :class:`webhelpers.paginate.Page`
+        and :class:`mediacore.lib.paginate.KeysetPage`.
 
-        :param page: Page number, defaults to 1.
+        :param page: Page number. Pages are fetched by cursor instead
+            when a ``cursor`` is given, unless searching.
         :type page: int
         :param show: 'latest', 'popular' or 'featured'
         :type show: unicode or None
@@ -79,6 +86,8 @@ class MediaController(BaseController):
                 The total number of media items for this query
             search_query
                 The query the user searched for, if any
+            sort_keys
+                The sort keys for cursor pagination, if possible
 
         """
         media = Media.query.published()
@@ -92,25 +101,32 @@ class MediaController(BaseController):
             tag = fetch_row(Tag, slug=tag)
             media = media.filter(Media.tags.contains(tag))
 
+        # Searches are too varied to be worth caching
+        if q:
+            result_count = media.count()
+        else:
+            result_count = count_cache.count(media)
+
         return dict(
             media = media,
-            result_count = media.count(),
+            result_count = result_count,
             search_query = q,
             show = show,
             tag = tag,
+            sort_keys = not q and helpers.library_sort_keys(show) or None,
         )
 
     @expose('media/tags.html')
     def tags(self, **kwargs):
         """Display a listing of all tags."""
         tags = Tag.query\
-            .options(orm.undefer('media_count_published'))\
             .filter(Tag.media_count_published > 0)
         return dict(
             tags = tags,
         )
 
     @expose('media/explore.html')
+    @cache_page(tags=['catalog'])
     @observable(events.MediaController.explore)
     def explore(self, page=1, **kwargs):
         """Display the most recent 15 media.
@@ -146,13 +162,20 @@ class MediaController(BaseController):
         )
 
     @expose()
-    def random(self, **kwargs):
-        """Redirect to a randomly selected media item."""
-        # TODO: Implement something more efficient than ORDER BY RAND().
-        #       This method does a full table scan every time.
-        media = Media.query.published()\
-            .order_by(sql.func.random())\
-            .first()
+    def random(self, category=None, tag=None, **kwargs):
+        """Redirect to a randomly selected media item.
+
+        :param category: An optional category slug to pick from.
+        :type category: unicode or None
+        :param tag: An optional tag slug to pick from.
+        :type tag: unicode or None
+
+        """
+        if category:
+            category = fetch_row(Category, slug=category)
+        if tag:
+            tag = fetch_row(Tag, slug=tag)
+        media = random_media.pick(category or None, tag or None)
         if media is None:
             redirect(action='explore')
         if media.podcast_id:
@@ -162,6 +185,7 @@ class MediaController(BaseController):
         redirect(action='view', slug=media.slug, podcast_slug=podcast_slug)
 
     @expose('media/view.html')
+    @cache_page()
     @autocommit
     @observable(events.MediaController.view)
     def view(self, slug, podcast_slug=None, **kwargs):
@@ -197,6 +221,8 @@ class MediaController(BaseController):
                 redirect(podcast_slug=media.podcast.slug)
 
         media.increment_views()
+        page_cache.increment_on_hit(media.id, 'views')
+        cache_tags.depend_on('media:%d' % media.id)
 
         # Which style of 'likes' links has the admin selected?
         # TODO: Add settings to control these options.
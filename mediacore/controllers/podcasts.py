@@ -21,8 +21,10 @@ import pylons.templating
 
 from mediacore.lib import helpers
 from mediacore.lib.base import BaseController
-from mediacore.lib.decorators import (beaker_cache, expose, expose_xhr,
-    observable, paginate, validate)
+from mediacore.lib.cache_tags import cache_tags
+from mediacore.lib.count_cache import count_cache
+from mediacore.lib.decorators import (beaker_cache, cache_page, expose,
+    expose_xhr, observable, paginate, validate)
 from mediacore.lib.helpers import redirect
 from mediacore.model import Category, Media, Podcast, fetch_row
 from mediacore.model.meta import DBSession
@@ -75,7 +77,9 @@ class PodcastsController(BaseController):
 
 
     @expose('podcasts/view.html')
-    @paginate('episodes', items_per_page=10)
+    @cache_page(tags=['podcasts'])
+    @paginate('episodes', items_per_page=10, keyset='sort_keys',
+              item_count='result_count')
     @observable(events.PodcastsController.view)
     def view(self, slug, page=1, show='latest', **kwargs):
         """View a podcast and the media that belongs to it.
@@ -92,9 +96,12 @@ class PodcastsController(BaseController):
                 that belong to the ``podcast``.
             podcasts
                 A list of all the other podcasts
+            sort_keys
+                The sort keys for cursor pagination, if possible
 
         """
         podcast = fetch_row(Podcast, slug=slug)
+        cache_tags.depend_on('podcast:%d' % podcast.id)
         episodes = podcast.media.published()
 
         episodes, show = helpers.filter_library_controls(episodes, show)
@@ -102,11 +109,12 @@ class PodcastsController(BaseController):
         return dict(
             podcast = podcast,
             episodes = episodes,
-            result_count = episodes.count(),
+            result_count = count_cache.count(episodes),
             show = show,
+            sort_keys = helpers.library_sort_keys(show),
         )
 
-    @beaker_cache(expire=60 * 20, query_args=True)
+    @beaker_cache(expire=60 * 60 * 24, query_args=True)
     @expose('podcasts/feed.xml')
     @observable(events.PodcastsController.feed)
     def feed(self, slug, **kwargs):
@@ -130,6 +138,7 @@ class PodcastsController(BaseController):
 
         """
         podcast = fetch_row(Podcast, slug=slug)
+        cache_tags.depend_on('podcast:%d' % podcast.id)
 
         if (podcast.feedburner_url
             and not 'feedburner' in request.environ.get('HTTP_USER_AGENT', '').lower()
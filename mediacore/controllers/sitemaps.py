@@ -27,6 +27,8 @@ from pylons.controllers.util import abort, forward
 from webob.exc import HTTPNotFound
 
 from mediacore.lib.base import BaseController
+from mediacore.lib.cache_tags import cache_tags
+from mediacore.lib.count_cache import count_cache
 from mediacore.lib.decorators import expose, beaker_cache
 from mediacore.lib.helpers import get_featured_category, redirect, url_for
 from mediacore.model import Media
@@ -42,7 +44,8 @@ class SitemapsController(BaseController):
     Sitemap generation
     """
 
-    @beaker_cache(expire=60 * 60 * 4, query_args=True)
+    @beaker_cache(expire=60 * 60 * 24, query_args=True, tags=['catalog'],
+                  refresh_ahead=60 * 10)
     @expose('sitemaps/google.xml')
     def google(self, page=None, limit=10000, **kwargs):
         """Generate a sitemap which contains googles Video Sitemap information.
@@ -66,10 +69,12 @@ class SitemapsController(BaseController):
         )
 
         media = Media.query.published()
+        limit = int(limit)
 
         if page is None:
-            if media.count() > limit:
-                return dict(pages=math.ceil(media.count() / float(limit)))
+            count = count_cache.count(media)
+            if count > limit:
+                return dict(pages=math.ceil(count / float(limit)))
         else:
             page = int(page)
             media = media.offset(page * limit).limit(limit)
@@ -90,7 +95,8 @@ class SitemapsController(BaseController):
             links = links,
         )
 
-    @beaker_cache(expire=60 * 60, query_args=True)
+    @beaker_cache(expire=60 * 60 * 24, query_args=True, tags=['catalog'],
+                  refresh_ahead=60 * 10)
     @expose('sitemaps/mrss.xml')
     def mrss(self, **kwargs):
         """Generate a media rss (mRSS) feed of all the sites media."""
@@ -109,7 +115,8 @@ class SitemapsController(BaseController):
             title = 'MediaRSS Sitemap',
         )
 
-    @beaker_cache(expire=60 * 3, query_args=True)
+    @beaker_cache(expire=60 * 60 * 24, query_args=True, tags=['catalog'],
+                  refresh_ahead=60 * 10)
     @expose('sitemaps/mrss.xml')
     def latest(self, limit=30, skip=0, **kwargs):
         """Generate a media rss (mRSS) feed of all the sites media."""
@@ -133,7 +140,7 @@ class SitemapsController(BaseController):
             title = 'Latest Media',
         )
 
-    @beaker_cache(expire=60 * 3, query_args=True)
+    @beaker_cache(expire=60 * 60 * 24, query_args=True)
     @expose('sitemaps/mrss.xml')
     def featured(self, limit=30, skip=0, **kwargs):
         """Generate a media rss (mRSS) feed of the sites featured media."""
@@ -145,7 +152,11 @@ class SitemapsController(BaseController):
             request.environ.get('HTTP_ACCEPT', '*/*')
         )
 
-        media = Media.query.in_category(get_featured_category())\
+        featured_category = get_featured_category()
+        if featured_category:
+            cache_tags.depend_on('category:%d' % featured_category.id)
+
+        media = Media.query.in_category(featured_category)\
             .order_by(Media.publish_on.desc())\
             .limit(limit)
 
@@ -1,8 +1,17 @@
 """The application's Globals object"""
 
+import os
+
 from beaker.cache import CacheManager
 from beaker.util import parse_cache_config_options
 
+from mediacore.lib.versioned_cache import VersionedCache
+
+def fetch_settings():
+    """Return a dict of all the settings from the database."""
+    from mediacore.model import DBSession, Setting
+    return dict(DBSession.query(Setting.key, Setting.value))
+
 class Globals(object):
     """Globals acts as a container for objects available throughout the
     life of the application
@@ -14,19 +23,15 @@ class Globals(object):
         'app_globals' variable
 
         """
-        self.cache = cache = CacheManager(**parse_cache_config_options(config))
-        self.settings_cache = cache.get_cache('app_settings',
-                                              expire=3600,
-                                              type='memory')
+        self.cache = CacheManager(**parse_cache_config_options(config))
 
-        # We'll store the primary translator here for sharing between requests
-        self.primary_language = None
-        self.primary_translator = None
+        # Every process keeps the settings in memory, and reloads them when
+        # another process replaces the version file.
+        cache_dir = config.get('cache_dir')
+        self.settings_cache = VersionedCache(fetch_settings,
+            version_path=cache_dir and os.path.join(cache_dir, 'settings.version'),
+            check_interval=float(config.get('settings_check_interval', 1)))
 
     @property
     def settings(self):
-        def fetch_settings():
-            from mediacore.model import DBSession, Setting
-            settings_dict = dict(DBSession.query(Setting.key, Setting.value))
-            return settings_dict
-        return self.settings_cache.get(createfunc=fetch_settings, key=None)
+        return self.settings_cache.get()
@@ -30,7 +30,7 @@ from repoze.what.predicates import has_permission, Predicate
 from tw.forms.fields import ContainerMixin as _ContainerMixin
 
 from mediacore.lib import helpers
-from mediacore.lib.i18n import Translator
+from mediacore.lib.i18n import translator_pool
 from mediacore.model.meta import DBSession
 
 __all__ = [
@@ -92,16 +92,10 @@ class BareBonesController(WSGIController):
             abort(status_code=404)
 
     def setup_translator(self):
-        # Load the primary translator on first request and reactivate it for
-        # each subsequent request until the primary language is changed.
-        app_globs = app_globals._current_obj()
-        lang = app_globs.settings['primary_language'] or 'en'
-        if app_globs.primary_language == lang and app_globs.primary_translator:
-            translator = app_globs.primary_translator
-        else:
-            translator = Translator(lang, config['locale_dirs'])
-            app_globs.primary_translator = translator
-            app_globs.primary_language = lang
+        # Reuse the translator for the primary language between requests,
+        # and keep the previous ones in case the language is switched back.
+        lang = app_globals.settings['primary_language'] or 'en'
+        translator = translator_pool.get(lang, config['locale_dirs'])
         translator.install_pylons_global()
 
 class BaseController(BareBonesController):
@@ -243,12 +237,8 @@ class BaseSettingsController(BaseController):
                 DBSession.add(setting)
         DBSession.flush()
 
-        # Clear the settings cache unless there are multiple processes.
-        # We have no way of notifying the other processes that they need
-        # to clear their caches too, so we've just gotta let it play out
-        # until all the caches expire.
-        if not request.environ.get('wsgi.multiprocess', False):
-            app_globals.settings_cache.clear()
+        # Reload the settings in all processes
+        app_globals.settings_cache.clear()
 
     def _display(self, form, values=None, action=None):
         """Return the template variables for display of the form.
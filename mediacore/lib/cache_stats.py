@@ -0,0 +1,78 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Cache Statistics
+
+Each cache counts how often it is hit, missed, serves a stale value and
+regenerates a value, so that the expiry times and grace periods can be
+tuned. The counts are kept in memory for each worker process since it
+was started, and can be read from ``/admin/index/cache_stats``.
+
+"""
+import threading
+
+__all__ = ['CacheStats', 'cache_stats']
+
+class CacheStats(object):
+    """Thread-safe counters of cache events, grouped by cache name."""
+
+    events = ('hit', 'miss', 'stale', 'regeneration')
+    """The events that are counted for every cache.
+
+    Other events may be counted for some caches, such as the catalog loads
+    of :data:`mediacore.lib.i18n.translator_pool`.
+    """
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def incr(self, name, event, amount=1):
+        """Count an event for the named cache.
+
+        :param name: The name of the cache, such as a Beaker namespace.
+        :param event: One of :attr:`events`.
+        """
+        self._lock.acquire()
+        try:
+            counts = self._counts.get(name)
+            if counts is None:
+                counts = self._counts[name] = dict.fromkeys(self.events, 0)
+            counts[event] = counts.get(event, 0) + amount
+        finally:
+            self._lock.release()
+
+    def snapshot(self):
+        """Return a copy of the counts of every cache.
+
+        :rtype: dict
+        :returns: A dict of cache names to dicts of event counts.
+        """
+        self._lock.acquire()
+        try:
+            return dict((name, counts.copy())
+                        for name, counts in self._counts.iteritems())
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        """Forget all counts."""
+        self._lock.acquire()
+        try:
+            self._counts.clear()
+        finally:
+            self._lock.release()
+
+cache_stats = CacheStats()
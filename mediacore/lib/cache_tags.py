@@ -0,0 +1,258 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Cache Dependency Tags
+
+Responses cached by :func:`mediacore.lib.decorators.beaker_cache` can
+declare the rows they were built from as tags:
+
+* ``catalog`` for listings of all published media, such as the sitemaps,
+* ``podcasts`` for listings of all podcasts,
+* ``players`` for rendered players, which depend on the player preferences,
+* ``media:<id>``, ``podcast:<id>`` and ``category:<id>`` for responses
+  built from a single media item, podcast or category.
+
+Every tag has a version stamp, kept in a Beaker cache that is shared by
+all workers. A cached response records the stamps of its tags when it is
+created and is only served while they are unchanged. The
+:mod:`mediacore.plugin.events` observers below replace the stamps of the
+tags that a saved media item, media file, comment, podcast or category
+affects, so that only those responses are rebuilt. A media item affects
+its own tag, the catalog, its podcast, and its categories along with
+their ancestors.
+
+Stamps are replaced when the change is flushed and again once it has
+been committed, so that a response built from the old rows in between
+isn't kept.
+
+"""
+import threading
+import time
+
+from pylons import request
+from sqlalchemy import sql
+from sqlalchemy.orm import attributes
+
+from mediacore.lib.util import chunks
+from mediacore.plugin import events
+#from mediacore.model.meta import DBSession XXX: Import at EOF
+
+__all__ = ['CacheTags', 'cache_tags', 'media_dependencies']
+
+class CacheTags(object):
+    """Track the version of each cache dependency tag.
+
+    Tags are only tracked once :meth:`configure` has been called. Until
+    then every cached response is considered current.
+
+    :param global_tags: Tags that every response depends on.
+
+    """
+    def __init__(self, global_tags=('settings',)):
+        self.global_tags = tuple(global_tags)
+        self.cache = None
+        self._local = threading.local()
+
+    def configure(self, cache_manager, type='file'):
+        """Store the tag versions in the given Beaker cache manager.
+
+        :param cache_manager: A :class:`beaker.cache.CacheManager`.
+        :param type: The type of Beaker cache to use. Memory caches
+            aren't shared between processes.
+        """
+        self.cache = cache_manager.get_cache('cache_tags', type=type)
+
+    def versions(self, tags):
+        """Return the current version stamp of each of the given tags.
+
+        :rtype: dict
+        """
+        if self.cache is None:
+            return {}
+        versions = {}
+        for tag in tags:
+            try:
+                versions[tag] = self.cache.get_value(tag)
+            except KeyError:
+                versions[tag] = None
+        return versions
+
+    def is_current(self, versions):
+        """Return True if none of the given tags have changed.
+
+        :param versions: A dict of the tag versions a response was
+            created with, as returned by :meth:`collect`.
+        """
+        if not versions or self.cache is None:
+            return True
+        return self.versions(versions.iterkeys()) == versions
+
+    def collect(self, func, tags=()):
+        """Call the given function, collecting the tags its result depends on.
+
+        The versions are read before the function is called, so a change
+        made while it's running leaves the result stale.
+
+        :param func: A callable which takes no arguments.
+        :param tags: The tags which are known in advance.
+        :returns: The result and a dict of the tag versions.
+        """
+        versions = self.versions(self.global_tags + tuple(tags or ()))
+        stack = self._local.__dict__.setdefault('collecting', [])
+        stack.append(versions)
+        try:
+            result = func()
+        finally:
+            stack.pop()
+        return result, versions
+
+    def depend_on(self, *tags):
+        """Declare that the response being cached depends on the given tags.
+
+        This may be called from within a cached action, for tags which
+        aren't known until the rows are loaded. Elsewhere it's a no-op.
+        """
+        stack = getattr(self._local, 'collecting', None)
+        if not stack:
+            return
+        new_tags = [tag for tag in tags if tag not in stack[-1]]
+        stack[-1].update(self.versions(new_tags))
+
+    def invalidate(self, *tags):
+        """Make all responses which depend on the given tags stale.
+
+        If this is called during a request that commits with the
+        :func:`~mediacore.lib.decorators.autocommit` decorator, the tags
+        are invalidated again once the transaction has been committed.
+
+        :rtype: str
+        :returns: The new version stamp.
+        """
+        if self.cache is None or not tags:
+            return None
+        version = self._bump(tags)
+        try:
+            callbacks = request.commit_callbacks
+        except (AttributeError, TypeError):
+            # Outside of a request, or not within @autocommit
+            pass
+        else:
+            callbacks.append(lambda: self._bump(tags))
+        return version
+
+    def _bump(self, tags):
+        version = '%.6f' % time.time()
+        for tag in set(tags):
+            self.cache.set_value(tag, version)
+        return version
+
+cache_tags = CacheTags()
+
+def _category_tags(bind, category_ids):
+    """Return the tags of the given categories and all their ancestors."""
+    from mediacore.model.categories import category_closure
+    tags = set('category:%d' % cat_id for cat_id in category_ids)
+    for chunk in chunks(category_ids):
+        tags.update('category:%d' % cat_id for cat_id, in bind.execute(
+            sql.select([category_closure.c.ancestor_id],
+                       category_closure.c.descendant_id.in_(chunk))))
+    return tags
+
+def media_dependencies(bind, media_ids):
+    """Return the tags that the given media affect, as stored in the database.
+
+    :param bind: The engine or connection to execute with.
+    :param media_ids: A list of media IDs.
+    :rtype: set
+    """
+    from mediacore.model.media import media, media_categories
+    tags = set(['catalog'])
+    tags.update('media:%d' % media_id for media_id in media_ids)
+    category_ids = set()
+    for chunk in chunks(media_ids):
+        tags.update('podcast:%d' % podcast_id for podcast_id, in bind.execute(
+            sql.select([media.c.podcast_id],
+                       sql.and_(media.c.id.in_(chunk),
+                                media.c.podcast_id != None)).distinct()))
+        category_ids.update(cat_id for cat_id, in bind.execute(
+            sql.select([media_categories.c.category_id],
+                       media_categories.c.media_id.in_(chunk)).distinct()))
+    tags.update(_category_tags(bind, category_ids))
+    return tags
+
+@events.observes(events.Media.after_insert, events.Media.after_update,
+                 events.Media.before_delete)
+def _invalidate_media(instance):
+    if cache_tags.cache is None:
+        return
+    conn = DBSession.connection()
+    tags = set()
+    if instance.id is not None:
+        tags.update(media_dependencies(conn, [instance.id]))
+    # The associations may not be flushed yet, or may already be removed
+    added, kept, removed = attributes.get_history(instance, 'podcast_id')
+    tags.update('podcast:%d' % podcast_id
+                for podcast_id in list(added) + list(removed)
+                if podcast_id is not None)
+    if 'categories' in instance.__dict__:
+        added, kept, removed = attributes.get_history(
+            instance, 'categories', passive=attributes.PASSIVE_NO_INITIALIZE)
+        tags.update(_category_tags(conn, [cat.id for cat
+                                          in list(added) + list(removed)
+                                          if cat.id is not None]))
+    cache_tags.invalidate(*tags)
+
+@events.observes(events.MediaFile.after_insert, events.MediaFile.after_update,
+                 events.MediaFile.after_delete)
+def _invalidate_media_file(instance):
+    if cache_tags.cache is not None and instance.media_id is not None:
+        cache_tags.invalidate(*media_dependencies(DBSession.connection(),
+                                                  [instance.media_id]))
+
+@events.observes(events.Comment.after_insert, events.Comment.after_update,
+                 events.Comment.after_delete)
+def _invalidate_comment(instance):
+    if instance.media_id is not None:
+        cache_tags.invalidate('media:%d' % instance.media_id)
+
+@events.observes(events.Podcast.after_insert, events.Podcast.after_update,
+                 events.Podcast.after_delete)
+def _invalidate_podcast(instance):
+    cache_tags.invalidate('catalog', 'podcasts', 'podcast:%d' % instance.id)
+
+@events.observes(events.Category.before_update, events.Category.before_delete)
+def _invalidate_old_category(instance):
+    if cache_tags.cache is None:
+        return
+    # The closure table still holds the ancestors it's being moved away from
+    cache_tags.invalidate('catalog',
+        *_category_tags(DBSession.connection(), [instance.id]))
+
+@events.observes(events.Category.after_update)
+def _invalidate_new_category(instance):
+    if cache_tags.cache is None:
+        return
+    tags = set(['category:%d' % instance.id])
+    if instance.parent_id is not None:
+        tags.update(_category_tags(DBSession.connection(),
+                                   [instance.parent_id]))
+    cache_tags.invalidate(*tags)
+
+@events.observes(events.Setting.after_insert, events.Setting.after_update,
+                 events.Setting.after_delete)
+def _invalidate_settings(instance):
+    cache_tags.invalidate('settings')
+
+from mediacore.model.meta import DBSession
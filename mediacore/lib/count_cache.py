@@ -0,0 +1,125 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Cached Query Counts
+
+Paginated listings, the API and the sitemaps all need the total number of
+media matched by a query. Every worker counts the same few listings over
+and over, though they only change when media are saved or published.
+
+:class:`CountCache` keeps the counts in a Beaker cache that is shared by
+all workers, keyed by a hash of the compiled SQL and its parameters. Each
+count is stored with the current generation stamp, and the stamp is
+replaced whenever a :class:`mediacore.plugin.events.Media` observer fires
+or the publication scheduler flips live flags, so a count from before the
+change is recomputed the next time it's needed. Counts also expire after
+``count_cache_expire`` seconds, to pick up changes made outside of
+MediaCore.
+
+"""
+import time
+
+from mediacore.lib.compat import sha1
+from mediacore.plugin import events
+
+__all__ = ['CountCache', 'count_cache']
+
+class CountCache(object):
+    """Cache the number of rows matched by queries.
+
+    Counts are only cached once :meth:`configure` has been called. Until
+    then queries are counted every time.
+
+    :param expire: The number of seconds to keep a count for.
+
+    """
+    def __init__(self, expire=60):
+        self.expire = expire
+        self.cache = None
+
+    def configure(self, cache_manager, type='file', expire=None):
+        """Store counts in the given Beaker cache manager.
+
+        :param cache_manager: A :class:`beaker.cache.CacheManager`.
+        :param type: The type of Beaker cache to use. Memory caches
+            aren't shared between processes.
+        :param expire: Optionally override the expiry time in seconds.
+        """
+        if expire is not None:
+            self.expire = int(expire)
+        self.cache = cache_manager.get_cache('count_cache', type=type)
+
+    def signature(self, query):
+        """Return a key that identifies the given query and its parameters.
+
+        :param query: An ORM query or select. Queries which differ only
+            in their order share the same signature.
+        :rtype: str
+        """
+        # The order doesn't change the count
+        query = query.order_by(None)
+        statement = getattr(query, 'statement', query)
+        compiled = statement.compile()
+        params = sorted(compiled.params.iteritems())
+        text = u'%s\n%r' % (compiled, params)
+        return sha1(text.encode('utf-8')).hexdigest()
+
+    def count(self, query):
+        """Return the number of rows the query matches, from cache if possible.
+
+        :param query: An ORM query.
+        :rtype: int
+        """
+        if self.cache is None:
+            return query.count()
+        generation = self.generation()
+        key = self.signature(query)
+        def create_func():
+            return generation, query.count()
+        # Creation is locked by Beaker, so that when a popular count
+        # expires only one worker recomputes it.
+        value = self.cache.get_value(key, createfunc=create_func,
+                                     expiretime=self.expire)
+        if value[0] != generation:
+            self.cache.remove_value(key)
+            value = self.cache.get_value(key, createfunc=create_func,
+                                         expiretime=self.expire)
+        return value[1]
+
+    def generation(self):
+        """Return the current generation stamp."""
+        try:
+            return self.cache.get_value('generation')
+        except KeyError:
+            return self.invalidate()
+
+    def invalidate(self):
+        """Make all cached counts stale, in every process.
+
+        :rtype: str
+        :returns: The new generation stamp.
+        """
+        if self.cache is None:
+            return None
+        generation = '%.6f' % time.time()
+        self.cache.set_value('generation', generation)
+        return generation
+
+count_cache = CountCache()
+
+@events.observes(events.Media.after_insert, events.Media.after_update,
+                 events.Media.after_delete)
+def _invalidate_counts(instance):
+    count_cache.invalidate()
@@ -0,0 +1,300 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Buffered Media Counters
+
+Incrementing :attr:`mediacore.model.media.Media.views` (or likes, or
+dislikes) with an UPDATE on every page view locks the media row, and by
+way of our MySQL triggers, the whole MyISAM media_fulltext table. Under
+heavy traffic this causes lock wait timeouts.
+
+Instead, each worker process aggregates the increments in memory and a
+background thread writes them with a single bulk UPDATE every
+``counters_flush_interval`` seconds, or sooner once
+``counters_flush_threshold`` increments have been buffered.
+
+Any increments that could not be written are saved to a spill file in
+``cache_dir/counters`` and retried. Spill files left behind by dead
+processes are picked up when a new process starts, so a crash loses at
+most one interval's worth of views.
+
+"""
+import atexit
+import errno
+import glob
+import logging
+import os
+import threading
+
+import simplejson
+
+from mediacore.model.meta import DBSession
+
+__all__ = ['COUNTER_COLUMNS', 'CounterBuffer', 'media_counters']
+
+log = logging.getLogger(__name__)
+
+COUNTER_COLUMNS = ('views', 'likes', 'dislikes')
+"""The media columns which can be buffered, in the order deltas are stored."""
+
+def _pid_alive(pid):
+    """Return True if a process with the given ID is running."""
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return e.errno == errno.EPERM
+    return True
+
+class CounterBuffer(object):
+    """Aggregate media counter increments and write them in bulk.
+
+    :param flush_interval: The maximum number of seconds to buffer for.
+    :param flush_threshold: The maximum number of increments to buffer.
+
+    """
+    def __init__(self, flush_interval=10, flush_threshold=1000):
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.bind = None
+        self.spill_dir = None
+        self._pending = {}
+        self._inflight = {}
+        self._events = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def start(self, bind, spill_dir=None, flush_interval=None,
+              flush_threshold=None):
+        """Start buffering increments, if we aren't already.
+
+        :param bind: The engine to connect to the database with.
+        :param spill_dir: An optional directory to save unwritten increments.
+        :param flush_interval: Optionally override the flush interval.
+        :param flush_threshold: Optionally override the flush threshold.
+        """
+        if self._thread is not None:
+            return
+        self.bind = bind
+        if flush_interval is not None:
+            self.flush_interval = int(flush_interval)
+        if flush_threshold is not None:
+            self.flush_threshold = int(flush_threshold)
+        if spill_dir:
+            if not os.path.exists(spill_dir):
+                os.makedirs(spill_dir)
+            self.spill_dir = spill_dir
+            self._claim_orphaned_spills()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='CounterBuffer')
+        self._thread.setDaemon(True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    @property
+    def running(self):
+        """True if increments are being buffered."""
+        return self._thread is not None
+
+    def stop(self):
+        """Stop the flush thread and write any pending increments."""
+        if self._thread is None:
+            return
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+        self.flush()
+
+    def increment(self, media_id, name, delta=1):
+        """Increment the given counter.
+
+        If the buffer hasn't been started, the increment is written
+        immediately in the current :data:`DBSession` transaction.
+
+        :param media_id: A :attr:`mediacore.model.media.Media.id`.
+        :param name: One of :data:`COUNTER_COLUMNS`.
+        :param delta: The amount to increment by.
+        :rtype: bool
+        :returns: True if the increment was buffered.
+        """
+        index = COUNTER_COLUMNS.index(name)
+        if self._thread is None:
+            from mediacore.model.media import update_counters
+            deltas = [0] * len(COUNTER_COLUMNS)
+            deltas[index] = delta
+            update_counters(DBSession, {media_id: deltas})
+            return False
+
+        self._lock.acquire()
+        try:
+            counts = self._pending.get(media_id)
+            if counts is None:
+                counts = self._pending[media_id] = [0] * len(COUNTER_COLUMNS)
+            counts[index] += delta
+            self._events += 1
+            if self._events >= self.flush_threshold:
+                self._wakeup.set()
+        finally:
+            self._lock.release()
+        return True
+
+    def pending(self, media_id, name):
+        """Return the increments that haven't been committed yet.
+
+        :param media_id: A :attr:`mediacore.model.media.Media.id`.
+        :param name: One of :data:`COUNTER_COLUMNS`.
+        :rtype: int
+        """
+        index = COUNTER_COLUMNS.index(name)
+        total = 0
+        for buffered in (self._pending, self._inflight):
+            counts = buffered.get(media_id)
+            if counts:
+                total += counts[index]
+        return total
+
+    def flush(self):
+        """Write all pending increments to the database.
+
+        :rtype: int
+        :returns: The number of media that were updated.
+        """
+        from mediacore.model.media import update_counters
+        self._flush_lock.acquire()
+        try:
+            self._lock.acquire()
+            try:
+                self._inflight, self._pending = self._pending, {}
+                self._events = 0
+            finally:
+                self._lock.release()
+            deltas = self._inflight
+            if not deltas:
+                return 0
+
+            try:
+                conn = self.bind.connect()
+                try:
+                    trans = conn.begin()
+                    try:
+                        update_counters(conn, deltas)
+                        trans.commit()
+                    except:
+                        trans.rollback()
+                        raise
+                finally:
+                    conn.close()
+            except Exception:
+                log.exception('Failed to write the counters for %d media, '
+                              'they will be retried', len(deltas))
+                self._merge(deltas)
+                self._inflight = {}
+                self._spill()
+                return 0
+
+            self._inflight = {}
+            self._spill()
+            return len(deltas)
+        finally:
+            self._flush_lock.release()
+
+    def _merge(self, deltas):
+        self._lock.acquire()
+        try:
+            for media_id, delta in deltas.iteritems():
+                counts = self._pending.get(media_id)
+                if counts is None:
+                    self._pending[media_id] = list(delta)
+                else:
+                    for i, value in enumerate(delta):
+                        counts[i] += value
+        finally:
+            self._lock.release()
+
+    def _spill_path(self, pid=None):
+        return os.path.join(self.spill_dir, '%d.json' % (pid or os.getpid()))
+
+    def _spill(self):
+        """Save the pending increments to this process's spill file."""
+        if not self.spill_dir:
+            return
+        self._lock.acquire()
+        try:
+            snapshot = dict((str(media_id), counts)
+                            for media_id, counts in self._pending.iteritems())
+        finally:
+            self._lock.release()
+
+        path = self._spill_path()
+        if not snapshot:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        tmp_path = path + '.tmp'
+        spill = open(tmp_path, 'w')
+        try:
+            simplejson.dump(snapshot, spill)
+            spill.flush()
+            os.fsync(spill.fileno())
+        finally:
+            spill.close()
+        os.rename(tmp_path, path)
+
+    def _claim_orphaned_spills(self):
+        """Merge in any increments spilled by processes that have died."""
+        claimed = []
+        for path in glob.glob(os.path.join(self.spill_dir, '*.json')):
+            try:
+                pid = int(os.path.basename(path)[:-len('.json')])
+            except ValueError:
+                continue
+            if pid == os.getpid() or _pid_alive(pid):
+                continue
+            # Renaming is atomic, so only one worker can claim each file
+            claimed_path = '%s.%d.claimed' % (path, os.getpid())
+            try:
+                os.rename(path, claimed_path)
+            except OSError:
+                continue
+            spill = open(claimed_path)
+            try:
+                try:
+                    deltas = simplejson.load(spill)
+                except ValueError:
+                    log.warn('Discarding a corrupt counter spill file: %s',
+                             claimed_path)
+                    deltas = {}
+            finally:
+                spill.close()
+            self._merge(dict((int(media_id), counts)
+                             for media_id, counts in deltas.iteritems()))
+            claimed.append(claimed_path)
+        if claimed:
+            self._spill()
+            for path in claimed:
+                os.remove(path)
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._stopped:
+                break
+            self.flush()
+
+media_counters = CounterBuffer()
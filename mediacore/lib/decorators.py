@@ -14,12 +14,15 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import os
+import time
 import warnings
 import simplejson
 
 import formencode
 import tw.forms
 
+from beaker.synchronization import file_synchronizer
 from decorator import decorator
 from paste.deploy.converters import asbool
 from pylons import request, response, tmpl_context, translator
@@ -29,12 +32,15 @@ from repoze.what.plugins.pylonshq import ActionProtector
 from repoze.what.predicates import has_permission
 from webob.exc import HTTPException, HTTPMethodNotAllowed
 
+from mediacore.lib.cache_stats import cache_stats
+from mediacore.lib.cache_tags import cache_tags
+from mediacore.lib.page_cache import find_last_modified, page_cache
 from mediacore.lib.paginate import paginate
 from mediacore.lib.templating import render
 from mediacore.model.meta import DBSession
 
 __all__ = [
-    'autocommit', 'beaker_cache', 'expose',
+    'autocommit', 'beaker_cache', 'cache_page', 'expose',
     'expose_xhr', 'paginate', 'validate',
 ]
 
@@ -423,7 +429,8 @@ def beaker_cache(key="cache_default", expire="never", type=None,
                  query_args=False,
                  cache_headers=('content-type', 'content-length'),
                  invalidate_on_startup=False,
-                 cache_response=True, **b_kwargs):
+                 cache_response=True, tags=None, grace=None,
+                 refresh_ahead=0, **b_kwargs):
     """Cache decorator utilizing Beaker. Caches action or other
     function that returns a pickle-able object as a result.
 
@@ -455,6 +462,22 @@ def beaker_cache(key="cache_default", expire="never", type=None,
         .. note::
             When cache_response is set to False, the cache_headers
             argument is ignored as none of the response is cached.
+    ``tags``
+        A list of :mod:`mediacore.lib.cache_tags` the response depends
+        on. The cached copy is rebuilt as soon as any of them are
+        invalidated. The action may declare more tags while it runs
+        with :meth:`~mediacore.lib.cache_tags.CacheTags.depend_on`.
+    ``grace``
+        The number of seconds after the cached copy expires or its tags
+        change that it may still be served, while one request rebuilds
+        it. Defaults to the cache_grace setting in the .ini file.
+    ``refresh_ahead``
+        The number of seconds before the cached copy expires that one
+        request may rebuild it, while the others are still served the
+        current copy. Defaults to 0, which disables this.
+
+    Hits, misses, stale copies served and regenerations are counted in
+    :data:`mediacore.lib.cache_stats.cache_stats`.
 
     If cache_enabled is set to False in the .ini file, then cache is
     disabled globally.
@@ -516,20 +539,81 @@ def beaker_cache(key="cache_default", expire="never", type=None,
         else:
             cache_expire = expire
 
+        if grace is None:
+            cache_grace = int(pylons.config.get('cache_grace', 300))
+        else:
+            cache_grace = grace
+        if cache_expire is None:
+            keep_expire = None
+        else:
+            keep_expire = cache_expire + cache_grace
+
         def create_func():
             log.debug("Creating new cache copy with key: %s, type: %s",
                       cache_key, type)
-            result = func(*args, **kwargs)
+            result, versions = cache_tags.collect(
+                lambda: func(*args, **kwargs), tags)
             glob_response = pylons.response
             headers = glob_response.headerlist
             status = glob_response.status
             full_response = dict(headers=headers, status=status,
-                                 cookies=None, content=result)
+                                 cookies=None, content=result,
+                                 tags=versions, created=time.time())
+            my_cache.set_value(cache_key, full_response,
+                               expiretime=keep_expire)
+            cache_stats.incr(namespace, 'regeneration')
             return full_response
 
-        response = my_cache.get_value(cache_key, createfunc=create_func,
-                                      expiretime=cache_expire,
-                                      starttime=starttime)
+        def get_state():
+            try:
+                response = my_cache.get_value(cache_key,
+                                              expiretime=keep_expire)
+            except KeyError:
+                return None, None
+            created = response.get('created', 0)
+            if starttime is not None and created < starttime:
+                return None, None
+            age = time.time() - created
+            if cache_expire is not None and age >= cache_expire:
+                return response, 'stale'
+            if not cache_tags.is_current(response.get('tags')):
+                return response, 'stale'
+            if cache_expire is not None and refresh_ahead \
+            and age >= cache_expire - refresh_ahead:
+                return response, 'refresh'
+            return response, 'fresh'
+
+        # Only one process at a time regenerates each key. The others
+        # serve the previous value while it's still within the grace
+        # period, or wait for the new one.
+        lock = file_synchronizer('%s:%s' % (namespace, cache_key),
+            os.path.join(pylons.config['app_conf']['cache_dir'],
+                         'regenerate'))
+        response, state = get_state()
+        if state == 'fresh':
+            cache_stats.incr(namespace, 'hit')
+        elif state is not None:
+            if lock.acquire_write_lock(wait=False):
+                try:
+                    response, state = get_state()
+                    if state != 'fresh':
+                        response = create_func()
+                finally:
+                    lock.release_write_lock()
+            else:
+                cache_stats.incr(namespace,
+                                 state == 'refresh' and 'hit' or 'stale')
+        else:
+            cache_stats.incr(namespace, 'miss')
+            lock.acquire_write_lock()
+            try:
+                # Another process may have created it while we waited
+                response, state = get_state()
+                if state != 'fresh':
+                    response = create_func()
+            finally:
+                lock.release_write_lock()
+
         if cache_response:
             glob_response = pylons.response
             glob_response.headerlist = [header for header in response['headers']
@@ -539,6 +623,29 @@ def beaker_cache(key="cache_default", expire="never", type=None,
         return response['content']
     return decorator(wrapper)
 
+def cache_page(tags=None):
+    """Allow anonymous responses of the decorated action to be cached.
+
+    The response is stored by
+    :class:`~mediacore.lib.page_cache.PageCacheMiddleware`, and served to
+    other anonymous visitors until any of the given
+    :mod:`~mediacore.lib.cache_tags` are invalidated. More tags may be
+    declared by the action with
+    :meth:`~mediacore.lib.cache_tags.CacheTags.depend_on`.
+
+    This must be placed below :func:`expose` and above :func:`paginate`,
+    so that the Last-Modified date can be found from the returned entities.
+
+    :param tags: A list of the tags the page depends on.
+    :returns: A decorator function.
+    """
+    def wrapper(func, *args, **kwargs):
+        result, versions = cache_tags.collect(
+            lambda: func(*args, **kwargs), tags)
+        page_cache.mark(versions, find_last_modified(result))
+        return result
+    return decorator(wrapper)
+
 def observable(event):
     """Filter the result of the decorated action through the events observers.
 
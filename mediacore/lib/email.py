@@ -100,7 +100,7 @@ def send_media_notification(media_obj):
     edit_url = url_for(controller='/admin/media', action='edit',
                        id=media_obj.id, qualified=True),
 
-    clean_description = strip_xhtml(line_break_xhtml(line_break_xhtml(media_obj.description)))
+    clean_description = media_obj.description_plain
 
     type = media_obj.type
     title = media_obj.title
@@ -141,7 +141,7 @@ def send_comment_notification(media_obj, comment):
     author_name = media_obj.author.name
     comment_subject = comment.subject
     post_url = url_for(controller='/media', action='view', slug=media_obj.slug, qualified=True),
-    comment_body = strip_xhtml(line_break_xhtml(line_break_xhtml(comment.body)))
+    comment_body = strip_xhtml(line_break_xhtml(comment.body, 2))
     subject = _('New Comment: %(comment_subject)s') % locals()
     body = _("""A new comment has been posted!
 
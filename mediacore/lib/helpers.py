@@ -40,6 +40,7 @@ from mediacore.lib.thumbnails import thumb, thumb_url
 from mediacore.lib.uri import (best_link_uri, download_uri, file_path,
     pick_uri, pick_uris, web_uri)
 from mediacore.lib.util import delete_files, merge_dicts, redirect, url, url_for
+from mediacore.lib.vulgarity import get_vulgarity_filter
 from mediacore.lib.xhtml import (clean_xhtml, decode_entities, encode_entities,
     excerpt_xhtml, line_break_xhtml, list_acceptable_xhtml, strip_xhtml,
     truncate_xhtml)
@@ -65,6 +66,7 @@ defined = [
     'doc_link', 'duration_from_seconds', 'duration_to_seconds',
     'filter_library_controls', 'filter_vulgarity',
     'get_featured_category', 'gravatar_from_email', 'is_admin', 'js',
+    'library_sort_keys',
     'pick_any_media_file', 'pick_podcast_media_file',
     'pretty_file_size', 'redirect', 'store_transient_message',
     'truncate', 'wrap_long_words',
@@ -241,6 +243,21 @@ def filter_library_controls(query, show='latest'):
             query = query.in_category(featured_cat)
     return query, show
 
+def library_sort_keys(show='latest'):
+    """Return the sort keys to page through :func:`filter_library_controls`.
+
+    :param show: 'latest', 'popular' or 'featured'
+    :rtype: list or None
+    :returns: Sort keys for :class:`mediacore.lib.paginate.KeysetPage`,
+        or None if the listing can only be paged by number.
+    """
+    from mediacore.model import Media
+    if show == 'latest':
+        return [(Media.publish_on, 'desc'), (Media.id, 'desc')]
+    elif show == 'popular':
+        return [(Media.popularity_points, 'desc'), (Media.id, 'desc')]
+    return None
+
 def is_admin():
     """Return True if the logged in user is a part of the Admins group.
 
@@ -372,13 +389,7 @@ def filter_vulgarity(text):
     """
     vulgar_words = app_globals.settings.get('vulgarity_filtered_words', None)
     if vulgar_words:
-        words = (word.strip() for word in vulgar_words.split(','))
-        word_pattern = '|'.join(re.escape(word) for word in words if word)
-        word_expr = re.compile(word_pattern, re.IGNORECASE)
-        def word_replacer(matchobj):
-            word = matchobj.group(0)
-            return '*' * len(word)
-        text = word_expr.sub(word_replacer, text)
+        text = get_vulgarity_filter(vulgar_words).sub(text)
     return text
 
 def best_translation(a, b):
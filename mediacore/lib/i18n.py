@@ -14,15 +14,19 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import threading
 
 from gettext import NullTranslations, translation as gettext_translation
 
 from babel.core import Locale
 from babel.dates import (format_date as _format_date,
-    format_datetime as _format_datetime, format_time as _format_time)
+    format_datetime as _format_datetime, format_time as _format_time,
+    parse_pattern)
 from pylons import config, request, translator
 from pylons.i18n.translation import lazify
 
+from mediacore.lib.cache_stats import cache_stats
+
 log = logging.getLogger(__name__)
 
 MEDIACORE = 'mediacore'
@@ -111,6 +115,7 @@ class Translator(object):
             t = NullTranslations()
         else:
             raise DomainError('No localedir specified for domain %r' % domain)
+        cache_stats.incr('translators', 'catalog_load')
         self._domains[domain] = t
         return t
 
@@ -180,6 +185,59 @@ class Translator(object):
     dugettext = dgettext
     dungettext = dngettext
 
+class TranslatorPool(object):
+    """Share :class:`Translator` instances between requests.
+
+    The translators of the most recently used locales are kept, so that
+    their message catalogs aren't read again for every request. Catalogs
+    for domains other than 'mediacore' are still loaded as they're first
+    needed, by each translator.
+
+    :param size: The number of locales to keep translators for.
+
+    """
+    def __init__(self, size=10):
+        self.size = size
+        self._translators = {}
+        self._used = []
+        self._lock = threading.Lock()
+
+    def get(self, locale, locale_dirs):
+        """Return a translator for the given locale.
+
+        :type locale: :class:`babel.Locale` or ``str``.
+        :param locale: The locale to translate to.
+        :type locale_dirs: dict
+        :param locale_dirs: See :class:`Translator`.
+        :rtype: :class:`Translator`
+        """
+        key = (str(locale), id(locale_dirs))
+        self._lock.acquire()
+        try:
+            t = self._translators.get(key)
+            if t is not None:
+                cache_stats.incr('translators', 'hit')
+                self._used.remove(key)
+            else:
+                cache_stats.incr('translators', 'miss')
+                t = self._translators[key] = Translator(locale, locale_dirs)
+                while len(self._used) >= self.size:
+                    del self._translators[self._used.pop(0)]
+            self._used.append(key)
+            return t
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Forget all translators, so that their catalogs are read again."""
+        self._lock.acquire()
+        try:
+            self._translators.clear()
+            del self._used[:]
+        finally:
+            self._lock.release()
+
+translator_pool = TranslatorPool()
 
 def gettext(msgid, domain=None):
     """Get the translated string for this msgid in the given domain.
@@ -269,7 +327,8 @@ def format_date(date=None, format='medium'):
                    date/time pattern
     :rtype: `unicode`
     """
-    return _format_date(date, format, translator.locale)
+    return _format_date(date, _date_pattern(format),
+                        translator._current_obj().locale)
 
 def format_datetime(datetime=None, format='medium', tzinfo=None):
     """Return a date formatted according to the given pattern.
@@ -283,7 +342,8 @@ def format_datetime(datetime=None, format='medium', tzinfo=None):
     :param tzinfo: the timezone to apply to the time for display
     :rtype: `unicode`
     """
-    return _format_datetime(datetime, format, tzinfo, translator.locale)
+    return _format_datetime(datetime, _date_pattern(format), tzinfo,
+                            translator._current_obj().locale)
 
 def format_time(time=None, format='medium', tzinfo=None):
     """Return a time formatted according to the given pattern.
@@ -297,4 +357,25 @@ def format_time(time=None, format='medium', tzinfo=None):
     :param tzinfo: the time-zone to apply to the time for display
     :rtype: `unicode`
     """
-    return _format_time(time, format, tzinfo, translator.locale)
+    return _format_time(time, _date_pattern(format), tzinfo,
+                        translator._current_obj().locale)
+
+_named_formats = frozenset(['full', 'long', 'medium', 'short'])
+_parsed_patterns = {}
+
+def _date_pattern(format):
+    """Return the parsed form of a custom date/time pattern.
+
+    Named formats are returned as is, since babel keeps them parsed in
+    each :class:`babel.Locale`. Custom patterns don't depend on the
+    locale, so they're parsed once for all requests.
+    """
+    if format in _named_formats:
+        return format
+    try:
+        return _parsed_patterns[format]
+    except KeyError:
+        if len(_parsed_patterns) >= 100:
+            _parsed_patterns.clear()
+        pattern = _parsed_patterns[format] = parse_pattern(format)
+        return pattern
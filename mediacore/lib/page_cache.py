@@ -0,0 +1,328 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Anonymous Page Cache
+
+Most visitors aren't logged in, so they all see the same public pages.
+Actions decorated with :func:`mediacore.lib.decorators.cache_page` mark
+their responses as cacheable, and :class:`PageCacheMiddleware` stores the
+marked responses to anonymous GET requests, gzipped, in a Beaker cache
+that's shared by all workers. They're keyed by the URL and the
+Accept-Language header.
+
+Later requests for the same page are answered from the cache without
+entering the controller, with an ETag and a Last-Modified date derived
+from the entities the page was rendered from. A matching If-None-Match
+or If-Modified-Since header is answered with a 304.
+
+Cached pages depend on :mod:`mediacore.lib.cache_tags`, so they are
+rebuilt when the media, podcasts, categories or settings they show are
+saved. They also expire after ``page_cache_expire`` seconds, since they
+show view counts and relative dates too.
+
+"""
+import gzip
+import time
+
+from cStringIO import StringIO
+from datetime import datetime
+from rfc822 import formatdate, mktime_tz, parsedate_tz
+
+from pylons import request
+
+from mediacore.lib.cache_stats import cache_stats
+from mediacore.lib.cache_tags import cache_tags
+from mediacore.lib.compat import sha1
+from mediacore.lib.counters import media_counters
+
+__all__ = ['PageCache', 'PageCacheMiddleware', 'page_cache']
+
+MARK_KEY = 'mediacore.page_cache'
+"""The environ key a cacheable response is marked with."""
+
+COUNTERS_KEY = 'mediacore.page_cache.counters'
+"""The environ key of counters to increment for each cached response."""
+
+_stored_headers_exclude = frozenset([
+    'content-encoding', 'content-length', 'date', 'etag', 'last-modified',
+    'set-cookie', 'vary',
+])
+
+class PageCache(object):
+    """Store rendered pages for anonymous requests.
+
+    Pages are only cached once :meth:`configure` has been called.
+
+    :param expire: The number of seconds to keep a page for.
+
+    """
+    def __init__(self, expire=300):
+        self.expire = expire
+        self.cache = None
+        self.bypass_cookies = frozenset(['authtkt'])
+
+    def configure(self, cache_manager, type='file', expire=None,
+                  bypass_cookies=()):
+        """Store pages in the given Beaker cache manager.
+
+        :param cache_manager: A :class:`beaker.cache.CacheManager`.
+        :param type: The type of Beaker cache to use. Memory caches
+            aren't shared between processes.
+        :param expire: Optionally override the expiry time in seconds.
+        :param bypass_cookies: The names of any cookies, besides the auth
+            cookie, which mark a request as not anonymous.
+        """
+        if expire is not None:
+            self.expire = int(expire)
+        self.bypass_cookies = self.bypass_cookies.union(bypass_cookies)
+        self.cache = cache_manager.get_cache('page_cache', type=type)
+
+    def is_cacheable_request(self, environ):
+        """Return True if the given request is an anonymous GET."""
+        if self.cache is None or environ['REQUEST_METHOD'] != 'GET':
+            return False
+        for cookie in environ.get('HTTP_COOKIE', '').split(';'):
+            if cookie.split('=', 1)[0].strip() in self.bypass_cookies:
+                return False
+        return True
+
+    def key(self, environ):
+        """Return the cache key for the given request.
+
+        Pages link to absolute URLs, so requests made over HTTP and HTTPS,
+        directly or through a proxy, are cached separately.
+        """
+        text = '\n'.join([
+            environ.get('wsgi.url_scheme', ''),
+            environ.get('HTTP_X_FORWARDED_PROTO', '').lower(),
+            environ.get('HTTP_HOST', ''),
+            environ.get('SCRIPT_NAME', ''),
+            environ.get('PATH_INFO', ''),
+            environ.get('QUERY_STRING', ''),
+            environ.get('HTTP_ACCEPT_LANGUAGE', '').replace(' ', '').lower(),
+        ])
+        return sha1(text).hexdigest()
+
+    def get(self, environ):
+        """Return the current cached page for the given request, if any.
+
+        :rtype: dict or None
+        """
+        try:
+            entry = self.cache.get_value(self.key(environ),
+                                         expiretime=self.expire)
+        except KeyError:
+            return None
+        if time.time() - entry['created'] >= self.expire \
+        or not cache_tags.is_current(entry['tags']):
+            return None
+        return entry
+
+    def store(self, environ, status, headers, body):
+        """Store a page marked as cacheable, if possible.
+
+        :param environ: The WSGI environ of the request.
+        :param status: The status line of the response.
+        :param headers: The headers of the response.
+        :param body: The full body of the response.
+        :rtype: dict or None
+        :returns: The stored entry, or None if the page can't be cached.
+        """
+        mark = environ.get(MARK_KEY)
+        counters = environ.get(COUNTERS_KEY, [])
+        if mark is None or (counters and not media_counters.running):
+            # Counters can only be incremented by the middleware when
+            # they're buffered, since it doesn't have a transaction.
+            return None
+        digest = sha1(body).hexdigest()
+        last_modified = mark['last_modified']
+        if last_modified is not None:
+            last_modified = time.mktime(last_modified.timetuple())
+        entry = dict(
+            status = status,
+            headers = [(name, value) for name, value in headers
+                       if name.lower() not in _stored_headers_exclude],
+            body = _gzip(body),
+            etag = '"%s"' % digest,
+            etag_gzip = '"%s-gzip"' % digest,
+            last_modified = last_modified,
+            tags = mark['tags'],
+            counters = counters,
+            created = time.time(),
+        )
+        self.cache.set_value(self.key(environ), entry, expiretime=self.expire)
+        return entry
+
+    def serve(self, entry, environ, start_response):
+        """Respond with the given cached page, or a 304 if it's unchanged."""
+        accept_gzip = 'gzip' in environ.get('HTTP_ACCEPT_ENCODING', '')
+        headers = list(entry['headers'])
+        headers.append(('ETag', accept_gzip and entry['etag_gzip']
+                                or entry['etag']))
+        headers.append(('Vary', 'Accept-Encoding, Accept-Language, Cookie'))
+        if entry['last_modified'] is not None:
+            headers.append(('Last-Modified',
+                            formatdate(entry['last_modified'])))
+
+        if self.is_not_modified(entry, environ):
+            start_response('304 Not Modified',
+                           [(name, value) for name, value in headers
+                            if name.lower() != 'content-type'])
+            return []
+
+        body = entry['body']
+        if accept_gzip:
+            headers.append(('Content-Encoding', 'gzip'))
+        else:
+            body = _gunzip(body)
+        headers.append(('Content-Length', str(len(body))))
+        start_response(entry['status'], headers)
+        return [body]
+
+    def is_not_modified(self, entry, environ):
+        """Return True if the client's copy of the page is current."""
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            etags = set()
+            for etag in if_none_match.split(','):
+                etag = etag.strip()
+                if etag.startswith('W/'):
+                    etag = etag[2:]
+                etags.add(etag)
+            return '*' in etags or entry['etag'] in etags \
+                or entry['etag_gzip'] in etags
+        if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since and entry['last_modified'] is not None:
+            parsed = parsedate_tz(if_modified_since.split(';')[0])
+            if parsed is not None:
+                return int(entry['last_modified']) <= mktime_tz(parsed)
+        return False
+
+    def mark(self, tags, last_modified=None):
+        """Mark the response to the current request as cacheable.
+
+        :param tags: A dict of the cache tag versions the page depends on.
+        :param last_modified: The latest modification date of the
+            entities the page shows.
+        :type last_modified: :class:`datetime.datetime` or None
+        """
+        if self.cache is not None:
+            request.environ[MARK_KEY] = dict(tags=tags,
+                                             last_modified=last_modified)
+
+    def increment_on_hit(self, media_id, name):
+        """Increment a media counter whenever this page is served from cache.
+
+        :param media_id: A :attr:`mediacore.model.media.Media.id`.
+        :param name: One of :data:`mediacore.lib.counters.COUNTER_COLUMNS`.
+        """
+        if self.cache is not None:
+            request.environ.setdefault(COUNTERS_KEY, []).append(
+                (media_id, name))
+
+    def replay_counters(self, entry):
+        """Increment the counters of a page that's served from cache."""
+        for media_id, name in entry['counters']:
+            media_counters.increment(media_id, name)
+
+page_cache = PageCache()
+
+def find_last_modified(result):
+    """Return the latest modified_on date of the entities in an action result.
+
+    Only values of the result dict and the items of lists, such as the
+    current page of a paginated listing, are checked. Queries aren't run.
+
+    :param result: The dict returned by an action.
+    :rtype: :class:`datetime.datetime` or None
+    """
+    latest = None
+    if not isinstance(result, dict):
+        return latest
+    for value in result.itervalues():
+        if isinstance(value, (list, tuple)):
+            items = value
+        else:
+            items = [value]
+        for item in items:
+            modified_on = getattr(item, 'modified_on', None)
+            if isinstance(modified_on, datetime) \
+            and (latest is None or modified_on > latest):
+                latest = modified_on
+    return latest
+
+class PageCacheMiddleware(object):
+    """Answer anonymous GET requests from the :class:`PageCache`.
+
+    Responses to requests which aren't in the cache are buffered only if
+    they were marked as cacheable by the time they're started, so large
+    files are still streamed.
+    """
+    def __init__(self, app, page_cache=page_cache):
+        self.app = app
+        self.page_cache = page_cache
+
+    def __call__(self, environ, start_response):
+        cache = self.page_cache
+        if not cache.is_cacheable_request(environ):
+            return self.app(environ, start_response)
+
+        entry = cache.get(environ)
+        if entry is not None:
+            cache_stats.incr('page_cache', 'hit')
+            cache.replay_counters(entry)
+            return cache.serve(entry, environ, start_response)
+        cache_stats.incr('page_cache', 'miss')
+
+        captured = []
+        written = []
+        state = {'returned': False}
+        def capture_start_response(status, headers, exc_info=None):
+            if exc_info is None and not state['returned'] \
+            and MARK_KEY in environ and status.startswith('200') \
+            and not [name for name, value in headers
+                     if name.lower() in ('set-cookie', 'content-encoding')]:
+                captured[:] = [status, headers]
+                return written.append
+            return start_response(status, headers, exc_info)
+
+        app_iter = self.app(environ, capture_start_response)
+        state['returned'] = True
+        if not captured:
+            return app_iter
+        try:
+            written.extend(app_iter)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+        status, headers = captured
+        body = ''.join(written)
+
+        entry = cache.store(environ, status, headers, body)
+        if entry is None:
+            start_response(status, headers)
+            return [body]
+        cache_stats.incr('page_cache', 'regeneration')
+        return cache.serve(entry, environ, start_response)
+
+def _gzip(data):
+    buf = StringIO()
+    zfile = gzip.GzipFile(mode='wb', fileobj=buf, compresslevel=6)
+    zfile.write(data)
+    zfile.close()
+    return buf.getvalue()
+
+def _gunzip(data):
+    return gzip.GzipFile(mode='rb', fileobj=StringIO(data)).read()
@@ -13,10 +13,16 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import base64
 import inspect
 import warnings
 
+from datetime import datetime
+
+import simplejson
+
 from pylons import request, tmpl_context
+from sqlalchemy import sql
 from webhelpers import paginate as _paginate
 from webhelpers.paginate import get_wrapper
 from webob.multidict import MultiDict
@@ -69,7 +75,8 @@ def partial(*args, **create_time_kwds):
         return func(*args, **kwds)
     return curried_function
 
-def paginate(name, items_per_page=10, use_prefix=False, items_first_page=None):
+def paginate(name, items_per_page=10, use_prefix=False, items_first_page=None,
+             keyset=None, item_count=None):
     """Paginate a given collection.
 
     Duplicates and extends the functionality of :func:`tg.decorators.paginate` to:
@@ -78,6 +85,12 @@ def paginate(name, items_per_page=10, use_prefix=False, items_first_page=None):
           :mod:`sphinx.ext.autodoc` to read docstring.
         * Support our :class:`CustomPage` extension -- used any time
           ``items_first_page`` is provided.
+        * Support cursor pagination with :class:`KeysetPage` -- used when
+          ``keyset`` is provided, the action returns sort keys and a
+          "cursor" parameter was given.
+        * Use a count returned by the action, such as one from
+          :data:`mediacore.lib.count_cache.count_cache`, instead of
+          counting the collection again.
 
     This decorator is mainly exposing the functionality
     of :func:`webhelpers.paginate`.
@@ -115,6 +128,15 @@ def paginate(name, items_per_page=10, use_prefix=False, items_first_page=None):
       items_first_page
         the number of items to be rendered on the first page. Defaults to the
         value of ``items_per_page``
+      keyset
+        the name of a key in the returned dict which holds the sort keys
+        for :class:`KeysetPage`, or None if the collection can't be paged
+        by cursor. Requests with a "cursor" parameter are then paginated
+        by cursor, an empty cursor being the first page. Everything else
+        is paginated by page number, as usual.
+      item_count
+        the name of a key in the returned dict which holds the number of
+        items in the collection, if the action already knows it.
 
     """
     prefix = ""
@@ -122,13 +144,15 @@ def paginate(name, items_per_page=10, use_prefix=False, items_first_page=None):
         prefix = name + "_"
     own_parameters = dict(
         page="%spage" % prefix,
-        items_per_page="%sitems_per_page" % prefix
+        items_per_page="%sitems_per_page" % prefix,
+        cursor="%scursor" % prefix,
         )
     #@decorator
     def _d(f):
         @wraps(f)
         def _w(*args, **kwargs):
             page = int(kwargs.pop(own_parameters["page"], 1))
+            cursor = kwargs.pop(own_parameters["cursor"], None)
             real_items_per_page = int(
                     kwargs.pop(
                             own_parameters['items_per_page'],
@@ -160,24 +184,39 @@ def paginate(name, items_per_page=10, use_prefix=False, items_first_page=None):
                         additional_parameters.add(key, value)
 
                 collection = res[name]
-
-                # Use CustomPage if our extra custom arg was provided
-                if items_first_page is not None:
-                    page_class = CustomPage
+                sort_keys = keyset and res.get(keyset)
+                count = item_count and res.get(item_count)
+
+                if sort_keys and cursor is not None:
+                    page_kwargs = additional_parameters.dict_of_lists()
+                    try:
+                        page = KeysetPage(collection, sort_keys, cursor,
+                            items_per_page=real_items_per_page,
+                            item_count=count, **page_kwargs)
+                    except ValueError:
+                        # A mangled cursor, start again from the beginning
+                        page = KeysetPage(collection, sort_keys, None,
+                            items_per_page=real_items_per_page,
+                            item_count=count, **page_kwargs)
                 else:
-                    page_class = Page
-
-                page = page_class(
-                    collection,
-                    page,
-                    items_per_page=real_items_per_page,
-                    items_first_page=items_first_page,
-                    **additional_parameters.dict_of_lists()
-                    )
-                # wrap the pager so that it will render
-                # the proper page-parameter
-                page.pager = partial(page.pager,
-                        page_param=own_parameters["page"])
+                    # Use CustomPage if our extra custom arg was provided
+                    if items_first_page is not None:
+                        page_class = CustomPage
+                    else:
+                        page_class = Page
+
+                    page = page_class(
+                        collection,
+                        page,
+                        items_per_page=real_items_per_page,
+                        items_first_page=items_first_page,
+                        item_count=count,
+                        **additional_parameters.dict_of_lists()
+                        )
+                    # wrap the pager so that it will render
+                    # the proper page-parameter
+                    page.pager = partial(page.pager,
+                            page_param=own_parameters["page"])
                 res[name] = page
                 # this is a bit strange - it appears
                 # as if c returns an empty
@@ -391,3 +430,152 @@ class CustomPage(Page):
         # This is a subclass of the 'list' type. Initialise the list now.
         list.__init__(self, self.items)
 
+
+
+def encode_cursor(values):
+    """Return an opaque continuation token for the given sort key values.
+
+    :param values: The sort key values of the last item on a page.
+    :type values: list
+    :rtype: str
+    """
+    def _encode(value):
+        if isinstance(value, datetime):
+            return {'dt': list(value.timetuple()[:6]) + [value.microsecond]}
+        return value
+    data = simplejson.dumps([_encode(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+def decode_cursor(cursor):
+    """Return the sort key values encoded by :func:`encode_cursor`.
+
+    :param cursor: A continuation token, or None for the first page.
+    :type cursor: str or None
+    :rtype: list or None
+    :raises ValueError: If the cursor is malformed.
+    """
+    if not cursor:
+        return None
+    def _decode(value):
+        if isinstance(value, dict):
+            return datetime(*value['dt'])
+        return value
+    try:
+        cursor = str(cursor)
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = simplejson.loads(data)
+        if not isinstance(values, list):
+            raise ValueError('Expected a list')
+        return [_decode(v) for v in values]
+    except (TypeError, ValueError, KeyError, UnicodeError), e:
+        raise ValueError('Invalid cursor %r: %s' % (cursor, e))
+
+def cursor_for(item, sort_keys):
+    """Return the cursor for the page that follows the given item.
+
+    :param item: A mapped instance.
+    :param sort_keys: A list of (attribute, 'asc' or 'desc') tuples.
+    :rtype: str
+    """
+    return encode_cursor([getattr(item, attr.key) for attr, d in sort_keys])
+
+def keyset_filter(query, sort_keys, values):
+    """Filter the query to the rows that sort after the given values.
+
+    For sort keys (a desc, b desc) this is equivalent to
+    ``(a, b) < (va, vb)``, expanded for databases which can't compare
+    row values, with a redundant ``a <= va`` so that an index on ``a``
+    can be used for a range scan.
+
+    :param query: A query or select.
+    :param sort_keys: A list of (column, 'asc' or 'desc') tuples.
+    :param values: The sort key values of the last row already seen.
+    :raises ValueError: If the number of values doesn't match.
+    """
+    if len(values) != len(sort_keys):
+        raise ValueError('Expected %d cursor values, got %d'
+                         % (len(sort_keys), len(values)))
+    clauses = []
+    for i, (column, direction) in enumerate(sort_keys):
+        if direction == 'desc':
+            after = column < values[i]
+        else:
+            after = column > values[i]
+        equal = [col == value for (col, d), value
+                 in zip(sort_keys[:i], values[:i])]
+        clauses.append(sql.and_(*(equal + [after])))
+    first, direction = sort_keys[0]
+    if direction == 'desc':
+        bound = first <= values[0]
+    else:
+        bound = first >= values[0]
+    return query.filter(sql.and_(bound, sql.or_(*clauses)))
+
+class KeysetPage(list):
+    """One page of a collection, continuing on from an opaque cursor.
+
+    Rather than skipping over the preceding rows with an OFFSET, each page
+    filters for the rows that sort after the last item on the previous
+    page. Every page is as cheap to fetch as the first, but there are no
+    page numbers to jump to, only the next page.
+
+    The collection must be an SQLAlchemy ORM query. It is reordered by
+    the sort keys, the last of which must be unique (such as the primary
+    key), and none of which may be NULL.
+
+    Instance attributes:
+
+    original_collection
+        Points to the collection object being paged through
+
+    sort_keys
+        A list of (attribute, 'asc' or 'desc') tuples
+
+    cursor
+        The cursor this page was fetched with, or None for the first page
+
+    next_cursor
+        The cursor for the next page, or None if this is the last page
+
+    items_per_page
+        Maximal number of items displayed on a page
+
+    item_count
+        Number of items in the collection, if it was passed in. Counting
+        every time would defeat the purpose.
+
+    items
+        Sequence of items on the current page
+
+    """
+    page = None
+    """Cursor pages aren't numbered."""
+
+    page_count = None
+    """Cursor pages aren't counted."""
+
+    def __init__(self, collection, sort_keys, cursor=None, items_per_page=20,
+                 item_count=None, **kwargs):
+        self.kwargs = kwargs
+        self.original_collection = collection
+        self.sort_keys = sort_keys
+        self.cursor = cursor or None
+        self.items_per_page = items_per_page
+        self.item_count = item_count
+
+        query = collection.order_by(None)\
+            .order_by(*[getattr(attr, direction)()
+                        for attr, direction in sort_keys])
+        values = decode_cursor(self.cursor)
+        if values is not None:
+            query = keyset_filter(query, sort_keys, values)
+
+        # Fetch one extra item to find out if there's a next page
+        items = query.limit(items_per_page + 1).all()
+        self.items = items[:items_per_page]
+        if len(items) > items_per_page:
+            self.next_cursor = cursor_for(self.items[-1], sort_keys)
+        else:
+            self.next_cursor = None
+
+        list.__init__(self, self.items)
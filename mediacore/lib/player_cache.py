@@ -0,0 +1,127 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Rendered Player Cache
+
+The player markup rendered by :func:`mediacore.lib.players.media_player`
+only depends on the media, its files, the enabled players and the options
+it's called with, but picking a player and rendering its template costs
+more than the rest of the media page does. :class:`PlayerCache` keeps the
+rendered markup in a Beaker cache that's shared by all workers.
+
+Entries are keyed on the media and its modification date, the options,
+the current locale and the application URL, and depend on the
+``media:<id>``, ``players`` and ``settings`` tags of
+:mod:`mediacore.lib.cache_tags`. Saving a file of the media or any player
+preferences therefore renders the player again. Entries also expire after
+``player_cache_expire`` seconds, to pick up changes to the storage
+engines.
+
+"""
+import time
+
+from genshi.core import Markup
+from pylons import request, translator
+
+from mediacore.lib.cache_stats import cache_stats
+from mediacore.lib.cache_tags import cache_tags
+from mediacore.lib.compat import sha1
+from mediacore.plugin import events
+
+__all__ = ['PlayerCache', 'player_cache']
+
+class PlayerCache(object):
+    """Cache rendered player markup.
+
+    Players are only cached once :meth:`configure` has been called.
+
+    :param expire: The number of seconds to keep a player for.
+
+    """
+    def __init__(self, expire=3600):
+        self.expire = expire
+        self.cache = None
+
+    def configure(self, cache_manager, type='file', expire=None):
+        """Store players in the given Beaker cache manager.
+
+        :param cache_manager: A :class:`beaker.cache.CacheManager`.
+        :param type: The type of Beaker cache to use. Memory caches
+            aren't shared between processes.
+        :param expire: Optionally override the expiry time in seconds.
+        """
+        if expire is not None:
+            self.expire = int(expire)
+        self.cache = cache_manager.get_cache('player_cache', type=type)
+
+    def key(self, media, options):
+        """Return the cache key for the given media and player options.
+
+        :param media: A :class:`~mediacore.model.media.Media` instance.
+        :param options: A dict of the arguments the player is rendered
+            with.
+        :rtype: str
+        """
+        locale = getattr(translator._current_obj(), 'locale', None)
+        text = repr((media.id, str(media.modified_on),
+                     sorted(options.iteritems()), str(locale),
+                     request.application_url))
+        return sha1(text).hexdigest()
+
+    def render(self, media, options, render_func):
+        """Return the player markup for the given media, from cache if possible.
+
+        :param media: A :class:`~mediacore.model.media.Media` instance.
+        :param options: A dict of keyword arguments for `render_func`.
+        :param render_func: A callable which takes the media and the
+            options and returns the rendered markup, or None if the media
+            can't be played.
+        :rtype: :class:`genshi.core.Markup` or None
+        """
+        if self.cache is None or media.id is None:
+            return render_func(media, **options)
+        # A page that's being cached depends on the player too
+        cache_tags.depend_on('players', 'media:%d' % media.id)
+        key = self.key(media, options)
+        try:
+            entry = self.cache.get_value(key, expiretime=self.expire)
+        except KeyError:
+            entry = None
+        if entry is not None and time.time() - entry['created'] < self.expire \
+        and cache_tags.is_current(entry['tags']):
+            cache_stats.incr('player_cache', 'hit')
+            return Markup(entry['markup'])
+        cache_stats.incr('player_cache', 'miss')
+
+        # The player settings are read while rendering, so the entry
+        # depends on them whether or not they're a global tag.
+        markup, versions = cache_tags.collect(
+            lambda: render_func(media, **options),
+            ['settings', 'players', 'media:%d' % media.id])
+        if markup is not None:
+            self.cache.set_value(key, dict(markup=unicode(markup),
+                                           tags=versions,
+                                           created=time.time()),
+                                 expiretime=self.expire)
+            cache_stats.incr('player_cache', 'regeneration')
+        return markup
+
+player_cache = PlayerCache()
+
+@events.observes(events.PlayerPrefs.after_insert,
+                 events.PlayerPrefs.after_update,
+                 events.PlayerPrefs.after_delete)
+def _invalidate_players(instance):
+    cache_tags.invalidate('players')
@@ -929,6 +929,10 @@ def media_player(media, is_widescreen=False, show_like=True, show_dislike=True,
     :attr:`mediacore.model.players.c.data` dict is passed as kwargs to
     :meth:`AbstractPlayer.__init__`.
 
+    The rendered markup is kept by
+    :data:`mediacore.lib.player_cache.player_cache` until the media, its
+    files or the player preferences change.
+
     :type media: :class:`mediacore.model.media.Media`
     :param media: A media instance to play.
 
@@ -944,10 +948,29 @@ def media_player(media, is_widescreen=False, show_like=True, show_dislike=True,
     :rtype: `str` or `None`
     :returns: A rendered player.
     """
-    uris = media.get_uris()
+    kwargs.update(
+        is_widescreen=is_widescreen, show_like=show_like,
+        show_dislike=show_dislike, show_download=show_download,
+        show_embed=show_embed, show_playerbar=show_playerbar,
+        show_popout=show_popout, show_resize=show_resize,
+        show_share=show_share, js_init=js_init,
+    )
+    return player_cache.render(media, kwargs, _render_media_player)
+
+def _render_media_player(media, is_widescreen, show_like, show_dislike,
+                         show_download, show_embed, show_playerbar,
+                         show_popout, show_resize, show_share, js_init,
+                         **kwargs):
+    """Render the player for :func:`media_player`, bypassing the cache."""
+    playable_by = _playable_by(media)
+    uris = None
 
     # Find the first player that can play any uris
     for player_cls, player_data in fetch_enabled_players():
+        if playable_by is not None and player_cls.name not in playable_by:
+            continue
+        if uris is None:
+            uris = media.get_uris()
         can_play = player_cls.can_play(uris)
         if any(can_play):
             break
@@ -973,7 +996,7 @@ def media_player(media, is_widescreen=False, show_like=True, show_dislike=True,
         'show_popout': show_popout,
         'show_resize': show_resize and player.supports_resizing,
         'show_share': show_share,
-    })
+    }, method='xhtml')
 
 def pick_podcast_media_file(media):
     """Return a file playable in the most podcasting client: iTunes.
@@ -981,6 +1004,9 @@ def pick_podcast_media_file(media):
     :param media: A :class:`~mediacore.model.media.Media` instance.
     :returns: A :class:`~mediacore.model.media.MediaFile` object or None
     """
+    playable_by = _playable_by(media)
+    if playable_by is not None and iTunesPlayer.name not in playable_by:
+        return None
     uris = media.get_uris()
     for i, plays in enumerate(iTunesPlayer.can_play(uris)):
         if plays:
@@ -993,13 +1019,36 @@ def pick_any_media_file(media):
     :param media: A :class:`~mediacore.model.media.Media` instance.
     :returns: A :class:`~mediacore.model.media.MediaFile` object or None
     """
-    uris = media.get_uris()
+    playable_by = _playable_by(media)
+    uris = None
     for player_cls, player_data in fetch_enabled_players():
+        if playable_by is not None and player_cls.name not in playable_by:
+            continue
+        if uris is None:
+            uris = media.get_uris()
         for i, plays in enumerate(player_cls.can_play(uris)):
             if plays:
                 return uris[i]
     return None
 
+def playability(uris):
+    """Return which of the registered players can play any of the given URIs.
+
+    :param uris: A list of :class:`~mediacore.lib.storage.StorageURI`.
+    :rtype: dict
+    :returns: Player names mapped to True if they can play any URI.
+    """
+    player_classes = list(AbstractPlayer)
+    player_classes.append(iTunesPlayer)
+    return dict((player_cls.name, any(player_cls.can_play(uris)))
+                for player_cls in player_classes)
+
+def _playable_by(media):
+    """Return the names of the players that can play the media, if known."""
+    if media.playable_by is None:
+        return None
+    return frozenset(media.playable_by.split(u','))
+
 def update_enabled_players():
     """Ensure that the encoding status of all media is up to date with the new
     set of enabled players.
@@ -1030,5 +1079,6 @@ def embed_iframe(media, width=400, height=225, frameborder=0, **kwargs):
 
 embed_player = embed_iframe
 
+from mediacore.lib.player_cache import player_cache
 from mediacore.model.players import fetch_enabled_players
 from mediacore.model import DBSession, Media
@@ -0,0 +1,153 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Random Media Selection
+
+Picking a random row with ORDER BY RAND() scans the whole media table.
+Instead we keep a sorted array of published media IDs in memory, so that
+a random pick is an array index plus a primary key lookup.
+
+The unfiltered array is kept current by observing
+:class:`mediacore.plugin.events.Media`. Arrays filtered by category or tag
+are discarded whenever any media changes and reloaded on demand. All
+arrays are reloaded after ``ttl`` seconds to pick up changes made by other
+processes, and any stale ID we happen to pick is discarded and we try
+again.
+
+"""
+import random
+import threading
+import time
+
+from array import array
+from bisect import bisect_left
+
+from mediacore.model import Media
+from mediacore.plugin import events
+
+__all__ = ['RandomMediaPicker', 'random_media']
+
+class RandomMediaPicker(object):
+    """Pick random published media from cached arrays of IDs.
+
+    :param ttl: The number of seconds to keep an array before reloading it.
+    :param max_pools: The maximum number of filtered arrays to keep.
+
+    """
+    def __init__(self, ttl=300, max_pools=100):
+        self.ttl = ttl
+        self.max_pools = max_pools
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def pick(self, category=None, tag=None, attempts=5):
+        """Return a random published media item.
+
+        :param category: Optionally pick from this category and its
+            descendants.
+        :type category: :class:`~mediacore.model.categories.Category`
+        :param tag: Optionally pick from media with this tag.
+        :type tag: :class:`~mediacore.model.tags.Tag`
+        :param attempts: The number of stale IDs to skip before giving up.
+        :rtype: :class:`~mediacore.model.media.Media` or ``None``
+        """
+        key = (category and category.id, tag and tag.id)
+        for i in xrange(attempts):
+            ids = self._get_pool(key, category, tag)
+            if not ids:
+                return None
+            media_id = ids[random.randrange(len(ids))]
+            media = Media.query.get(media_id)
+            if media is not None and media.live:
+                return media
+            self.discard(media_id)
+        return None
+
+    def add(self, media_id):
+        """Add a newly published media item to the cached arrays."""
+        self._lock.acquire()
+        try:
+            self._clear_filtered()
+            pool = self._pools.get((None, None))
+            if pool is not None:
+                ids = pool[1]
+                i = bisect_left(ids, media_id)
+                if i == len(ids) or ids[i] != media_id:
+                    ids.insert(i, media_id)
+        finally:
+            self._lock.release()
+
+    def discard(self, media_id):
+        """Remove an unpublished or deleted media item from the cached arrays."""
+        self._lock.acquire()
+        try:
+            self._clear_filtered()
+            for loaded_on, ids in self._pools.itervalues():
+                i = bisect_left(ids, media_id)
+                if i < len(ids) and ids[i] == media_id:
+                    del ids[i]
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Discard all cached arrays."""
+        self._lock.acquire()
+        try:
+            self._pools.clear()
+        finally:
+            self._lock.release()
+
+    def _clear_filtered(self):
+        unfiltered = self._pools.get((None, None))
+        self._pools.clear()
+        if unfiltered is not None:
+            self._pools[(None, None)] = unfiltered
+
+    def _get_pool(self, key, category, tag):
+        pool = self._pools.get(key)
+        if pool is not None and time.time() - pool[0] < self.ttl:
+            return pool[1]
+        loaded_on = time.time()
+        ids = self._load(category, tag)
+        self._lock.acquire()
+        try:
+            if len(self._pools) >= self.max_pools:
+                self._clear_filtered()
+            self._pools[key] = (loaded_on, ids)
+        finally:
+            self._lock.release()
+        return ids
+
+    def _load(self, category, tag):
+        query = Media.query.published()
+        if category is not None:
+            query = query.in_category(category)
+        if tag is not None:
+            query = query.filter(Media.tags.contains(tag))
+        query = query.order_by(Media.id)
+        return array('l', (media_id for media_id, in query.values(Media.id)))
+
+random_media = RandomMediaPicker()
+
+@events.observes(events.Media.after_insert, events.Media.after_update)
+def _update_random_media(instance):
+    if instance.live:
+        random_media.add(instance.id)
+    else:
+        random_media.discard(instance.id)
+
+@events.observes(events.Media.after_delete)
+def _discard_random_media(instance):
+    random_media.discard(instance.id)
@@ -0,0 +1,327 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Related Media
+
+The nearest neighbours of each published media item are precomputed into
+the media_related table, so that :meth:`MediaQuery.related
+<mediacore.model.media.MediaQuery.related>` is a single indexed query
+rather than a fulltext search on every page view.
+
+Each media item is represented by a sparse TF-IDF vector over its tags,
+categories and title words, and neighbours are ranked by cosine
+similarity. Features shared by more than ``max_df`` of all media are
+ignored, since they say little about similarity and would make every
+item a candidate for every other.
+
+The whole table is rebuilt by
+``batch-scripts/maintenance/rebuild_related_media.py``. Between rebuilds,
+media that are saved are queued by an :class:`mediacore.plugin.events.Media`
+observer and :meth:`RelatedMediaIndex.update_queued` recomputes only the
+neighbour lists that may have changed.
+
+"""
+import logging
+import math
+import re
+import threading
+import time
+
+from heapq import nlargest
+
+from sqlalchemy import sql
+
+from mediacore.lib.util import chunks
+from mediacore.model.media import (media, media_categories, media_related,
+    media_tags)
+from mediacore.plugin import events
+
+__all__ = ['RelatedMediaIndex', 'related_media']
+
+log = logging.getLogger(__name__)
+
+TAG_WEIGHT = 1.0
+CATEGORY_WEIGHT = 1.0
+TITLE_WEIGHT = 0.5
+
+_feature_weights = {
+    'tag': TAG_WEIGHT,
+    'category': CATEGORY_WEIGHT,
+    'word': TITLE_WEIGHT,
+}
+
+_word_re = re.compile(r'\w{3,}', re.UNICODE)
+
+def title_words(title):
+    """Return the set of words of three or more letters in a title."""
+    return set(_word_re.findall((title or u'').lower()))
+
+class RelatedMediaIndex(object):
+    """An in-memory feature index for computing related media.
+
+    :param top_k: The number of neighbours to store for each media item.
+    :param max_df: Ignore features shared by more than this fraction of
+        all media.
+    :param min_cutoff: Never ignore features shared by this many media or
+        fewer, so that small libraries aren't left without any features.
+    :param max_age: Reload the index after this many seconds, to pick up
+        changes made by other processes.
+
+    """
+    def __init__(self, top_k=10, max_df=0.2, min_cutoff=50, max_age=3600):
+        self.top_k = top_k
+        self.max_df = max_df
+        self.min_cutoff = min_cutoff
+        self.max_age = max_age
+        self.features = {}
+        self.postings = {}
+        self.loaded_on = None
+        self._norms = {}
+        self._queue = set()
+        self._queue_lock = threading.Lock()
+        self._update_lock = threading.Lock()
+
+    def fetch_features(self, bind, ids=None):
+        """Return the features of live media, by media ID.
+
+        :param bind: The engine or connection to execute with.
+        :param ids: Optionally limit the results to these media IDs.
+        :rtype: dict
+        """
+        features = {}
+        for chunk in ids is None and [None] or chunks(ids):
+            where = [media.c.live == True]
+            if chunk is not None:
+                where.append(media.c.id.in_(chunk))
+            where = sql.and_(*where)
+            for media_id, title in bind.execute(
+                    sql.select([media.c.id, media.c.title], where)):
+                features[media_id] = set(('word', word)
+                                         for word in title_words(title))
+            for table, col, kind in (
+                    (media_tags, media_tags.c.tag_id, 'tag'),
+                    (media_categories, media_categories.c.category_id, 'category')):
+                query = sql.select([table.c.media_id, col],
+                                   sql.and_(table.c.media_id == media.c.id, where))
+                for media_id, feature_id in bind.execute(query):
+                    features[media_id].add((kind, feature_id))
+        return features
+
+    def load(self, bind):
+        """Load the features of all live media."""
+        self.features = {}
+        self.postings = {}
+        self._norms = {}
+        for media_id, features in self.fetch_features(bind).iteritems():
+            self._set_features(media_id, features)
+        self.loaded_on = time.time()
+
+    def _set_features(self, media_id, features):
+        for feature in self.features.pop(media_id, ()):
+            postings = self.postings[feature]
+            postings.discard(media_id)
+            if not postings:
+                del self.postings[feature]
+        if features:
+            self.features[media_id] = features
+            for feature in features:
+                self.postings.setdefault(feature, set()).add(media_id)
+        self._norms = {}
+
+    def weight(self, feature):
+        """Return the TF-IDF weight of the given feature.
+
+        Features are present or absent, so the term frequency is always 1.
+        """
+        total = len(self.features)
+        df = len(self.postings.get(feature, ()))
+        if not df or df > max(self.max_df * total, self.min_cutoff):
+            return 0.0
+        return _feature_weights[feature[0]] * math.log(float(total) / df + 1)
+
+    def norm(self, media_id):
+        """Return the length of the given media item's feature vector."""
+        norm = self._norms.get(media_id)
+        if norm is None:
+            norm = math.sqrt(sum(self.weight(f) ** 2
+                                 for f in self.features.get(media_id, ())))
+            self._norms[media_id] = norm
+        return norm
+
+    def similarities(self, media_id):
+        """Return the cosine similarity of all media which share a feature.
+
+        :rtype: dict
+        :returns: Similarity scores by media ID.
+        """
+        norm = self.norm(media_id)
+        if not norm:
+            return {}
+        dots = {}
+        for feature in self.features.get(media_id, ()):
+            weight = self.weight(feature)
+            if not weight:
+                continue
+            weight *= weight
+            for other_id in self.postings[feature]:
+                dots[other_id] = dots.get(other_id, 0.0) + weight
+        dots.pop(media_id, None)
+        return dict((other_id, dot / (norm * self.norm(other_id)))
+                    for other_id, dot in dots.iteritems())
+
+    def neighbours(self, media_id):
+        """Return the ``top_k`` most similar media and their scores.
+
+        :rtype: list of tuples
+        """
+        scores = self.similarities(media_id)
+        return nlargest(self.top_k, scores.iteritems(), key=lambda x: x[1])
+
+    def rebuild(self, bind):
+        """Recompute the neighbours of all media.
+
+        :param bind: The engine or connection to execute with.
+        :rtype: int
+        :returns: The number of media with related media.
+        """
+        self.load(bind)
+        bind.execute(media_related.delete())
+        return self._write(bind, self.features.keys(), delete=False)
+
+    def queue(self, media_id):
+        """Queue the given media item for :meth:`update_queued`."""
+        self._queue_lock.acquire()
+        try:
+            self._queue.add(media_id)
+        finally:
+            self._queue_lock.release()
+
+    def update_queued(self, bind):
+        """Update the neighbours affected by the queued media.
+
+        This is run periodically by a
+        :class:`mediacore.lib.scheduler.PeriodicTask`.
+        """
+        self._queue_lock.acquire()
+        try:
+            ids, self._queue = self._queue, set()
+        finally:
+            self._queue_lock.release()
+        if not ids:
+            return
+        conn = bind.connect()
+        try:
+            trans = conn.begin()
+            try:
+                updated = self.update(conn, ids)
+                trans.commit()
+            except:
+                trans.rollback()
+                raise
+        except Exception:
+            self._queue_lock.acquire()
+            try:
+                self._queue.update(ids)
+            finally:
+                self._queue_lock.release()
+            raise
+        finally:
+            conn.close()
+        if updated:
+            log.info('Updated the related media of %d media', updated)
+
+    def update(self, bind, ids):
+        """Update the neighbours of the given media and any affected by them.
+
+        Affected media are those which currently list one of the given
+        media as related, and those that the given media are now similar
+        enough to displace from their current neighbours.
+
+        :param bind: The engine or connection to execute with.
+        :param ids: The IDs of media whose features may have changed.
+        :rtype: int
+        :returns: The number of neighbour lists that were rewritten.
+        """
+        self._update_lock.acquire()
+        try:
+            new_features = self.fetch_features(bind, ids)
+            if self.loaded_on is None \
+            or time.time() - self.loaded_on > self.max_age:
+                # A fresh load already holds the new features, so there
+                # is nothing to compare them with.
+                self.load(bind)
+                changed = list(ids)
+            else:
+                changed = [media_id for media_id in ids
+                           if self.features.get(media_id) != new_features.get(media_id)]
+            if not changed:
+                return 0
+            affected = set(changed)
+            for chunk in chunks(changed):
+                affected.update(media_id for media_id, in bind.execute(
+                    sql.select([media_related.c.media_id],
+                               media_related.c.related_id.in_(chunk))))
+            for media_id in changed:
+                self._set_features(media_id, new_features.get(media_id))
+
+            candidates = {}
+            for media_id in changed:
+                for other_id, score in self.similarities(media_id).iteritems():
+                    if other_id not in affected:
+                        candidates[other_id] = max(score,
+                                                   candidates.get(other_id, 0.0))
+            for chunk in chunks(candidates):
+                rows = bind.execute(sql.select(
+                    [media_related.c.media_id,
+                     sql.func.count(media_related.c.related_id),
+                     sql.func.min(media_related.c.score)],
+                    media_related.c.media_id.in_(chunk),
+                    group_by=[media_related.c.media_id],
+                ))
+                current = dict((row[0], row[1:]) for row in rows)
+                for other_id in chunk:
+                    count, lowest = current.get(other_id, (0, None))
+                    if count < self.top_k or candidates[other_id] > lowest:
+                        affected.add(other_id)
+            return self._write(bind, affected)
+        finally:
+            self._update_lock.release()
+
+    def _write(self, bind, ids, delete=True):
+        written = 0
+        insert = media_related.insert()
+        for chunk in chunks(ids):
+            if delete:
+                bind.execute(media_related.delete(
+                    media_related.c.media_id.in_(chunk)))
+            rows = []
+            for media_id in chunk:
+                neighbours = self.neighbours(media_id)
+                if neighbours:
+                    written += 1
+                rows.extend({'media_id': media_id,
+                             'related_id': related_id,
+                             'score': score}
+                            for related_id, score in neighbours)
+            if rows:
+                bind.execute(insert, rows)
+        return written
+
+related_media = RelatedMediaIndex()
+
+@events.observes(events.Media.after_insert, events.Media.after_update,
+                 events.Media.after_delete)
+def _queue_related_media(instance):
+    related_media.queue(instance.id)
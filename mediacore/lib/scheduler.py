@@ -0,0 +1,287 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Publication Scheduler
+
+:attr:`mediacore.model.media.Media.live` is a materialized flag, so
+something has to flip it when a publish_on or publish_until date is
+reached. Each worker process runs a :class:`PublicationScheduler` thread
+that sleeps until the next such boundary, or until it is told about a new
+one by :meth:`PublicationScheduler.schedule`, and polls at a regular
+interval to pick up changes made by other processes.
+
+Each flag is flipped, and counted in the published media counts of its
+tags and categories, only by the worker that gets there first, so it
+doesn't matter which one does.
+
+Other maintenance jobs, such as recalculating popularity scores, are run
+at a fixed interval by a :class:`PeriodicTask`.
+
+"""
+import errno
+import heapq
+import logging
+import os
+import threading
+import time
+
+from datetime import datetime, timedelta
+
+from mediacore.lib.count_cache import count_cache
+
+__all__ = ['PeriodicTask', 'PublicationScheduler', 'publication_scheduler']
+
+log = logging.getLogger(__name__)
+
+def _seconds(delta):
+    """Return the given :class:`datetime.timedelta` in seconds."""
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1e6
+
+class PublicationScheduler(object):
+    """Background thread which keeps the live flag of all media current.
+
+    :param poll_interval: The maximum number of seconds to sleep between
+        updates, to catch boundaries that were scheduled in another process.
+    :type poll_interval: int
+
+    """
+    def __init__(self, poll_interval=60):
+        self.poll_interval = poll_interval
+        self.bind = None
+        self._thread = None
+        self._stopped = False
+        self._wakeups = []
+        self._condition = threading.Condition()
+
+    def start(self, bind, poll_interval=None):
+        """Start the scheduler thread, if it isn't running already.
+
+        :param bind: The engine to connect to the database with.
+        :param poll_interval: Optionally override the poll interval.
+        """
+        if self._thread is not None:
+            return
+        self.bind = bind
+        if poll_interval is not None:
+            self.poll_interval = int(poll_interval)
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run,
+                                        name='PublicationScheduler')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the scheduler thread and wait for it to exit."""
+        self._condition.acquire()
+        try:
+            self._stopped = True
+            self._condition.notify()
+        finally:
+            self._condition.release()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def schedule(self, when):
+        """Update the live flags at the given time.
+
+        This may be called when the scheduler isn't running, in which case
+        it's a no-op.
+
+        :type when: :class:`datetime.datetime`
+        """
+        if self._thread is None:
+            return
+        self._condition.acquire()
+        try:
+            heapq.heappush(self._wakeups, when)
+            self._condition.notify()
+        finally:
+            self._condition.release()
+
+    def run_once(self, now=None):
+        """Flip the live flag for any media whose state has changed.
+
+        :param now: The time to check against, defaults to now.
+        :rtype: :class:`datetime.datetime` or ``None``
+        :returns: The next time a flag must be flipped, if known.
+        """
+        from mediacore.lib.cache_tags import cache_tags, media_dependencies
+        from mediacore.lib.related import related_media
+        from mediacore.lib.search import get_backends
+        from mediacore.model.media import next_live_boundary, update_live_flags
+        if now is None:
+            now = datetime.now()
+        flipped = []
+        conn = self.bind.connect()
+        try:
+            trans = conn.begin()
+            try:
+                updated = update_live_flags(conn, now, flipped)
+                boundary = next_live_boundary(conn, now)
+                trans.commit()
+            except:
+                trans.rollback()
+                raise
+        finally:
+            conn.close()
+        if updated:
+            log.info('Updated the publication state of %d media', updated)
+            count_cache.invalidate()
+            if cache_tags.cache is not None:
+                cache_tags.invalidate(*media_dependencies(self.bind, flipped))
+            # Only live media have related media or are publicly searchable,
+            # and no events are fired
+            for media_id in flipped:
+                related_media.queue(media_id)
+                for backend in get_backends():
+                    backend.queue('media', media_id)
+        # Media remain live for the entire second of their publish_until date,
+        # so try again shortly after rather than spinning on the same second.
+        if boundary is not None and boundary <= now:
+            boundary = now + timedelta(seconds=1)
+        return boundary
+
+    def _run(self):
+        boundary = None
+        next_poll = datetime.now()
+        while True:
+            self._condition.acquire()
+            try:
+                while not self._stopped:
+                    now = datetime.now()
+                    due = [next_poll]
+                    if boundary is not None:
+                        due.append(boundary)
+                    if self._wakeups:
+                        due.append(self._wakeups[0])
+                    due = min(due)
+                    if due <= now:
+                        break
+                    self._condition.wait(_seconds(due - now))
+                if self._stopped:
+                    return
+                while self._wakeups and self._wakeups[0] <= now:
+                    heapq.heappop(self._wakeups)
+            finally:
+                self._condition.release()
+
+            try:
+                boundary = self.run_once(now)
+            except Exception:
+                log.exception('Failed to update the publication state of media')
+                boundary = None
+            next_poll = now + timedelta(seconds=self.poll_interval)
+
+publication_scheduler = PublicationScheduler()
+
+class PeriodicTask(object):
+    """Background thread which calls a function at a fixed interval.
+
+    When a lock file is given, the last run time is recorded by touching
+    it, so that only one of the worker processes sharing the file runs the
+    task each interval.
+
+    :param name: A name for the thread and log messages.
+    :param func: A callable which takes the bind to execute with.
+
+    """
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+        self.bind = None
+        self.interval = None
+        self.lock_path = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self, bind, interval, lock_path=None):
+        """Start the task thread, if it isn't running already.
+
+        :param bind: The engine to pass to the task.
+        :param interval: The number of seconds between runs.
+        :param lock_path: An optional file to coordinate processes with.
+        """
+        if self._thread is not None:
+            return
+        self.bind = bind
+        self.interval = int(interval)
+        self.lock_path = lock_path
+        if lock_path:
+            lock_dir = os.path.dirname(lock_path)
+            if not os.path.exists(lock_dir):
+                os.makedirs(lock_dir)
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the task thread and wait for it to exit."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def run_once(self):
+        """Run the task now, unless another process ran it recently.
+
+        :rtype: bool
+        :returns: True if the task was run.
+        """
+        if self.lock_path and not self._claim():
+            return False
+        start = time.time()
+        self.func(self.bind)
+        log.info('%s finished in %.1f seconds', self.name, time.time() - start)
+        return True
+
+    def _claim(self):
+        """Claim this interval's run by touching the lock file.
+
+        The file is opened exclusively when it doesn't exist yet, and an
+        existing file is only claimed by renaming it out of the way, so at
+        most one process wins each interval.
+        """
+        try:
+            last_run = os.path.getmtime(self.lock_path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+        else:
+            if time.time() - last_run < self.interval:
+                return False
+            claimed_path = '%s.%d' % (self.lock_path, os.getpid())
+            try:
+                os.rename(self.lock_path, claimed_path)
+            except OSError:
+                return False
+            os.remove(claimed_path)
+        try:
+            fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError:
+            return False
+        os.close(fd)
+        return True
+
+    def _run(self):
+        while not self._stopped.isSet():
+            self._stopped.wait(self.interval)
+            if self._stopped.isSet():
+                break
+            try:
+                self.run_once()
+            except Exception:
+                log.exception('%s failed', self.name)
@@ -0,0 +1,203 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Media Search Backends
+
+:meth:`MediaQuery.search <mediacore.model.media.MediaQuery.search>` and
+:meth:`MediaQuery.admin_search <mediacore.model.media.MediaQuery.admin_search>`
+hand off to the first available :class:`SearchBackend`, which is chosen
+once per database engine. If a preferred backend was unavailable, they are
+checked again every :data:`RECHECK_INTERVAL` seconds, so that an index
+built while the app is running is used straight away:
+
+* :class:`~mediacore.lib.search.mysql.MySQLFulltextSearch` uses the
+  FULLTEXT indexes on media_fulltext, when MySQL is keeping it populated.
+* :class:`~mediacore.lib.search.native.InvertedIndexSearch` uses an
+  on-disk inverted index with BM25 ranking, for any other database. It is
+  built by ``batch-scripts/maintenance/rebuild_search_index.py``.
+* :class:`LikeSearch` is the last resort: a LIKE match on the title.
+
+The ``search_backend`` config option may name a backend type to use
+instead of picking automatically.
+
+"""
+import logging
+import time
+
+from operator import attrgetter
+
+from pylons import config
+
+from mediacore.plugin import events
+from mediacore.plugin.abc import AbstractClass, abstractmethod, abstractproperty
+#from mediacore.model import Media XXX: Import at EOF
+
+__all__ = ['SearchBackend', 'get_search_backend']
+
+log = logging.getLogger(__name__)
+
+INDEX_NAMES = ('public', 'admin')
+"""The search indexes: one for the public site and one for the admin."""
+
+RECHECK_INTERVAL = 30
+"""Seconds between checks for a preferred backend that was unavailable."""
+
+class SearchBackend(AbstractClass):
+    """
+    Base class for all media search implementations.
+    """
+
+    backend_type = abstractproperty()
+    """A unique identifying string for the backend."""
+
+    priority = 100
+    """Backends with a lower priority are tried first."""
+
+    def configure(self, config):
+        """Read any settings the backend needs from the app config.
+
+        :param config: The Pylons config dict.
+        """
+
+    @abstractmethod
+    def is_available(self, bind):
+        """Return True if this backend can search the given database.
+
+        The result is cached per engine. Unavailable backends are checked
+        again every :data:`RECHECK_INTERVAL` seconds.
+
+        :param bind: An engine or connection.
+        :rtype: bool
+        """
+
+    @abstractmethod
+    def search(self, query, index, search, bool=False, order_by=True):
+        """Filter the given media query to the search results.
+
+        :param query: A :class:`~mediacore.model.media.MediaQuery`.
+        :param index: One of :data:`INDEX_NAMES`.
+        :param search: The search string.
+        :param bool: True to interpret operators such as + and -.
+        :param order_by: True to order the results by relevance.
+        :rtype: :class:`~mediacore.model.media.MediaQuery`
+        """
+
+    def queue(self, kind, id):
+        """Note that a media item, tag or category has been modified.
+
+        Backends which maintain their own index should update it the
+        next time :meth:`update_queued` is called.
+
+        :param kind: 'media', 'tag' or 'category'.
+        :param id: The ID of the modified row.
+        """
+
+    def update_queued(self, bind):
+        """Update the index for any queued changes.
+
+        :param bind: The engine to read the changes with.
+        """
+
+    def rebuild(self, bind):
+        """Rebuild the index from scratch, if there is one.
+
+        :param bind: The engine or connection to read the media with.
+        :rtype: int
+        :returns: The number of media indexed.
+        """
+        return 0
+
+class LikeSearch(SearchBackend):
+    """
+    A very rudimentary search of media titles.
+    """
+    backend_type = 'like'
+    priority = 1000
+
+    def is_available(self, bind):
+        return True
+
+    def search(self, query, index, search, bool=False, order_by=True):
+        return query.filter(Media.title.like("%%%s%%" % search))
+
+_instances = {}
+_engine_backends = {}
+
+def get_backends(app_config=None):
+    """Return an instance of every registered backend, in priority order.
+
+    :param app_config: The config to configure new instances with,
+        defaults to :data:`pylons.config`.
+    :rtype: list
+    """
+    for cls in SearchBackend:
+        if cls not in _instances:
+            _instances[cls] = cls()
+            _instances[cls].configure(app_config or config)
+    return sorted(_instances.itervalues(), key=attrgetter('priority'))
+
+def get_search_backend(bind):
+    """Return the backend to search the given database with.
+
+    :param bind: An engine or connection.
+    :rtype: :class:`SearchBackend`
+    """
+    engine = getattr(bind, 'engine', bind)
+    backend, recheck_on = _engine_backends.get(engine, (None, None))
+    if backend is None \
+    or recheck_on is not None and time.time() >= recheck_on:
+        wanted = config.get('search_backend', 'auto')
+        candidates = [candidate for candidate in get_backends()
+                      if wanted in ('auto', candidate.backend_type)]
+        for candidate in candidates:
+            if candidate.is_available(bind):
+                backend = candidate
+                break
+        else:
+            if backend is None:
+                log.warn('The %r search backend is unavailable', wanted)
+            backend = get_backends()[-1]
+        recheck_on = None
+        if not candidates or backend is not candidates[0]:
+            recheck_on = time.time() + RECHECK_INTERVAL
+        _engine_backends[engine] = backend, recheck_on
+    return backend
+
+def update_search_indexes(bind):
+    """Update the indexes of every backend for any queued changes."""
+    for backend in get_backends():
+        backend.update_queued(bind)
+
+@events.observes(events.Media.after_insert, events.Media.after_update,
+                 events.Media.after_delete)
+def _queue_media(instance):
+    for backend in get_backends():
+        backend.queue('media', instance.id)
+
+@events.observes(events.Tag.after_update)
+def _queue_tag(instance):
+    for backend in get_backends():
+        backend.queue('tag', instance.id)
+
+@events.observes(events.Category.after_update)
+def _queue_category(instance):
+    for backend in get_backends():
+        backend.queue('category', instance.id)
+
+from mediacore.lib.search.mysql import MySQLFulltextSearch
+from mediacore.lib.search.native import InvertedIndexSearch
+from mediacore.model import Media
+
+SearchBackend.register(LikeSearch)
@@ -0,0 +1,478 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+On-disk Inverted Index
+
+An :class:`InvertedIndex` is made up of two files:
+
+``<name>.idx``
+    The compacted index. A zlib compressed JSON header holds the length of
+    each document and the offset of each term's posting list, followed by
+    the posting lists themselves. Each posting list is a sequence of
+    varint encoded (document ID gap, term frequency) pairs.
+
+``<name>.journal``
+    Documents which have been added, changed or removed since the index
+    was compacted, one JSON list per line. Every process replays any new
+    lines before it searches, so changes made in one worker are seen by
+    all of them.
+
+Both are replaced atomically when the index is written or compacted, and
+writers hold an exclusive lock on ``<name>.lock`` while they do so.
+
+"""
+import fcntl
+import math
+import os
+import re
+import struct
+import threading
+import zlib
+
+from bisect import bisect_left
+
+import simplejson
+
+__all__ = ['InvertedIndex', 'parse_query', 'tokenize']
+
+MAGIC = 'MCIDX1\n'
+MIN_TOKEN_LENGTH = 2
+
+_token_re = re.compile(r'\w+', re.UNICODE)
+_query_re = re.compile(r'([+-]?)(?:"([^"]*)"?|(\S+))', re.UNICODE)
+
+def tokenize(text):
+    """Split the given text into lowercase words."""
+    return [token for token in _token_re.findall((text or u'').lower())
+            if len(token) >= MIN_TOKEN_LENGTH]
+
+def parse_query(search, bool=False):
+    """Parse a search string into required, optional and excluded terms.
+
+    In boolean mode, words prefixed with ``+`` or joined by ``AND`` are
+    required, words prefixed with ``-`` or ``NOT`` are excluded, and a
+    trailing ``*`` matches any word beginning with the given prefix.
+    All words of a quoted phrase are required. Other words are optional,
+    as in MySQL's boolean mode.
+
+    :rtype: tuple
+    :returns: Three lists of (term, is_prefix) tuples: the required,
+        optional and excluded terms.
+    """
+    if not bool:
+        return [], [(term, False) for term in tokenize(search)], []
+
+    clauses = []
+    for op, phrase, word in _query_re.findall(search):
+        if phrase:
+            clauses.append(['+', [(term, False) for term in tokenize(phrase)]])
+        elif not op and word in ('AND', 'OR', 'NOT'):
+            clauses.append([word, []])
+        else:
+            prefix = word.endswith('*')
+            terms = [(term, False) for term in tokenize(word.rstrip('*'))]
+            if terms and prefix:
+                terms[-1] = (terms[-1][0], True)
+            clauses.append([op, terms])
+
+    for i, (op, terms) in enumerate(clauses):
+        if op == 'AND':
+            for j in (i - 1, i + 1):
+                if 0 <= j < len(clauses) and not clauses[j][0]:
+                    clauses[j][0] = '+'
+        elif op == 'NOT' and i + 1 < len(clauses):
+            clauses[i + 1][0] = '-'
+
+    required, optional, excluded = [], [], []
+    for op, terms in clauses:
+        if op == '+':
+            required.extend(terms)
+        elif op == '-':
+            excluded.extend(terms)
+        elif not op:
+            optional.extend(terms)
+    return required, optional, excluded
+
+def _encode_postings(postings):
+    """Encode a sorted list of (document ID, frequency) pairs."""
+    out = []
+    last = 0
+    for doc_id, freq in postings:
+        for value in (doc_id - last, freq):
+            while value >= 0x80:
+                out.append(chr(value & 0x7f | 0x80))
+                value >>= 7
+            out.append(chr(value))
+        last = doc_id
+    return ''.join(out)
+
+def _decode_postings(data):
+    """Decode a string created by :func:`_encode_postings`."""
+    values = []
+    value = shift = 0
+    for byte in data:
+        byte = ord(byte)
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = shift = 0
+    postings = []
+    doc_id = 0
+    for i in xrange(0, len(values), 2):
+        doc_id += values[i]
+        postings.append((doc_id, values[i + 1]))
+    return postings
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime, st.st_size)
+
+class InvertedIndex(object):
+    """A BM25 ranked inverted index of documents made up of weighted terms.
+
+    Documents are dicts of term frequencies, keyed by an integer ID.
+
+    :param path: The filename of the index, without an extension.
+
+    """
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.journal_path = path + '.journal'
+        self.lock_path = path + '.lock'
+        self._lock = threading.RLock()
+        self._index_stamp = None
+        self._journal_ino = None
+        self._journal_offset = 0
+        self._reset()
+
+    def _reset(self):
+        self._terms = {}
+        self._sorted_terms = []
+        self._postings = ''
+        self._lengths = {}
+        self._delta = {}
+        self._delta_postings = {}
+        self._doc_count = 0
+        self._total_length = 0
+
+    def exists(self):
+        """Return True if the index has been written."""
+        return os.path.exists(self.index_path)
+
+    def refresh(self):
+        """Reload the index if it was rewritten and replay the journal."""
+        self._lock.acquire()
+        try:
+            stamp = _stamp(self.index_path)
+            if stamp != self._index_stamp:
+                self._load()
+                self._index_stamp = stamp
+                self._journal_ino = None
+            self._replay()
+        finally:
+            self._lock.release()
+
+    def _load(self):
+        self._reset()
+        try:
+            f = open(self.index_path, 'rb')
+        except IOError:
+            return
+        try:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('%s is not a search index' % self.index_path)
+            header_length, = struct.unpack('>Q', f.read(8))
+            header = simplejson.loads(zlib.decompress(f.read(header_length)))
+            self._postings = f.read()
+        finally:
+            f.close()
+        self._lengths = dict(header['docs'])
+        self._doc_count = len(self._lengths)
+        self._total_length = sum(self._lengths.itervalues())
+        for term, offset, size, df in header['terms']:
+            self._terms[term] = (offset, size, df)
+        self._sorted_terms = sorted(self._terms)
+
+    def _replay(self):
+        try:
+            journal = open(self.journal_path, 'rb')
+        except IOError:
+            return
+        try:
+            ino = os.fstat(journal.fileno()).st_ino
+            if ino != self._journal_ino:
+                self._journal_ino = ino
+                self._journal_offset = 0
+                # Undo any journal entries replayed from the old journal
+                for doc_id in self._delta.keys():
+                    self._apply(doc_id, self._main_terms(doc_id))
+                self._delta = {}
+            journal.seek(self._journal_offset)
+            data = journal.read()
+        finally:
+            journal.close()
+        # Ignore a trailing line that is still being written
+        end = data.rfind('\n') + 1
+        for line in data[:end].splitlines():
+            doc_id, terms = simplejson.loads(line)
+            self._apply(doc_id, terms)
+        self._journal_offset += end
+
+    def _main_terms(self, doc_id):
+        """Return a marker restoring the compacted version of a document."""
+        if doc_id in self._lengths:
+            return _MAIN
+        return None
+
+    def _current_length(self, doc_id):
+        if doc_id in self._delta:
+            terms = self._delta[doc_id]
+            return terms is not None and sum(terms.itervalues()) or None
+        return self._lengths.get(doc_id)
+
+    def _apply(self, doc_id, terms):
+        """Replace the given document with a new dict of terms, or None."""
+        old_length = self._current_length(doc_id)
+        if old_length is not None:
+            self._doc_count -= 1
+            self._total_length -= old_length
+        for term in self._delta.get(doc_id) or ():
+            postings = self._delta_postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._delta_postings[term]
+
+        if terms is _MAIN:
+            self._delta.pop(doc_id, None)
+        else:
+            self._delta[doc_id] = terms
+            for term, freq in (terms or {}).iteritems():
+                self._delta_postings.setdefault(term, {})[doc_id] = freq
+
+        new_length = self._current_length(doc_id)
+        if new_length is not None:
+            self._doc_count += 1
+            self._total_length += new_length
+
+    def _term_postings(self, term):
+        """Return the current {document ID: frequency} dict for a term."""
+        postings = {}
+        entry = self._terms.get(term)
+        if entry is not None:
+            offset, size, df = entry
+            data = self._postings[offset:offset + size]
+            delta = self._delta
+            postings.update((doc_id, freq)
+                            for doc_id, freq in _decode_postings(data)
+                            if doc_id not in delta)
+        postings.update(self._delta_postings.get(term, ()))
+        return postings
+
+    def _expand(self, term, prefix):
+        """Return the terms matching the given term or prefix."""
+        if not prefix:
+            return [term]
+        terms = set(t for t in self._delta_postings if t.startswith(term))
+        i = bisect_left(self._sorted_terms, term)
+        while i < len(self._sorted_terms) \
+        and self._sorted_terms[i].startswith(term):
+            terms.add(self._sorted_terms[i])
+            i += 1
+        return list(terms)
+
+    def search(self, parsed_query, limit=None):
+        """Search the index.
+
+        :param parsed_query: A tuple as returned by :func:`parse_query`.
+        :param limit: The maximum number of results to return.
+        :rtype: list
+        :returns: (document ID, score) tuples, best match first.
+        """
+        required, optional, excluded = parsed_query
+        self.refresh()
+        self._lock.acquire()
+        try:
+            if not self._doc_count:
+                return []
+            avg_length = float(self._total_length) / self._doc_count
+
+            def matches(term, prefix):
+                docs = {}
+                for t in self._expand(term, prefix):
+                    for doc_id, freq in self._term_postings(t).iteritems():
+                        docs.setdefault(doc_id, []).append((t, freq))
+                return docs
+
+            required = [matches(*term) for term in required]
+            optional = [matches(*term) for term in optional]
+            excluded = [matches(*term) for term in excluded]
+
+            if required:
+                candidates = set(required[0])
+                for docs in required[1:]:
+                    candidates.intersection_update(docs)
+            else:
+                candidates = set()
+                for docs in optional:
+                    candidates.update(docs)
+            for docs in excluded:
+                candidates.difference_update(docs)
+            if not candidates:
+                return []
+
+            df = {}
+            scores = dict.fromkeys(candidates, 0.0)
+            for docs in required + optional:
+                for doc_id in candidates.intersection(docs):
+                    length = self._current_length(doc_id)
+                    norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                    for term, freq in docs[doc_id]:
+                        if term not in df:
+                            df[term] = len(self._term_postings(term))
+                        idf = math.log(1 + (self._doc_count - df[term] + 0.5)
+                                       / (df[term] + 0.5))
+                        scores[doc_id] += idf * freq * (self.k1 + 1) / (freq + norm)
+        finally:
+            self._lock.release()
+        results = sorted(scores.iteritems(), key=lambda x: (-x[1], x[0]))
+        if limit is not None:
+            results = results[:limit]
+        return results
+
+    def update(self, documents):
+        """Add, replace or remove documents by appending them to the journal.
+
+        :param documents: A dict of term frequency dicts by document ID.
+            Documents which are None are removed from the index.
+        """
+        if not documents:
+            return
+        lines = ''.join(simplejson.dumps([doc_id, terms]) + '\n'
+                        for doc_id, terms in documents.iteritems())
+        lock = self._acquire_file_lock()
+        try:
+            journal = open(self.journal_path, 'ab')
+            try:
+                journal.write(lines)
+            finally:
+                journal.close()
+        finally:
+            lock.close()
+
+    def journal_size(self):
+        """Return the size of the journal in bytes."""
+        stamp = _stamp(self.journal_path)
+        return stamp and stamp[2] or 0
+
+    def write(self, documents):
+        """Replace the entire index with the given documents.
+
+        :param documents: An iterable of (document ID, term frequency dict)
+            tuples.
+        :rtype: int
+        :returns: The number of documents written.
+        """
+        postings = {}
+        lengths = {}
+        for doc_id, terms in documents:
+            lengths[doc_id] = sum(terms.itervalues())
+            for term, freq in terms.iteritems():
+                postings.setdefault(term, []).append((doc_id, freq))
+        lock = self._acquire_file_lock()
+        try:
+            self._write(postings, lengths)
+        finally:
+            lock.close()
+        return len(lengths)
+
+    def compact(self):
+        """Merge the journal into the compacted index."""
+        lock = self._acquire_file_lock()
+        try:
+            self.refresh()
+            self._lock.acquire()
+            try:
+                lengths = {}
+                for doc_id, length in self._lengths.iteritems():
+                    if doc_id not in self._delta:
+                        lengths[doc_id] = length
+                for doc_id, terms in self._delta.iteritems():
+                    if terms is not None:
+                        lengths[doc_id] = sum(terms.itervalues())
+                terms = set(self._terms).union(self._delta_postings)
+                postings = {}
+                for term in terms:
+                    postings[term] = self._term_postings(term).items()
+            finally:
+                self._lock.release()
+            self._write(postings, lengths)
+        finally:
+            lock.close()
+
+    def _write(self, postings, lengths):
+        """Write the index and truncate the journal. Hold the file lock!"""
+        blob = []
+        header_terms = []
+        offset = 0
+        for term in sorted(postings):
+            docs = sorted(postings[term])
+            if not docs:
+                continue
+            data = _encode_postings(docs)
+            header_terms.append((term, offset, len(data), len(docs)))
+            blob.append(data)
+            offset += len(data)
+        header = zlib.compress(simplejson.dumps({
+            'docs': lengths.items(),
+            'terms': header_terms,
+        }))
+
+        tmp_path = self.index_path + '.tmp'
+        f = open(tmp_path, 'wb')
+        try:
+            f.write(MAGIC)
+            f.write(struct.pack('>Q', len(header)))
+            f.write(header)
+            for data in blob:
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.rename(tmp_path, self.index_path)
+
+        tmp_path = self.journal_path + '.tmp'
+        open(tmp_path, 'wb').close()
+        os.rename(tmp_path, self.journal_path)
+
+    def _acquire_file_lock(self):
+        dirname = os.path.dirname(self.lock_path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        lock = open(self.lock_path, 'a')
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        # The lock is released when the file is closed
+        return lock
+
+_MAIN = object()
@@ -0,0 +1,56 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from sqlalchemy import sql
+
+from mediacore.lib.search import SearchBackend
+from mediacore.model import MatchAgainstClause
+from mediacore.model.media import MediaFullText, _fulltext_indexes, media_fulltext
+
+__all__ = ['MySQLFulltextSearch']
+
+class MySQLFulltextSearch(SearchBackend):
+    """
+    Search the FULLTEXT indexes of the media_fulltext table.
+
+    The table is kept up to date by the triggers in setup_triggers.sql.
+    """
+    backend_type = 'mysql'
+    priority = 10
+
+    def is_available(self, bind):
+        if bind.dialect.name != 'mysql':
+            return False
+        # use a fun trick to see if the media_fulltext table is being used
+        # thanks to this guy: http://data.agaric.com/node/2241#comment-544
+        select = sql.select('1').select_from(media_fulltext).limit(1)
+        return bind.execute(select).scalar() is not None
+
+    def search(self, query, index, search, bool=False, order_by=True):
+        search_cols = _fulltext_indexes[index]
+        filter = MatchAgainstClause(search_cols, search, bool)
+        query = query.join(MediaFullText).filter(filter)
+        if order_by:
+            # MySQL automatically orders natural lang searches by relevance,
+            # so override any existing ordering
+            query = query.order_by(None)
+            if bool:
+                # To mimic the same behaviour in boolean mode, we must do an
+                # extra natural language search on our boolean-filtered results
+                relevance = MatchAgainstClause(search_cols, search, bool=False)
+                query = query.order_by(relevance)
+        return query
+
+SearchBackend.register(MySQLFulltextSearch)
@@ -0,0 +1,244 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import sql
+
+from mediacore.lib.search import INDEX_NAMES, SearchBackend
+from mediacore.lib.search.index import InvertedIndex, parse_query, tokenize
+from mediacore.lib.util import chunks
+from mediacore.model.categories import categories
+from mediacore.model.media import Media, media, media_categories, media_tags
+from mediacore.model.tags import tags
+
+__all__ = ['InvertedIndexSearch']
+
+log = logging.getLogger(__name__)
+
+class InvertedIndexSearch(SearchBackend):
+    """
+    Search an on-disk inverted index of the media with BM25 ranking.
+
+    The index is kept in the ``search_index_dir`` from the config, which
+    defaults to a search folder in the ``cache_dir``. Only published media
+    are added to the public index, so that searches don't match drafts.
+    """
+    backend_type = 'index'
+    priority = 20
+
+    field_weights = {
+        'title': 3,
+        'subtitle': 2,
+        'tags': 2,
+        'categories': 2,
+        'description_plain': 1,
+        'notes': 1,
+    }
+    """How many times each word in the given field is counted."""
+
+    index_fields = {
+        'public': ('title', 'subtitle', 'tags', 'categories',
+                   'description_plain'),
+        'admin': ('title', 'subtitle', 'tags', 'categories',
+                  'description_plain', 'notes'),
+    }
+    """The fields that are searched by each index."""
+
+    ranked_results = 1000
+    """Order this many of the best matches by relevance. Any other matches
+    follow them, newest first."""
+
+    pending_age = 3600
+    """Keep changes queued while the index is missing for this many seconds,
+    in case it's being built and they were made after their media were read."""
+
+    compact_threshold = 4 * 1024 * 1024
+    """Merge the journal into the index when it grows to this many bytes."""
+
+    def __init__(self):
+        self.indexes = {}
+        self._queue = {}
+        self._queue_lock = threading.Lock()
+
+    def configure(self, config):
+        index_dir = config.get('search_index_dir')
+        if not index_dir:
+            cache_dir = config.get('app_conf', {}).get('cache_dir')
+            if not cache_dir:
+                return
+            index_dir = os.path.join(cache_dir, 'search')
+        self.indexes = dict((name, InvertedIndex(os.path.join(index_dir, name)))
+                            for name in INDEX_NAMES)
+
+    def is_available(self, bind):
+        return bool(self.indexes) \
+            and all(index.exists() for index in self.indexes.itervalues())
+
+    def search(self, query, index, search, bool=False, order_by=True):
+        results = self.indexes[index].search(parse_query(search, bool))
+        if not results:
+            return query.filter(sql.literal(False))
+        # Every match is kept, so that the query's own filters and counts
+        # apply to all of them. The IDs are written into the SQL, since as
+        # many bind params would exceed SQLite's limit.
+        ids = [sql.literal_column(str(int(media_id)))
+               for media_id, score in results]
+        query = query.filter(Media.id.in_(ids))
+        if order_by:
+            ranked = ids[:self.ranked_results]
+            rank = sql.case([(media_id, sql.literal_column(str(i)))
+                             for i, media_id in enumerate(ranked)],
+                            value=Media.id,
+                            else_=sql.literal_column(str(len(ranked))))
+            query = query.order_by(None).order_by(rank, Media.id.desc())
+        return query
+
+    def queue(self, kind, id):
+        if not self.indexes:
+            return
+        self._queue_lock.acquire()
+        try:
+            self._queue[(kind, id)] = time.time()
+        finally:
+            self._queue_lock.release()
+
+    def update_queued(self, bind):
+        self._queue_lock.acquire()
+        try:
+            queued, self._queue = self._queue, {}
+        finally:
+            self._queue_lock.release()
+        if not queued:
+            return
+        if not self.is_available(bind):
+            # Changes older than pending_age are in the index already,
+            # if it's ever built.
+            cutoff = time.time() - self.pending_age
+            self._queue_lock.acquire()
+            try:
+                for key, queued_on in queued.iteritems():
+                    if queued_on > cutoff:
+                        self._queue.setdefault(key, queued_on)
+            finally:
+                self._queue_lock.release()
+            return
+        ids = set(id for kind, id in queued if kind == 'media')
+        for kind, table, col in (
+                ('tag', media_tags, media_tags.c.tag_id),
+                ('category', media_categories, media_categories.c.category_id)):
+            kind_ids = [id for k, id in queued if k == kind]
+            if kind_ids:
+                ids.update(media_id for media_id, in bind.execute(
+                    sql.select([table.c.media_id], col.in_(kind_ids))))
+
+        documents = {}
+        for chunk in chunks(sorted(ids)):
+            documents.update(self.fetch_documents(bind, chunk))
+        for name, index in self.indexes.iteritems():
+            index.update(dict((media_id, self.terms(documents.get(media_id), name))
+                              for media_id in ids))
+            if index.journal_size() > self.compact_threshold:
+                index.compact()
+        log.debug('Updated the search index for %d media', len(ids))
+
+    def rebuild(self, bind):
+        count = 0
+        for name, index in self.indexes.iteritems():
+            documents = ((media_id, self.terms(document, name))
+                         for media_id, document in self.iter_documents(bind))
+            count = max(count, index.write((media_id, terms)
+                                           for media_id, terms in documents
+                                           if terms is not None))
+        return count
+
+    def terms(self, document, index):
+        """Return the weighted term frequencies of the given document.
+
+        :param document: A dict of field values, as returned by
+            :meth:`fetch_documents`, or None.
+        :param index: One of :data:`INDEX_NAMES`.
+        :rtype: dict or None
+        :returns: The terms, or None if the document doesn't belong in the
+            given index.
+        """
+        if document is None:
+            return None
+        if index == 'public' and not document['published']:
+            return None
+        terms = {}
+        for field in self.index_fields[index]:
+            weight = self.field_weights[field]
+            for term in tokenize(document.get(field)):
+                terms[term] = terms.get(term, 0) + weight
+        return terms
+
+    def iter_documents(self, bind, chunk_size=1000):
+        """Yield (media ID, document) for all media, in chunks."""
+        last_id = 0
+        while True:
+            ids = [media_id for media_id, in bind.execute(
+                sql.select([media.c.id], media.c.id > last_id)\
+                    .order_by(media.c.id).limit(chunk_size))]
+            if not ids:
+                break
+            documents = self.fetch_documents(bind, ids)
+            for media_id in ids:
+                if media_id in documents:
+                    yield media_id, documents[media_id]
+            last_id = ids[-1]
+
+    def fetch_documents(self, bind, ids):
+        """Return a dict of searchable field values for each media ID.
+
+        :param bind: The engine or connection to execute with.
+        :param ids: A list of media IDs.
+        :rtype: dict
+        """
+        documents = {}
+        rows = bind.execute(sql.select(
+            [media.c.id, media.c.live, media.c.slug, media.c.title,
+             media.c.subtitle, media.c.description_plain, media.c.notes],
+            media.c.id.in_(ids)))
+        for media_id, live, slug, title, subtitle, description_plain, notes \
+        in rows:
+            documents[media_id] = {
+                'published': live and not slug.startswith('_stub_'),
+                'title': title,
+                'subtitle': subtitle,
+                'description_plain': description_plain,
+                'notes': notes,
+                'tags': [],
+                'categories': [],
+            }
+        for field, table, col, names in (
+                ('tags', media_tags, media_tags.c.tag_id, tags),
+                ('categories', media_categories, media_categories.c.category_id,
+                 categories)):
+            rows = bind.execute(sql.select(
+                [table.c.media_id, names.c.name],
+                sql.and_(col == names.c.id, table.c.media_id.in_(ids))))
+            for media_id, name in rows:
+                if media_id in documents:
+                    documents[media_id][field].append(name)
+        for document in documents.itervalues():
+            document['tags'] = u' '.join(document['tags'])
+            document['categories'] = u' '.join(document['categories'])
+        return documents
+
+SearchBackend.register(InvertedIndexSearch)
@@ -13,9 +13,12 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import cPickle as pickle
 import logging
-import os.path
+import os
+import sys
 
+import genshi
 from genshi import Markup, XML
 from genshi.output import XHTMLSerializer
 from genshi.template import Template, NewTextTemplate
@@ -23,9 +26,13 @@ from genshi.template.loader import (directory,
     TemplateLoader as _TemplateLoader, TemplateNotFound)
 from pylons import app_globals, config, request, response, tmpl_context, translator
 
+from mediacore.lib.compat import sha1
 from mediacore.lib.i18n import N_
 
-__all__ = ['render', 'render_stream', 'TemplateLoader', 'XHTMLPlusSerializer']
+__all__ = [
+    'find_templates', 'precompile_templates', 'render', 'render_stream',
+    'TemplateLoader', 'XHTMLPlusSerializer',
+]
 
 log = logging.getLogger(__name__)
 
@@ -137,6 +144,18 @@ class XHTMLPlusSerializer(XHTMLSerializer):
     _EMPTY_ELEMS = frozenset(set(['source']) | XHTMLSerializer._EMPTY_ELEMS)
 
 class TemplateLoader(_TemplateLoader):
+    """Genshi TemplateLoader which can persist parsed templates to disk.
+
+    :param compiled_dir: An optional directory to store parsed templates
+        in, so that other processes, and this one after a restart, needn't
+        parse them again. Stored templates are keyed on the modification
+        time of the template file.
+
+    """
+    def __init__(self, *args, **kwargs):
+        self.compiled_dir = kwargs.pop('compiled_dir', None)
+        _TemplateLoader.__init__(self, *args, **kwargs)
+
     def load(self, filename, relative_to=None, cls=None, encoding=None):
         """Load the template with the given name.
 
@@ -263,3 +282,114 @@ class TemplateLoader(_TemplateLoader):
 
         finally:
             self._lock.release()
+
+    def _instantiate(self, cls, fileobj, filepath, filename, encoding=None):
+        """Parse the template, or load it from :attr:`compiled_dir`."""
+        compiled_path = self._compiled_path(cls, filepath, filename, encoding)
+        if compiled_path is not None:
+            tmpl = self._load_compiled(cls, compiled_path)
+            if tmpl is not None:
+                return tmpl
+        tmpl = _TemplateLoader._instantiate(self, cls, fileobj, filepath,
+                                            filename, encoding=encoding)
+        if compiled_path is not None:
+            self._store_compiled(tmpl, compiled_path)
+        return tmpl
+
+    def _compiled_path(self, cls, filepath, filename, encoding):
+        if self.compiled_dir is None:
+            return None
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+        key = repr((filepath, filename, stat.st_mtime, stat.st_size,
+                    cls.__module__, cls.__name__,
+                    encoding or self.default_encoding,
+                    self.variable_lookup, self.allow_exec,
+                    genshi.__version__, sys.version_info[:2]))
+        return os.path.join(self.compiled_dir,
+                            sha1(key).hexdigest() + '.pickle')
+
+    def _load_compiled(self, cls, compiled_path):
+        try:
+            f = open(compiled_path, 'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                state = pickle.load(f)
+            finally:
+                f.close()
+            tmpl = cls.__new__(cls)
+            tmpl.__setstate__(state)
+        except Exception, e:
+            log.warn('Ignoring compiled template %r: %s', compiled_path, e)
+            return None
+        tmpl.loader = self
+        return tmpl
+
+    def _store_compiled(self, tmpl, compiled_path):
+        # __getstate__ returns a copy of the state without the filters,
+        # which __setstate__ rebuilds. The loader is reattached on load.
+        state = tmpl.__getstate__()
+        state['loader'] = None
+        try:
+            data = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+        except Exception, e:
+            log.warn('Cannot store compiled template %r: %s',
+                     tmpl.filepath, e)
+            return
+        tmp_path = '%s.%d' % (compiled_path, os.getpid())
+        try:
+            if not os.path.exists(self.compiled_dir):
+                os.makedirs(self.compiled_dir)
+            f = open(tmp_path, 'wb')
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            os.rename(tmp_path, compiled_path)
+        except (IOError, OSError), e:
+            log.warn('Cannot store compiled template %r: %s',
+                     tmpl.filepath, e)
+
+def find_templates(directory, extensions=('.html', '.xml')):
+    """Return the paths of all markup templates under the given directory.
+
+    :param directory: The directory to search.
+    :param extensions: The file extensions of markup templates.
+    :rtype: list
+    :returns: Paths relative to the given directory.
+    """
+    templates = []
+    directory = os.path.normpath(directory)
+    for dirpath, dirnames, filenames in os.walk(directory):
+        reldir = dirpath[len(directory):].lstrip(os.sep)
+        for filename in filenames:
+            if os.path.splitext(filename)[1] in extensions:
+                templates.append(os.path.normpath(
+                    os.path.join(reldir, filename)))
+    templates.sort()
+    return templates
+
+def precompile_templates(loader, templates):
+    """Parse the given templates now, instead of on their first render.
+
+    Templates which fail to load are logged and skipped.
+
+    :param loader: A :class:`TemplateLoader`.
+    :param templates: Template paths, as they would be passed to
+        :func:`render`.
+    :rtype: int
+    :returns: The number of templates loaded.
+    """
+    loaded = 0
+    for template in templates:
+        try:
+            loader.load(template)
+        except Exception, e:
+            log.warn('Cannot precompile template %r: %s', template, e)
+        else:
+            loaded += 1
+    return loaded
@@ -12,31 +12,65 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Thumbnail Images
+
+The thumbs of every media and podcast are stored in the image_dir as
+``<type>/<name><size>.jpg``, where the name is the ``thumb_name`` column
+of the item:
+
+    * ``new`` for the default thumbs, which are shared by every item
+      without a thumb of its own.
+    * The sha1 hash of the uploaded image, so that items with the same
+      image share the same files.
+    * ``None`` for thumbs made before thumb names were stored, which are
+      named after the ID of the item.
+
+Since the name is known from the database, URLs and paths are resolved
+without checking the filesystem, except for those older thumbs.
+
+"""
 
 import filecmp
+import logging
 import os
 import re
 import shutil
+import thread
+import time
 
-from PIL import Image
+from PIL import Image, ImageFile
 # XXX: note that pylons.url is imported here. Make sure to only use it with
 #      absolute paths (ie. those starting with a /) to avoid differences in
 #      behavior from mediacore.lib.helpers.url_for
 from pylons import config, url as url_for
 
+from mediacore.lib.compat import sha1
+
 __all__ = [
     'ThumbDict', 'create_default_thumbs_for', 'create_thumbs_for',
-    'has_thumbs', 'has_default_thumbs',
-    'thumb', 'thumb_path', 'thumb_paths', 'thumb_url',
+    'has_thumbs', 'has_default_thumbs', 'owned_thumb_paths', 'resize_thumbs',
+    'save_thumbs_for', 'thumb', 'thumb_path', 'thumb_paths', 'thumb_url',
 ]
 
+log = logging.getLogger(__name__)
+
 def _normalize_thumb_item(item):
-    """Pass back the image subdir and id when given a media or podcast."""
+    """Pass back the image subdir and name when given a media or podcast."""
     try:
-        return item._thumb_dir, item.id or 'new'
+        # Thumb names are plain ASCII, and URLs must be built from a str
+        return item._thumb_dir, str(item.thumb_name or item.id or 'new')
     except AttributeError:
         return item
 
+def _thumb_name_known(item):
+    """Return True if the thumb files of the given item are known to exist.
+
+    Items with a stored thumb name always have thumbs. Older thumbs named
+    after the item ID, and those of 2-tuples, might not.
+    """
+    return getattr(item, 'thumb_name', None) is not None
+
 def thumb_path(item, size, exists=False, ext='jpg'):
     """Get the thumbnail path for the given item and size.
 
@@ -63,7 +97,8 @@ def thumb_path(item, size, exists=False, ext='jpg'):
     image = '%s/%s%s.%s' % (image_dir, item_id, size, ext)
     image_path = os.path.join(config['image_dir'], image)
 
-    if exists and not os.path.isfile(image_path):
+    if exists and not _thumb_name_known(item) \
+    and not os.path.isfile(image_path):
         return None
     return image_path
 
@@ -82,6 +117,21 @@ def thumb_paths(item, **kwargs):
     return dict((key, thumb_path(item, key, **kwargs))
                 for key in config['thumb_sizes'][image_dir].iterkeys())
 
+def owned_thumb_paths(item):
+    """Return the paths to the thumbs that only the given item uses.
+
+    The default thumbs and those named after an image hash may be shared
+    with other items, so they're left for
+    ``batch-scripts/maintenance/compact_thumbs.py`` to clean up.
+
+    :param item: A media or podcast.
+    :rtype: ``list``
+
+    """
+    if _thumb_name_known(item):
+        return []
+    return thumb_paths(item).values()
+
 def thumb_url(item, size, qualified=False, exists=False):
     """Get the thumbnail url for the given item and size.
 
@@ -107,7 +157,8 @@ def thumb_url(item, size, qualified=False, exists=False):
     image_dir, item_id = _normalize_thumb_item(item)
     image = '%s/%s%s.jpg' % (image_dir, item_id, size)
 
-    if exists and not os.path.isfile(os.path.join(config['image_dir'], image)):
+    if exists and not _thumb_name_known(item) \
+    and not os.path.isfile(os.path.join(config['image_dir'], image)):
         return None
     return url_for('/images/%s' % image, qualified=qualified)
 
@@ -193,10 +244,125 @@ def resize_thumb(img, size, filter=Image.ANTIALIAS):
 
     return img.resize(size, filter)
 
+def resize_thumbs(img, sizes, filter=Image.ANTIALIAS):
+    """Resize an image to several sizes, as :func:`resize_thumb` does.
+
+    Sizes are resized from largest to smallest. Each is derived from the
+    smallest thumb made so far that has the same aspect ratio and is at
+    least twice as large, or otherwise from the given image, so most
+    thumbs are resized from a few hundred pixels instead of the original.
+
+    :param img: Any open image
+    :type img: :class:`PIL.Image`
+    :param sizes: A dict of the desired width and height for each key.
+    :type sizes: dict
+    :param filter: The downsampling filter to use when resizing.
+    :returns: A dict of new, resized image instances for each key.
+
+    """
+    thumbs = {}
+    resized = []
+    by_area = sorted(sizes.iteritems(), key=lambda (key, (x, y)): x * y,
+                     reverse=True)
+    for key, size in by_area:
+        src = img
+        for src_size, src_img in reversed(resized):
+            if src_size[0] * size[1] == src_size[1] * size[0] \
+            and src_size[0] >= size[0] * 2 and src_size[1] >= size[1] * 2:
+                src = src_img
+                break
+        thumbs[key] = resize_thumb(src, tuple(size), filter)
+        resized.append((tuple(size), thumbs[key]))
+    return thumbs
+
+def _tmp_path(path):
+    return '%s.%d.%d.tmp' % (path, os.getpid(), thread.get_ident())
+
+def _save_jpeg(img, path):
+    """Save a progressive, optimized JPEG that replaces the path atomically."""
+    # The optimizing encoder must write the whole image in one block
+    ImageFile.MAXBLOCK = max(ImageFile.MAXBLOCK, img.size[0] * img.size[1] * 4)
+    tmp_path = _tmp_path(path)
+    try:
+        img.save(tmp_path, 'JPEG', optimize=True, progressive=True)
+        os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _copy_file(src_file, path):
+    """Copy an open file to a path, replacing the path atomically."""
+    tmp_path = _tmp_path(path)
+    try:
+        dst_file = open(tmp_path, 'w+b')
+        try:
+            shutil.copyfileobj(src_file, dst_file)
+        finally:
+            dst_file.close()
+        os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
 _ext_filter = re.compile(r'^\.([a-z0-9]*)')
 
+def save_thumbs_for(item, image_file):
+    """Create thumbnails in all sizes for a given Media or Podcast object.
+
+    The image is decoded only once. JPEGs are decoded at the smallest
+    scale that's still twice the size of the largest thumb, and the smaller
+    thumbs are resized from the larger ones, see :func:`resize_thumbs`.
+    Each file is written to a temporary path and renamed into place, so a
+    thumb is never served half-written.
+
+    :param item: A 2-tuple with a subdir name and an ID. If given a
+        ORM mapped class with _thumb_dir and id attributes, the info
+        can be extracted automatically.
+    :type item: ``tuple`` or mapped class instance
+    :param image_file: An open file handle for the image file.
+    :type image_file: file
+    :returns: The seconds spent decoding, resizing and saving, keyed by
+        ``decode``, ``resize`` and ``save``.
+    :rtype: dict
+    """
+    image_dir, item_id = _normalize_thumb_item(item)
+    sizes = config['thumb_sizes'][image_dir]
+    timings = {}
+
+    start = time.time()
+    img = Image.open(image_file)
+    # Only JPEGs can be drafted. They're scaled by 1/2, 1/4 or 1/8 while
+    # decoding, which is much faster than decoding the full size.
+    max_x = max([x for x, y in sizes.itervalues()])
+    max_y = max([y for x, y in sizes.itervalues()])
+    img.draft('RGB', (max_x * 2, max_y * 2))
+    # TODO: Allow other formats?
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    img.load()
+    timings['decode'] = time.time() - start
+
+    start = time.time()
+    thumbs = resize_thumbs(img, sizes)
+    timings['resize'] = time.time() - start
+
+    start = time.time()
+    for key, thumb_img in thumbs.iteritems():
+        _save_jpeg(thumb_img, thumb_path(item, key))
+    timings['save'] = time.time() - start
+    return timings
+
 def create_thumbs_for(item, image_file, image_filename):
-    """Creates thumbnails in all sizes for a given Media or Podcast object.
+    """Creates thumbnails in all sizes for a given Media or Podcast object,
+    and backs up the original image.
+
+    The thumbs of a media or podcast are named after the sha1 hash of the
+    image, which is stored as its ``thumb_name``. If another item already
+    uses the same image, its thumbs are simply shared. 2-tuples are given
+    thumbs named after their ID instead. See :func:`save_thumbs_for` for
+    how the thumbs are made.
 
     Side effects: Closes the open file handle passed in as image_file.
 
@@ -208,39 +374,67 @@ def create_thumbs_for(item, image_file, image_filename):
     :type image_file: file
     :param image_filename: The original filename of the thumbnail image.
     :type image_filename: unicode
+    :returns: The seconds spent decoding, resizing, saving the thumbs and
+        backing up the original, keyed by ``decode``, ``resize``,
+        ``save`` and ``backup``.
+    :rtype: dict
     """
-    image_dir, item_id = _normalize_thumb_item(item)
-    img = Image.open(image_file)
-
-    # TODO: Allow other formats?
-    for key, xy in config['thumb_sizes'][item._thumb_dir].iteritems():
-        path = thumb_path(item, key)
-        thumb_img = resize_thumb(img, xy)
-        if thumb_img.mode != "RGB":
-            thumb_img = thumb_img.convert("RGB")
-        thumb_img.save(path)
+    content_addressed = hasattr(item, 'thumb_name')
+    if content_addressed:
+        digest = sha1()
+        while True:
+            block = image_file.read(65536)
+            if not block:
+                break
+            digest.update(block)
+        image_file.seek(0)
+        image_dir, item_id = item._thumb_dir, unicode(digest.hexdigest())
+    else:
+        image_dir, item_id = _normalize_thumb_item(item)
+
+    paths = thumb_paths((image_dir, item_id))
+    if content_addressed \
+    and all([os.path.isfile(path) for path in paths.itervalues()]):
+        # The thumbs may not be used by any other item, so touch them to
+        # keep compact_thumbs.py --gc from deleting them in the meantime.
+        for path in paths.itervalues():
+            os.utime(path, None)
+        timings = {'decode': 0.0, 'resize': 0.0, 'save': 0.0}
+    else:
+        timings = save_thumbs_for((image_dir, item_id), image_file)
 
     # Backup the original image, ensuring there's no odd chars in the ext.
     # Thumbs from DailyMotion include an extra query string that needs to be
     # stripped off here.
+    start = time.time()
     ext = os.path.splitext(image_filename)[1].lower()
     ext_match = _ext_filter.match(ext)
     if ext_match:
         backup_type = ext_match.group(1)
-        backup_path = thumb_path(item, 'orig', ext=backup_type)
-        backup_file = open(backup_path, 'w+b')
-        image_file.seek(0)
-        shutil.copyfileobj(image_file, backup_file)
+        backup_path = thumb_path((image_dir, item_id), 'orig', ext=backup_type)
+        if not os.path.isfile(backup_path):
+            image_file.seek(0)
+            _copy_file(image_file, backup_path)
+        elif content_addressed:
+            os.utime(backup_path, None)
         image_file.close()
-        backup_file.close()
+    timings['backup'] = time.time() - start
+
+    # Only refer to the thumbs once they've all been written
+    if content_addressed:
+        item.thumb_name = item_id
+
+    log.debug('Created thumbs for %s/%s: %s', image_dir, item_id,
+              ', '.join('%s %.3fs' % (stage, timings[stage]) for stage
+                        in ('decode', 'resize', 'save', 'backup')))
+    return timings
 
 def create_default_thumbs_for(item):
-    """Create copies of the default thumbs for the given item.
+    """Give the given item the default thumbs.
 
-    This copies the default files (all named with an id of 'new') to
-    use the given item's id. This means there could be lots of duplicate
-    copies of the default thumbs, but at least we can always use the
-    same url when rendering.
+    Media and podcasts simply refer to the default files (all named with
+    an id of 'new') through their ``thumb_name``, so nothing is copied.
+    For 2-tuples, the default files are copied to use the given id.
 
     :param item: A 2-tuple with a subdir name and an ID. If given a
         ORM mapped class with _thumb_dir and id attributes, the info
@@ -248,6 +442,9 @@ def create_default_thumbs_for(item):
     :type item: ``tuple`` or mapped class instance
 
     """
+    if hasattr(item, 'thumb_name'):
+        item.thumb_name = u'new'
+        return
     image_dir, item_id = _normalize_thumb_item(item)
     for key in config['thumb_sizes'][image_dir].iterkeys():
         src_file = thumb_path((image_dir, 'new'), key)
@@ -272,6 +469,8 @@ def has_default_thumbs(item):
         can be extracted automatically.
     :type item: ``tuple`` or mapped class instance
     """
+    if _thumb_name_known(item):
+        return item.thumb_name == u'new'
     image_dir, item_id = _normalize_thumb_item(item)
     return filecmp.cmp(thumb_path((image_dir, item_id), 's'),
                        thumb_path((image_dir, 'new'), 's'))
@@ -17,7 +17,8 @@ import os
 
 from urlparse import urlsplit
 
-from mediacore.lib.compat import all
+from pylons import request
+from sqlalchemy.orm.attributes import instance_state
 
 class StorageURI(object):
     """
@@ -55,14 +56,26 @@ class StorageURI(object):
         streaming servers and the like, where a streaming server must
         be declared separately from the file.
 
+    .. attribute:: container
+
+        The container format of the file, copied when the URI is created
+        so that :func:`pick_uris` needn't look it up on the file.
+
+    .. attribute:: type
+
+        The media type of the file, also copied from the file.
+
     """
-    __slots__ = ('file', 'scheme', 'file_uri', 'server_uri', '__weakref__')
+    __slots__ = ('file', 'scheme', 'file_uri', 'server_uri', 'container',
+                 'type', '__weakref__')
 
     def __init__(self, file, scheme, file_uri, server_uri=None):
         self.file = file
         self.scheme = scheme
         self.file_uri = file_uri
         self.server_uri = server_uri
+        self.container = getattr(file, 'container', None)
+        self.type = getattr(file, 'type', None)
 
     def __str__(self):
         """Return the best possible string representation of the URI.
@@ -129,9 +142,15 @@ def pick_uris(uris, **kwargs):
             uris = uris.get_uris()
     if not uris or not kwargs:
         return uris
-    return [uri
-            for uri in uris
-            if all(getattr(uri, k) == v for k, v in kwargs.iteritems())]
+    criteria = kwargs.items()
+    picked = []
+    for uri in uris:
+        for key, value in criteria:
+            if getattr(uri, key) != value:
+                break
+        else:
+            picked.append(uri)
+    return picked
 
 def pick_uri(uris, **kwargs):
     """Return the first URL that meets the given criteria.
@@ -192,3 +211,90 @@ def file_path(uris):
         scheme, netloc, path, query, fragment = urlsplit(uris[0].file_uri)
         return path
     return None
+
+class URICache(object):
+    """Memoize the URIs of media files between requests.
+
+    Building the URIs can be costly: local files are routed with
+    :func:`~mediacore.lib.helpers.url_for` twice each, for example. Only
+    the scheme, file URI and server URI of each are kept, and new
+    :class:`StorageURI` instances are made for the file that asks for
+    them, so nothing is shared between database sessions.
+
+    Entries are keyed on the modification dates of the file, its media
+    and its storage engine, as well as the application URL of the current
+    request, so a changed file or engine simply misses the cache. Files
+    with unsaved changes aren't cached at all. The
+    most recently used entries are kept in two generations of at most
+    ``size`` entries each.
+
+    :param size: The number of entries per generation.
+
+    """
+    def __init__(self, size=10000):
+        self.size = size
+        self._current = {}
+        self._previous = {}
+
+    def configure(self, size):
+        """Set the number of entries to keep, and clear the cache."""
+        self.size = int(size)
+        self.clear()
+
+    def clear(self):
+        """Forget all entries in this process."""
+        self._current = {}
+        self._previous = {}
+
+    def key(self, media_file):
+        """Return the cache key for the given file, or None if uncacheable.
+
+        :param media_file: A :class:`~mediacore.model.media.MediaFile`.
+        """
+        if media_file.id is None or self.size <= 0:
+            return None
+        try:
+            application_url = request.application_url
+        except TypeError:
+            # Outside of a request, URLs can't be routed consistently
+            return None
+        storage = media_file.storage
+        for obj in (media_file, media_file.media, storage):
+            state = instance_state(obj)
+            if state.key is None or state.modified:
+                # Unsaved changes aren't reflected in the modified_on dates
+                return None
+        return (media_file.id, media_file.modified_on,
+                media_file.media.modified_on, storage.id,
+                storage.modified_on, application_url)
+
+    def get_uris(self, media_file):
+        """Return the URIs of the given file, from the cache if possible.
+
+        :param media_file: A :class:`~mediacore.model.media.MediaFile`.
+        :rtype: list
+        :returns: :class:`StorageURI` instances.
+        """
+        key = self.key(media_file)
+        if key is None:
+            return media_file.storage.get_uris(media_file)
+        parts = self._current.get(key)
+        if parts is None:
+            parts = self._previous.get(key)
+            if parts is None:
+                parts = [(uri.scheme, uri.file_uri, uri.server_uri)
+                         for uri in media_file.storage.get_uris(media_file)]
+            self._store(key, parts)
+        return [StorageURI(media_file, scheme, file_uri, server_uri)
+                for scheme, file_uri, server_uri in parts]
+
+    def _store(self, key, parts):
+        current = self._current
+        if len(current) >= self.size:
+            # Drop the oldest generation. Assignments are atomic, so
+            # racing threads can at worst lose an entry.
+            self._previous = current
+            current = self._current = {}
+        current[key] = parts
+
+uri_cache = URICache()
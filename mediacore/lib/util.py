@@ -25,6 +25,11 @@ from urlparse import urlparse
 from pylons import app_globals, config, url as pylons_url
 from webob.exc import HTTPFound
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 __all__ = ['merge_dicts', 'redirect', 'url', 'url_for']
 
 def url(*args, **kwargs):
@@ -140,7 +145,22 @@ def merge_dicts(dst, *srcs):
                     current_dst[key] = current_src[key]
     return dst
 
-def calculate_popularity(publish_date, score):
+def chunks(seq, size=500):
+    """Split a sequence into lists of at most the given size.
+
+    This keeps the number of values in an ``IN`` clause below the limits of
+    the database.
+
+    :param seq: Any iterable.
+    :param int size: The maximum length of each list.
+    :returns: A generator of lists.
+    """
+    seq = list(seq)
+    for i in xrange(0, len(seq), size):
+        yield seq[i:i + size]
+
+def calculate_popularity(publish_date, score, decay_exponent=None,
+                         decay_lifetime=None):
     """Calculate how 'hot' an item is given its response since publication.
 
     In our ranking algorithm, being base_life_hours newer is equivalent
@@ -150,15 +170,24 @@ def calculate_popularity(publish_date, score):
     :param publish_date: The date of publication. An older date reduces
         the popularity score.
     :param int score: The number of likes, dislikes or likes - dislikes.
+    :param decay_exponent: Optionally override the
+        ``popularity_decay_exponent`` setting, which is otherwise read
+        from :attr:`app_globals.settings`.
+    :param decay_lifetime: Optionally override the
+        ``popularity_decay_lifetime`` setting.
     :rtype: int
     :returns: Popularity points.
 
     """
-    settings = app_globals.settings
-    log_base = int(settings['popularity_decay_exponent'])
-    base_life = int(settings['popularity_decay_lifetime']) * 3600
+    if decay_exponent is None or decay_lifetime is None:
+        settings = app_globals.settings
+        decay_exponent = settings['popularity_decay_exponent']
+        decay_lifetime = settings['popularity_decay_lifetime']
+    log_base = int(decay_exponent)
+    base_life = int(decay_lifetime) * 3600
     # FIXME: The current algorithm assumes that the earliest publication
     #        date is January 1, 2000.
+    #        See also calculate_popularity_scores below.
     if score > 0:
         sign = 1
     elif score < 0:
@@ -169,3 +198,44 @@ def calculate_popularity(publish_date, score):
     t = delta.days * 86400 + delta.seconds
     popularity = math.log(max(abs(score), 1), log_base) + sign * t / base_life
     return max(int(popularity), 0)
+
+def calculate_popularity_scores(publish_dates, score_lists,
+                                decay_exponent, decay_lifetime):
+    """Calculate :func:`calculate_popularity` for many items at once.
+
+    If NumPy is installed the scores are computed with array math,
+    otherwise we fall back to calling :func:`calculate_popularity` for
+    each item.
+
+    :param publish_dates: A sequence of :class:`datetime.datetime`
+        publication dates.
+    :param score_lists: A list of sequences of scores, each as long as
+        ``publish_dates``. For example, likes - dislikes, likes and
+        dislikes.
+    :param decay_exponent: The ``popularity_decay_exponent`` setting.
+    :param decay_lifetime: The ``popularity_decay_lifetime`` setting.
+    :rtype: list
+    :returns: A list of popularity point lists, one per list of scores.
+
+    """
+    if numpy is None:
+        return [[calculate_popularity(date, score,
+                                      decay_exponent, decay_lifetime)
+                 for date, score in zip(publish_dates, scores)]
+                for scores in score_lists]
+
+    log_base = math.log(int(decay_exponent))
+    base_life = int(decay_lifetime) * 3600
+    dates = numpy.array(publish_dates, dtype='datetime64[us]')
+    epoch = numpy.datetime64(datetime(2000, 1, 1), 'us')
+    # Whole seconds since the epoch, as with timedelta.days and .seconds
+    t = (dates - epoch).astype(numpy.int64) // 1000000
+    results = []
+    for scores in score_lists:
+        scores = numpy.asarray(scores, dtype=numpy.int64)
+        magnitude = numpy.log(numpy.maximum(numpy.abs(scores), 1)) / log_base
+        # Python 2 integer division floors, and so does numpy's
+        popularity = magnitude + numpy.sign(scores) * t // base_life
+        popularity = numpy.maximum(popularity.astype(numpy.int64), 0)
+        results.append(popularity.tolist())
+    return results
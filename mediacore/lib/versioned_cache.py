@@ -0,0 +1,149 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Process-local Caches with a Shared Version
+
+Small tables that are read on every request but rarely written, such as
+the settings and the player preferences, are kept in memory by every
+worker process.
+:class:`VersionedCache` reloads its copy only when a version file in the
+cache_dir changes, and checks the file at most once every
+``check_interval`` seconds, so reads cost no more than a dict lookup and
+changes reach every worker within that time.
+
+"""
+import errno
+import os
+import threading
+import time
+
+from pylons import request
+
+__all__ = ['VersionedCache']
+
+class VersionedCache(object):
+    """Keep a value in memory until a version file shared by all processes
+    is replaced.
+
+    :param load: A callable which takes no arguments and returns the
+        value to keep.
+    :param version_path: The file whose version is shared by all processes
+        using the same database. Without one, the value is only reloaded
+        when cleared in this process.
+    :param check_interval: The number of seconds between version checks.
+
+    """
+    def __init__(self, load, version_path=None, check_interval=1.0):
+        self.load = load
+        self.version_path = version_path
+        self.check_interval = check_interval
+        self._value = None
+        self._loaded = False
+        self._version = None
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    def configure(self, version_path, check_interval=None):
+        """Share the version with other processes through the given file.
+
+        :param version_path: The path to the version file.
+        :param check_interval: Optionally override the check interval.
+        """
+        self.version_path = version_path
+        if check_interval is not None:
+            self.check_interval = float(check_interval)
+        self._loaded = False
+
+    def get(self):
+        """Return the current value, reloading it if it has changed."""
+        now = time.time()
+        if self._loaded and now - self._checked < self.check_interval:
+            return self._value
+        self._lock.acquire()
+        try:
+            if not self._loaded or now - self._checked >= self.check_interval:
+                # Read the version first, so that a change made while
+                # loading is picked up on the next check.
+                version = self._read_version()
+                self._checked = now
+                if not self._loaded or version != self._version:
+                    if self._clear_pending():
+                        # The value may contain uncommitted changes, which
+                        # mustn't be kept in case they're rolled back.
+                        return self.load()
+                    self._value = self.load()
+                    self._version = version
+                    self._loaded = True
+            return self._value
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Reload the value on next access, in every process.
+
+        If this is called during a request that commits with the
+        :func:`~mediacore.lib.decorators.autocommit` decorator, the value
+        is cleared again once the transaction has been committed or rolled
+        back, in case another process reloaded it in between. Until then,
+        the values read by this request aren't kept.
+        """
+        self._clear()
+        try:
+            commit_callbacks = request.commit_callbacks
+            rollback_callbacks = request.rollback_callbacks
+        except (AttributeError, TypeError):
+            # Outside of a request, or not within @autocommit
+            pass
+        else:
+            commit_callbacks.append(self._clear)
+            rollback_callbacks.append(self._clear)
+
+    def _clear_pending(self):
+        """Return True if the current request has cleared the value, but
+        not yet committed or rolled back."""
+        try:
+            return self._clear in request.commit_callbacks
+        except (AttributeError, TypeError):
+            return False
+
+    def _clear(self):
+        self._loaded = False
+        if self.version_path:
+            self._write_version()
+
+    def _read_version(self):
+        if not self.version_path:
+            return None
+        try:
+            stat = os.stat(self.version_path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        return stat.st_ino, stat.st_mtime, stat.st_size
+
+    def _write_version(self):
+        # Replacing the file gives it a new inode, so the version changes
+        # even if the mtime doesn't.
+        version_dir = os.path.dirname(self.version_path)
+        if not os.path.exists(version_dir):
+            os.makedirs(version_dir)
+        tmp_path = '%s.%d' % (self.version_path, os.getpid())
+        f = open(tmp_path, 'w')
+        try:
+            f.write('%.6f %d\n' % (time.time(), os.getpid()))
+        finally:
+            f.close()
+        os.rename(tmp_path, self.version_path)
@@ -0,0 +1,151 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Vulgarity Filter
+
+The words listed in the ``vulgarity_filtered_words`` setting are starred
+out of comments. :class:`VulgarityFilter` finds all of them in a single
+pass over the text with an Aho-Corasick automaton, so the time it takes
+doesn't grow with the length of the word list. The automaton for the
+current setting is built once and shared by all requests, see
+:func:`get_vulgarity_filter`.
+
+"""
+import threading
+
+from collections import deque
+
+__all__ = ['VulgarityFilter', 'get_vulgarity_filter']
+
+class VulgarityFilter(object):
+    """Replace any of the given words with asterisks.
+
+    Words are matched case insensitively, anywhere in the text. Where
+    words overlap, the longest word starting at the leftmost position is
+    replaced.
+
+    :param words: An iterable of words to filter.
+
+    """
+    def __init__(self, words):
+        self.words = frozenset(word.lower() for word in words if word)
+        # The trie transitions, failure links, and the lengths of the
+        # words that end at each node, including through failure links.
+        goto = [{}]
+        fail = [0]
+        out = [()]
+        for word in self.words:
+            node = 0
+            for char in word:
+                child = goto[node].get(char)
+                if child is None:
+                    child = goto[node][char] = len(goto)
+                    goto.append({})
+                    fail.append(0)
+                    out.append(())
+                node = child
+            out[node] = (len(word),)
+
+        queue = deque(goto[0].itervalues())
+        while queue:
+            node = queue.popleft()
+            for char, child in goto[node].iteritems():
+                queue.append(child)
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                fail[child] = goto[state].get(char, 0)
+                out[child] = out[child] + out[fail[child]]
+
+        self._goto = goto
+        self._fail = fail
+        self._out = out
+
+    def find(self, text):
+        """Return the positions of the words in the given text.
+
+        :type text: unicode
+        :rtype: list
+        :returns: Non-overlapping ``(start, end)`` tuples, in order.
+        """
+        if not self.words or not text:
+            return []
+        goto, fail, out = self._goto, self._fail, self._out
+        longest = {}
+        node = 0
+        # unicode.lower() maps each character to one character, so the
+        # positions in the lowered text are the positions in the original.
+        for end, char in enumerate(text.lower()):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for length in out[node]:
+                start = end + 1 - length
+                if longest.get(start, 0) < end + 1:
+                    longest[start] = end + 1
+
+        matches = []
+        covered = 0
+        for start in sorted(longest):
+            if start >= covered:
+                covered = longest[start]
+                matches.append((start, covered))
+        return matches
+
+    def sub(self, text):
+        """Return the text with each filtered word replaced by asterisks.
+
+        :type text: unicode
+        :rtype: unicode
+        """
+        matches = self.find(text)
+        if not matches:
+            return text
+        parts = []
+        pos = 0
+        for start, end in matches:
+            parts.append(text[pos:start])
+            parts.append(u'*' * (end - start))
+            pos = end
+        parts.append(text[pos:])
+        return u''.join(parts)
+
+_filter_lock = threading.Lock()
+_filter = (None, None)
+
+def get_vulgarity_filter(filtered_words):
+    """Return a filter for the given value of the ``vulgarity_filtered_words``
+    setting.
+
+    The filter is kept until the setting changes, so it's only built once
+    for every process.
+
+    :param filtered_words: A comma separated list of words.
+    :rtype: :class:`VulgarityFilter`
+    """
+    global _filter
+    setting, vulgarity_filter = _filter
+    if setting == filtered_words:
+        return vulgarity_filter
+    _filter_lock.acquire()
+    try:
+        setting, vulgarity_filter = _filter
+        if setting != filtered_words:
+            vulgarity_filter = VulgarityFilter(word.strip() for word
+                                               in filtered_words.split(','))
+            _filter = (filtered_words, vulgarity_filter)
+        return vulgarity_filter
+    finally:
+        _filter_lock.release()
@@ -21,14 +21,17 @@ import re
 from BeautifulSoup import BeautifulSoup
 from webhelpers import text
 
+from mediacore.lib.cache_stats import cache_stats
+from mediacore.lib.compat import sha1
 from mediacore.lib.xhtml.htmlsanitizer import (Cleaner,
     entities_to_unicode as decode_entities,
     encode_xhtml_entities as encode_entities)
+from mediacore.lib.xhtml.sanitizer import UnsupportedMarkup, sanitize
 
 __all__ = [
-    'clean_xhtml', 'decode_entities', 'encode_entities', 'excerpt_xhtml',
-    'line_break_xhtml', 'list_acceptable_xhtml', 'strip_xhtml',
-    'truncate_xhtml',
+    'CleanCache', 'clean_cache', 'clean_xhtml', 'decode_entities',
+    'encode_entities', 'excerpt_xhtml', 'line_break_xhtml',
+    'list_acceptable_xhtml', 'strip_xhtml', 'truncate_xhtml',
 ]
 
 # Configuration for HTML sanitization
@@ -57,10 +60,106 @@ cleaner_settings = dict(
     filters = cleaner_filters
 )
 
+class CleanCache(object):
+    """Memoize the output of :func:`clean_xhtml`.
+
+    Each description is sanitized every time it's saved or imported,
+    although most saves don't change it. The output only depends on the
+    input and the cleaner settings, so it's kept by this process, keyed on
+    a hash of both. The most recently used entries are kept in two
+    generations of at most ``size`` entries each.
+
+    :param size: The number of entries per generation.
+
+    """
+    def __init__(self, size=1000):
+        self.size = size
+        self._current = {}
+        self._previous = {}
+        self._settings_keys = {}
+
+    def configure(self, size):
+        """Set the number of entries to keep, and clear the cache."""
+        self.size = int(size)
+        self.clear()
+
+    def clear(self):
+        """Forget all entries in this process."""
+        self._current = {}
+        self._previous = {}
+
+    def key(self, string, p_wrap, settings):
+        """Return the cache key for the given :func:`clean_xhtml` arguments.
+
+        :param string: The input string.
+        :type string: unicode
+        :param p_wrap: The ``p_wrap`` flag.
+        :param settings: Constructor kwargs for
+            :class:`~mediacore.lib.xhtml.htmlsanitizer.Cleaner`.
+        :rtype: tuple
+        """
+        return (sha1(string.encode('utf-8')).digest(), bool(p_wrap),
+                self._settings_key(settings))
+
+    def clean(self, string, p_wrap, settings, clean_func):
+        """Return the cleaned string, from the cache if possible.
+
+        :param clean_func: A callable which takes the same arguments as
+            :meth:`key` and returns the cleaned string.
+        :rtype: unicode
+        """
+        if self.size <= 0:
+            return clean_func(string, p_wrap, settings)
+        key = self.key(string, p_wrap, settings)
+        result = self._current.get(key)
+        if result is None:
+            result = self._previous.get(key)
+            if result is None:
+                cache_stats.incr('clean_xhtml', 'miss')
+                result = clean_func(string, p_wrap, settings)
+            else:
+                cache_stats.incr('clean_xhtml', 'hit')
+            self._store(key, result)
+        else:
+            cache_stats.incr('clean_xhtml', 'hit')
+        return result
+
+    def _settings_key(self, settings):
+        # The settings are almost always the module-level defaults, so
+        # their hash is only computed once for every settings dict. The
+        # dict is kept alongside its key so that its id isn't reused.
+        cached = self._settings_keys.get(id(settings))
+        if cached is not None and cached[0] is settings:
+            return cached[1]
+        parts = []
+        for name, value in sorted(settings.iteritems()):
+            if isinstance(value, dict):
+                value = sorted(value.iteritems())
+            elif isinstance(value, (list, tuple)):
+                value = list(value)
+            parts.append((name, value))
+        settings_key = sha1(repr(parts)).digest()
+        if len(self._settings_keys) >= 100:
+            self._settings_keys = {}
+        self._settings_keys[id(settings)] = (settings, settings_key)
+        return settings_key
+
+    def _store(self, key, result):
+        current = self._current
+        if len(current) >= self.size:
+            # Drop the oldest generation. Assignments are atomic, so
+            # racing threads can at worst lose an entry.
+            self._previous = current
+            current = self._current = {}
+        current[key] = result
+
+clean_cache = CleanCache()
+
 def clean_xhtml(string, p_wrap=True, _cleaner_settings=None):
     """Convert the given plain text or HTML into valid XHTML.
 
     If there is no markup in the string, apply paragraph formatting.
+    Results are memoized by :data:`clean_cache`.
 
     :param string: XHTML input string
     :type string: unicode
@@ -79,6 +178,9 @@ def clean_xhtml(string, p_wrap=True, _cleaner_settings=None):
     if _cleaner_settings is None:
         _cleaner_settings = cleaner_settings
 
+    return clean_cache.clean(string, p_wrap, _cleaner_settings, _clean_xhtml)
+
+def _clean_xhtml(string, p_wrap, _cleaner_settings, _single_pass=True):
     # remove carriage return chars; FIXME: is this necessary?
     string = string.replace(u"\r", u"")
 
@@ -89,25 +191,22 @@ def clean_xhtml(string, p_wrap=True, _cleaner_settings=None):
     # replace all blank lines with <br> tags
     string = blank_line.sub(u"<br/>", string)
 
-    # initialize and run the cleaner
-    string = Cleaner(string, **_cleaner_settings)()
-    # FIXME: It's possible that the rename_tags operation creates
-    # some invalid nesting. e.g.
-    # >>> c = Cleaner("", "rename_tags", elem_map={'h2': 'p'})
-    # >>> c('<p><h2>head</h2></p>')
-    # u'<p><p>head</p></p>'
-    # This is undesirable, so here we... just re-parse the markup.
-    # But this ... could be pretty slow.
-    cleaner = Cleaner(string, **_cleaner_settings)
-    string = cleaner()
+    cleaned = None
+    if _single_pass:
+        try:
+            # The same output as running the Cleaner twice, in one parse
+            cleaned = sanitize(string, _cleaner_settings)
+        except UnsupportedMarkup:
+            cache_stats.incr('clean_xhtml', 'fallback')
+    if cleaned is None:
+        cleaned = _run_cleaner(string, _cleaner_settings)
+    string, plain_text = cleaned
 
     # Wrap in a <p> tag when no tags are used, and there are no blank
     # lines to trigger automatic <p> creation
     # FIXME: This should trigger any time we don't have a wrapping block tag
     # FIXME: This doesn't wrap orphaned text when it follows a <p> tag, for ex
-    if p_wrap \
-        and len(cleaner.root.contents) == 1 \
-        and isinstance(cleaner.root.contents[0], basestring):
+    if p_wrap and plain_text:
         string = u"<p>%s</p>" % string.strip()
 
     # strip all whitespace from immediately before/after block-level elements
@@ -115,6 +214,22 @@ def clean_xhtml(string, p_wrap=True, _cleaner_settings=None):
 
     return string.strip()
 
+def _run_cleaner(string, _cleaner_settings):
+    # initialize and run the cleaner
+    string = Cleaner(string, **_cleaner_settings)()
+    # FIXME: It's possible that the rename_tags operation creates
+    # some invalid nesting. e.g.
+    # >>> c = Cleaner("", "rename_tags", elem_map={'h2': 'p'})
+    # >>> c('<p><h2>head</h2></p>')
+    # u'<p><p>head</p></p>'
+    # This is undesirable, so here we... just re-parse the markup.
+    # But this ... could be pretty slow.
+    cleaner = Cleaner(string, **_cleaner_settings)
+    string = cleaner()
+    plain_text = len(cleaner.root.contents) == 1 \
+        and isinstance(cleaner.root.contents[0], basestring)
+    return string, plain_text
+
 def truncate_xhtml(string, size, _strip_xhtml=False, _decode_entities=False):
     """Truncate a XHTML string to roughly a given size (full words).
 
@@ -190,14 +305,15 @@ def strip_xhtml(string, _decode_entities=False):
 
     return string
 
-def line_break_xhtml(string):
-    """Add a linebreak after block-level tags are closed.
+def line_break_xhtml(string, lines=1):
+    """Add linebreaks after block-level tags are closed.
 
     :type string: unicode
+    :param lines: The number of linebreaks to add after each tag.
     :rtype: unicode
     """
     if string:
-        string = block_close.sub(u"\\1\n", string).rstrip()
+        string = block_close.sub(u"\\1" + u"\n" * lines, string).rstrip()
     return string
 
 def list_acceptable_xhtml():
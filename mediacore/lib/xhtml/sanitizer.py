@@ -0,0 +1,711 @@
+# This file is a part of MediaCore, Copyright 2010 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Single-pass XHTML Sanitizer
+
+:func:`sanitize` returns the same markup as running the
+:class:`~mediacore.lib.xhtml.htmlsanitizer.Cleaner` twice, the way
+:func:`~mediacore.lib.xhtml.clean_xhtml` does, at a fraction of the cost.
+
+The input is tokenized once, following the rules of BeautifulSoup's parser,
+into a lightweight tree that the Cleaner's filters are applied to. Rather
+than rendering the result and parsing it again, the tree is replayed into
+a new one the way that parse would see it, and filtered a second time.
+
+The quirks of BeautifulSoup 3.2.1 are reproduced, down to which sibling
+:meth:`~mediacore.lib.xhtml.htmlsanitizer.Cleaner.disgorge_elem` splices
+into. Markup outside the well-formed subset that's modelled here, such as
+comments, script tags, unquoted or duplicate attributes, raises
+:class:`UnsupportedMarkup` so that the caller can fall back to the Cleaner.
+
+"""
+import re
+from htmlentitydefs import name2codepoint
+from sgmllib import (SGMLParser, charref, endbracket, entityref, incomplete,
+    interesting, starttagopen)
+
+import BeautifulSoup
+
+from mediacore.lib.xhtml.htmlsanitizer import (URL_RE, default_settings,
+    encode_xhtml_entities)
+
+__all__ = ['UnsupportedMarkup', 'sanitize']
+
+# Older releases don't escape text as it's rendered, which changes the
+# output of almost every filter.
+supported = BeautifulSoup.__version__ in ('3.2.1', '3.2.2')
+
+_Soup = BeautifulSoup.BeautifulSoup
+_xml_entities = _Soup.XML_ENTITIES_TO_SPECIAL_CHARS
+_xml_specials = _Soup.XML_SPECIAL_CHARS_TO_ENTITIES
+_self_closing = _Soup.SELF_CLOSING_TAGS
+_preserve_whitespace = _Soup.PRESERVE_WHITESPACE_TAGS
+_special_tags = dict.fromkeys(_Soup.QUOTE_TAGS.keys() + ['meta', 'rootrootroot'])
+
+_bare_ampersand_or_bracket = BeautifulSoup.NavigableString.BARE_AMPERSAND_OR_BRACKET
+_attr_entity = re.compile("&(#\d+|#x[0-9a-fA-F]+|\w+);")
+_attr_ref = SGMLParser.entity_or_charref
+
+# The start tags that sgmllib and the tag stack handle like everything else:
+# quoted attributes, and no brackets that would end the tag early.
+_start_tag = re.compile(r"""<([a-zA-Z][a-zA-Z0-9]*)((?:\s+[a-zA-Z_][-:.a-zA-Z_0-9]*\s*=\s*(?:"[^"<>]*"|'[^'<>]*'))*)\s*/?>""")
+_attr = re.compile(r"""([a-zA-Z_][-:.a-zA-Z_0-9]*)\s*=\s*(?:"([^"<>]*)"|'([^'<>]*)')""")
+_tag_name = re.compile(r'^[a-z][a-z0-9]*$')
+
+_any_space = re.compile("\s+", re.M)
+_start_space = re.compile("^\s+")
+_non_word = re.compile('\W')
+
+# Deeper trees are left to the Cleaner, along with its recursion limits.
+_max_depth = 100
+
+class UnsupportedMarkup(ValueError):
+    """Raised for input that only the Cleaner can sanitize faithfully."""
+
+class _Text(object):
+    __slots__ = ('value', 'parent')
+
+    def __init__(self, value):
+        self.value = value
+        self.parent = None
+
+class _Element(object):
+    __slots__ = ('name', 'attrs', 'children', 'parent', 'self_closing')
+
+    def __init__(self, name, attrs=None):
+        self.name = name
+        self.attrs = attrs or []
+        self.children = []
+        self.parent = None
+        # As in BeautifulSoup, this is decided by the original name.
+        self.self_closing = name in _self_closing
+
+    def append(self, node):
+        node.parent = self
+        self.children.append(node)
+
+    def insert(self, index, node):
+        node.parent = self
+        self.children.insert(index, node)
+
+    def index(self, node):
+        for i, child in enumerate(self.children):
+            if child is node:
+                return i
+        raise ValueError(node)
+
+    def extract(self, node):
+        del self.children[self.index(node)]
+        node.parent = None
+
+    def get(self, key, default=None):
+        value = default
+        for name, val in self.attrs:
+            if name == key:
+                value = val
+        return value
+
+    def set(self, key, value):
+        found = False
+        for i, (name, val) in enumerate(self.attrs):
+            if name == key:
+                self.attrs[i] = (key, value)
+                found = True
+        if not found:
+            self.attrs.append((key, value))
+
+    def delete(self, key):
+        # Like Tag.__delitem__, which skips the item after each one removed.
+        for item in self.attrs:
+            if item[0] == key:
+                self.attrs.remove(item)
+
+def _escape(text):
+    """Escape the text the way a NavigableString is rendered."""
+    return _bare_ampersand_or_bracket.sub(
+        lambda m: u'&%s;' % _xml_specials[m.group(0)[0]], text)
+
+def _unichr(number, base=10):
+    try:
+        return unichr(int(number, base))
+    except (ValueError, OverflowError):
+        # Let the Cleaner raise its own error
+        raise UnsupportedMarkup('Invalid character reference: %r' % number)
+
+def _convert_ref(match):
+    """Decode an entity reference in an attribute, as sgmllib does."""
+    name, number, semicolon = match.groups()
+    if number:
+        if 0 <= int(number) <= 127:
+            return unichr(int(number))
+        return u'&#%s%s' % (number, semicolon)
+    elif semicolon:
+        return SGMLParser.entitydefs.get(name) or u'&%s;' % name
+    return u'&%s' % name
+
+def _convert_entity(match, convert):
+    """Decode an entity reference in an attribute, as a Tag does."""
+    name = match.group(1)
+    if convert and name in name2codepoint:
+        return unichr(name2codepoint[name])
+    elif name in _xml_entities:
+        if convert:
+            return _xml_entities[name]
+        return u'&%s;' % name
+    elif name[0] == '#':
+        if name[1:2] == 'x':
+            return _unichr(name[2:], 16)
+        return _unichr(name[1:])
+    return u'&%s;' % name
+
+def _parsed_value(value):
+    """Return a quoted attribute value as the parser passes it on."""
+    value = _attr_ref.sub(_convert_ref, value)
+    return _attr_entity.sub(lambda m: _convert_entity(m, True), value)
+
+def _entity_text(name):
+    if name in name2codepoint:
+        return unichr(name2codepoint[name])
+    return _xml_entities.get(name) or u'&amp;%s' % name
+
+class _Builder(object):
+    """Build a tree from parser events, the way BeautifulSoup does."""
+
+    def __init__(self):
+        self.root = _Element(u'rootrootroot')
+        self.stack = [self.root]
+        self.data = []
+
+    def handle_data(self, data):
+        self.data.append(data)
+
+    def end_data(self):
+        if not self.data:
+            return
+        data = u''.join(self.data)
+        self.data = []
+        if not data.translate(_Soup.STRIP_ASCII_SPACES):
+            for element in self.stack:
+                if element.name in _preserve_whitespace:
+                    break
+            else:
+                data = '\n' in data and u'\n' or u' '
+        self.stack[-1].append(_Text(data))
+
+    def start(self, name, attrs):
+        if name in _special_tags:
+            raise UnsupportedMarkup('Unsupported tag: %s' % name)
+        self.end_data()
+        element = _Element(name, attrs)
+        if not element.self_closing:
+            self._smart_pop(name)
+        self.stack[-1].append(element)
+        if not element.self_closing:
+            self.stack.append(element)
+            if len(self.stack) > _max_depth:
+                raise UnsupportedMarkup('Nested too deeply')
+
+    def end(self, name):
+        self.end_data()
+        self._pop_to(name)
+
+    def close(self):
+        self.end_data()
+        return self.root
+
+    def _pop_to(self, name, inclusive=True):
+        stack = self.stack
+        pops = 0
+        for i in range(len(stack) - 1, 0, -1):
+            if stack[i].name == name:
+                pops = len(stack) - i
+                break
+        if not inclusive:
+            pops -= 1
+        if pops > 0:
+            del stack[-pops:]
+
+    def _smart_pop(self, name):
+        reset_triggers = _Soup.NESTABLE_TAGS.get(name)
+        resets_nesting = name in _Soup.RESET_NESTING_TAGS
+        for element in reversed(self.stack[1:]):
+            if element.name == name and reset_triggers is None:
+                self._pop_to(name)
+                return
+            if (reset_triggers is not None and element.name in reset_triggers) \
+                or (reset_triggers is None and resets_nesting
+                    and element.name in _Soup.RESET_NESTING_TAGS):
+                self._pop_to(element.name, False)
+                return
+
+def _parse(markup, builder):
+    """Feed the markup to the builder, as sgmllib would.
+
+    BeautifulSoup never closes its parser, so anything left over after an
+    incomplete reference or tag at the end of the markup is dropped.
+    """
+    i = 0
+    n = len(markup)
+    while i < n:
+        match = interesting.search(markup, i)
+        if match:
+            j = match.start()
+        else:
+            j = n
+        if i < j:
+            builder.handle_data(markup[i:j])
+        i = j
+        if i == n:
+            break
+        if markup[i] == u'<':
+            if starttagopen.match(markup, i):
+                match = _start_tag.match(markup, i)
+                if not match:
+                    raise UnsupportedMarkup('Unsupported start tag')
+                attrs = []
+                seen = {}
+                for attr in _attr.finditer(match.group(2)):
+                    name = attr.group(1).lower()
+                    if name in seen:
+                        raise UnsupportedMarkup('Duplicate attribute')
+                    seen[name] = None
+                    value = attr.group(2)
+                    if value is None:
+                        value = attr.group(3)
+                    attrs.append((name, _parsed_value(value)))
+                builder.start(match.group(1).lower(), attrs)
+                i = match.end()
+                continue
+            if markup.startswith(u'</', i):
+                match = endbracket.search(markup, i + 1)
+                if not match:
+                    break
+                j = match.start()
+                name = markup[i+2:j].strip().lower()
+                try:
+                    name.encode('ascii')
+                except UnicodeError:
+                    # sgmllib fails to look up a handler for it
+                    raise UnsupportedMarkup('Unsupported end tag')
+                builder.end(name)
+                if markup[j] == u'>':
+                    j += 1
+                i = j
+                continue
+            if markup.startswith(u'<!', i) or markup.startswith(u'<?', i):
+                raise UnsupportedMarkup('Unsupported declaration')
+        else:
+            match = charref.match(markup, i)
+            if match:
+                builder.handle_data(_unichr(match.group(1)))
+                i = match.end()
+                if markup[i-1] != u';':
+                    i -= 1
+                continue
+            match = entityref.match(markup, i)
+            if match:
+                builder.handle_data(_entity_text(match.group(1)))
+                i = match.end()
+                if markup[i-1] != u';':
+                    i -= 1
+                continue
+        match = incomplete.match(markup, i)
+        if not match:
+            builder.handle_data(markup[i])
+            i += 1
+            continue
+        j = match.end()
+        if j == n:
+            break
+        builder.handle_data(markup[i:j])
+        i = j
+
+def _replay(element, events):
+    """List the start tags, end tags and text that the element renders as.
+
+    Adjacent strings are rendered as a single run of text.
+    """
+    for child in element.children:
+        if child.__class__ is _Text:
+            text = _escape(child.value)
+            if not text:
+                continue
+            if events and events[-1][0] is None:
+                events[-1] = (None, events[-1][1] + text)
+            else:
+                events.append((None, text))
+        else:
+            if not _tag_name.match(child.name) or child.name in _special_tags:
+                raise UnsupportedMarkup('Unsupported tag: %s' % child.name)
+            events.append((True, child))
+            _replay(child, events)
+            if not child.self_closing:
+                events.append((False, child.name))
+    return events
+
+def _reparsed_value(value):
+    """Return an attribute value as it reads once rendered and parsed."""
+    if u'"' in value and u"'" in value:
+        value = value.replace(u"'", u"&squot;")
+    return _parsed_value(_escape(value))
+
+def _reparse(root):
+    """Return the tree that parsing the rendered markup would build."""
+    builder = _Builder()
+    events = _replay(root, [])
+    last = len(events) - 1
+    for i, (kind, value) in enumerate(events):
+        if kind is None:
+            if i < last:
+                # The next tag ends any entity reference at the end.
+                value += u'<'
+            _parse(value, builder)
+        elif kind:
+            builder.start(value.name, [(key, _reparsed_value(val))
+                                       for key, val in value.attrs])
+        else:
+            builder.end(value)
+    return builder.close()
+
+def _render(element, parts):
+    for child in element.children:
+        if child.__class__ is _Text:
+            parts.append(_escape(child.value))
+            continue
+        attrs = []
+        for key, val in child.attrs:
+            fmt = u'%s="%s"'
+            if u'"' in val:
+                fmt = u"%s='%s'"
+                if u"'" in val:
+                    val = val.replace(u"'", u"&squot;")
+            attrs.append(fmt % (key, _escape(val)))
+        parts.append(u'<%s%s%s>' % (child.name,
+                                    attrs and u' ' + u' '.join(attrs) or u'',
+                                    child.self_closing and u' /' or u''))
+        _render(child, parts)
+        if not child.self_closing:
+            parts.append(u'</%s>' % child.name)
+    return parts
+
+def _elements(element, found=None):
+    """Return the descendants of the element, in document order."""
+    if found is None:
+        found = []
+    for child in element.children:
+        if child.__class__ is _Element:
+            found.append(child)
+            _elements(child, found)
+    return found
+
+def _texts(element, found=None):
+    """Return the non-empty strings in the element, in document order."""
+    if found is None:
+        found = []
+    for child in element.children:
+        if child.__class__ is _Element:
+            _texts(child, found)
+        elif child.value:
+            found.append(child)
+    return found
+
+def _find(element, match):
+    for child in element.children:
+        if child.__class__ is _Element:
+            if match(child):
+                return child
+            found = _find(child, match)
+            if found is not None:
+                return found
+    return None
+
+def _same(a, b):
+    """Compare elements the way Tag.__eq__ does."""
+    if a is b:
+        return True
+    if a.name != b.name or a.attrs != b.attrs \
+        or len(a.children) != len(b.children):
+        return False
+    for x, y in zip(a.children, b.children):
+        if x.__class__ is not y.__class__:
+            return False
+        if x.__class__ is _Text:
+            if x.value != y.value:
+                return False
+        elif not _same(x, y):
+            return False
+    return True
+
+def _disgorge(element):
+    """Replace the element with its children.
+
+    Like Cleaner.disgorge_elem, the children are spliced in where the first
+    sibling equal to the element is, which isn't always the element itself.
+    """
+    parent = element.parent
+    for index, sibling in enumerate(parent.children):
+        if sibling.__class__ is _Element and _same(sibling, element):
+            break
+    parent.extract(element)
+    children = element.children
+    element.children = []
+    for child in children:
+        child.parent = parent
+    parent.children[index:index] = children
+
+def _wrap_string(start_at, name, block_elems):
+    children = start_at.children
+    start_at.children = []
+    wrapped = []
+    paragraph = None
+    last_state = 'block'
+    for node in children + [None]:
+        if node is None:
+            state = 'end'
+        elif node.__class__ is _Element and node.name in block_elems:
+            state = 'block'
+        else:
+            state = 'inline'
+        if last_state == 'block' and state == 'inline':
+            paragraph = _Element(name)
+        if state == 'inline':
+            paragraph.append(node)
+        elif last_state == 'inline':
+            wrapped.append(paragraph)
+        if state == 'block':
+            wrapped.append(node)
+        last_state = state
+    for node in wrapped:
+        start_at.append(node)
+
+def add_nofollow(root, settings):
+    for a in _elements(root):
+        if a.name == 'a':
+            rel = a.get('rel', u'').split(u' ')
+            if u'nofollow' not in rel:
+                rel.append(u'nofollow')
+            a.set('rel', u' '.join(rel).strip())
+
+def br_to_p(root, settings):
+    block_elems = settings['block_elements'].copy()
+    block_elems['br'] = None
+    block_elems['p'] = None
+    is_br = lambda element: element.name == 'br'
+    while True:
+        br = _find(root, is_br)
+        if br is None:
+            break
+        parent = br.parent
+        _wrap_string(parent, u'p', block_elems)
+        parent.children = [child for child in parent.children
+                           if child.__class__ is not _Element
+                           or child.name != 'br']
+        if parent.name == 'p':
+            _disgorge(parent)
+
+def clean_whitespace(root, settings):
+    def condense():
+        for text in _texts(root):
+            text.value = _any_space.sub(u' ', _escape(text.value))
+
+    def separate_strings(element):
+        for child in element.children:
+            if child.__class__ is _Element:
+                separate_strings(child)
+        current = None
+        for next in element.children + [None]:
+            if current.__class__ is _Text:
+                if next.__class__ is _Text:
+                    # Merge adjacent strings
+                    element.extract(next)
+                    current.value = _escape(current.value) \
+                        + _escape(next.value)
+                    continue
+                split = _start_space.split(_escape(current.value))
+                if len(split) > 1 and split[1]:
+                    # Split off the leading whitespace
+                    index = element.index(current)
+                    element.extract(current)
+                    element.insert(index, _Text(split[1]))
+                    element.insert(index, _Text(u' '))
+            current = next
+
+    def reassign_whitespace():
+        after = None
+        for current in reversed(_texts(root)):
+            if after is not None and not after.value.strip():
+                # Append whitespace to the string before it
+                current.value = _escape(current.value) + _escape(after.value)
+                after.parent.extract(after)
+            after = current
+
+    condense()
+    separate_strings(root)
+    reassign_whitespace()
+    condense()
+
+def encode_xml_specials(root, settings):
+    for text in _texts(root):
+        text.value = encode_xhtml_entities(_escape(text.value))
+
+def make_links(root, settings):
+    def linkify(node):
+        parent = node.parent
+        index = parent.index(node)
+        string = _escape(node.value)
+        new_content = []
+        o = 0
+        for m in URL_RE.finditer(string):
+            s, e = m.span()
+            if e >= len(string) or _non_word.match(string[e]):
+                href = _attr_entity.sub(
+                    lambda ref: _convert_entity(ref, False), m.group())
+                link = _Element(u'a', [('href', href)])
+                link.append(_Text(m.group()))
+                if o < s:
+                    new_content.append(_Text(string[o:s]))
+                new_content.append(link)
+                o = e
+        if o > 0:
+            if o < len(string):
+                new_content.append(_Text(string[o:]))
+            parent.extract(node)
+            for x in new_content:
+                parent.insert(index, x)
+                index += 1
+
+    for node in _texts(root):
+        parent = node.parent
+        while parent is not None and parent.name != 'a':
+            parent = parent.parent
+        if parent is None:
+            linkify(node)
+
+def rename_tags(root, settings):
+    elem_map = settings['elem_map']
+    if not elem_map and root.children:
+        # BeautifulSoup would match every tag, and fail to rename them
+        raise UnsupportedMarkup('The elem_map is empty')
+    for element in [e for e in _elements(root) if e.name in elem_map]:
+        element.name = elem_map[element.name]
+
+def strip_attrs(root, settings):
+    valid_attrs = settings['valid_attrs']
+    for element in _elements(root):
+        element.attrs = [(key, val) for key, val in element.attrs
+                         if key in valid_attrs]
+
+def strip_empty_tags(root, settings):
+    def strip_empty(node):
+        if node.__class__ is _Text:
+            if not node.value:
+                node.parent.extract(node)
+            return
+        for child in list(node.children):
+            strip_empty(child)
+        if node is root:
+            return
+        if not node.children:
+            node.parent.extract(node)
+        else:
+            for child in node.children:
+                if child.__class__ is not _Text or child.value.strip():
+                    return
+            _disgorge(node)
+
+    strip_empty(root)
+
+def strip_schemes(root, settings):
+    for element in _elements(root):
+        for key in settings['attrs_considered_links']:
+            scheme_bits = element.get(key, u'').split(u':', 1)
+            if len(scheme_bits) > 1 \
+                and scheme_bits[0] not in settings['valid_schemes']:
+                element.delete(key)
+
+def strip_tags(root, settings):
+    valid_tags = settings['valid_tags']
+    is_invalid = lambda element: element.name not in valid_tags
+    while True:
+        element = _find(root, is_invalid)
+        if element is None:
+            break
+        _disgorge(element)
+
+def strip_nothing(root, settings):
+    # Comments and CDATA are never parsed
+    pass
+
+_filters = {
+    'add_nofollow': add_nofollow,
+    'br_to_p': br_to_p,
+    'clean_whitespace': clean_whitespace,
+    'encode_xml_specials': encode_xml_specials,
+    'make_links': make_links,
+    'rename_tags': rename_tags,
+    'strip_attrs': strip_attrs,
+    'strip_cdata': strip_nothing,
+    'strip_comments': strip_nothing,
+    'strip_empty_tags': strip_empty_tags,
+    'strip_schemes': strip_schemes,
+    'strip_tags': strip_tags,
+}
+
+def sanitize(string, settings):
+    """Run the input through the Cleaner's filters twice, in a single parse.
+
+    :param string: The markup to sanitize.
+    :type string: unicode
+    :param settings: Constructor kwargs for
+        :class:`~mediacore.lib.xhtml.htmlsanitizer.Cleaner`.
+    :rtype: tuple
+    :returns: The sanitized markup, and whether it's a single string
+        without any tags, which :func:`~mediacore.lib.xhtml.clean_xhtml`
+        wraps in a paragraph.
+    :raises UnsupportedMarkup: If the input or settings aren't supported.
+        :class:`~mediacore.lib.xhtml.htmlsanitizer.Cleaner` should be used
+        instead.
+
+    """
+    if not supported:
+        raise UnsupportedMarkup('BeautifulSoup %s is not supported'
+                                % BeautifulSoup.__version__)
+    if not isinstance(string, unicode):
+        raise UnsupportedMarkup('The input must be unicode')
+    merged = default_settings.copy()
+    merged.update(settings)
+    if merged['html5'] or merged['convert_entities'] != _Soup.XHTML_ENTITIES:
+        raise UnsupportedMarkup('Unsupported parser settings')
+    try:
+        filters = [_filters[name] for name in merged['filters']]
+    except KeyError, e:
+        raise UnsupportedMarkup('Unsupported filter: %s' % e.args[0])
+
+    for fix, m in _Soup.MARKUP_MASSAGE:
+        string = fix.sub(m, string)
+    builder = _Builder()
+    _parse(string, builder)
+    root = builder.close()
+    for f in filters:
+        f(root, merged)
+
+    # Filter the tree that the Cleaner would parse from the output again
+    root = _reparse(root)
+    for f in filters:
+        f(root, merged)
+
+    children = root.children
+    single_string = len(children) == 1 and children[0].__class__ is _Text
+    return u''.join(_render(root, [])), single_string
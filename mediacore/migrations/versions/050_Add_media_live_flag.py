@@ -0,0 +1,54 @@
+from datetime import datetime
+
+from sqlalchemy import *
+from migrate import *
+
+metadata = MetaData()
+
+media = Table('media', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    Column('reviewed', Boolean, default=False, nullable=False),
+    Column('encoded', Boolean, default=False, nullable=False),
+    Column('publishable', Boolean, default=False, nullable=False),
+    Column('live', Boolean, default=False, nullable=False, server_default='0'),
+    Column('modified_on', DateTime, default=datetime.now, onupdate=datetime.now, nullable=False),
+    Column('publish_on', DateTime),
+    Column('publish_until', DateTime),
+    Column('popularity_points', Integer, default=0, nullable=False),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
+live_publish_on_index = Index('media_live_publish_on',
+                              media.c.live, media.c.publish_on)
+live_popularity_index = Index('media_live_popularity',
+                              media.c.live, media.c.popularity_points)
+
+def upgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    conn = migrate_engine.connect()
+
+    transaction = conn.begin()
+    media.c.live.create(media)
+    transaction.commit()
+
+    transaction = conn.begin()
+    now = datetime.now()
+    conn.execute(media.update().where(and_(
+        media.c.reviewed == True,
+        media.c.encoded == True,
+        media.c.publishable == True,
+        media.c.publish_on <= now,
+        or_(media.c.publish_until == None,
+            media.c.publish_until >= now),
+    )).values(live=True, modified_on=media.c.modified_on))
+    transaction.commit()
+
+    live_publish_on_index.create(migrate_engine)
+    live_popularity_index.create(migrate_engine)
+
+def downgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    live_popularity_index.drop(migrate_engine)
+    live_publish_on_index.drop(migrate_engine)
+    media.c.live.drop()
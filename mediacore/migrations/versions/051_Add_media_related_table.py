@@ -0,0 +1,34 @@
+from sqlalchemy import *
+from migrate import *
+
+metadata = MetaData()
+
+media = Table('media', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
+media_related = Table('media_related', metadata,
+    Column('media_id', Integer, ForeignKey('media.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True),
+    Column('related_id', Integer, ForeignKey('media.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True),
+    Column('score', Float, nullable=False),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
+score_index = Index('media_related_score',
+                    media_related.c.media_id, media_related.c.score)
+
+def upgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    # The score index is created along with the table.
+    media_related.create()
+    # The table is filled by batch-scripts/maintenance/rebuild_related_media.py
+    # Until then, related media fall back to those in the same categories.
+
+def downgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    media_related.drop()
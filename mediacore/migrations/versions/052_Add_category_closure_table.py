@@ -0,0 +1,54 @@
+from sqlalchemy import *
+from migrate import *
+
+metadata = MetaData()
+
+categories = Table('categories', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    Column('parent_id', Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='CASCADE')),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8'
+)
+
+category_closure = Table('category_closure', metadata,
+    Column('ancestor_id', Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True),
+    Column('descendant_id', Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True),
+    Column('depth', Integer, nullable=False),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8'
+)
+
+descendant_index = Index('category_closure_descendant',
+                         category_closure.c.descendant_id,
+                         category_closure.c.depth)
+
+def upgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    conn = migrate_engine.connect()
+    # The descendant index is created along with the table
+    category_closure.create()
+
+    parents = dict(conn.execute(
+        select([categories.c.id, categories.c.parent_id])).fetchall())
+    rows = []
+    for cat_id in parents:
+        # Walk up to the root, stopping if the nesting is circular
+        ancestor_id, depth, seen = cat_id, 0, set()
+        while ancestor_id is not None and ancestor_id not in seen:
+            rows.append({'ancestor_id': ancestor_id,
+                         'descendant_id': cat_id,
+                         'depth': depth})
+            seen.add(ancestor_id)
+            ancestor_id = parents.get(ancestor_id)
+            depth += 1
+
+    transaction = conn.begin()
+    if rows:
+        conn.execute(category_closure.insert(), rows)
+    transaction.commit()
+
+def downgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    category_closure.drop()
@@ -0,0 +1,99 @@
+from datetime import datetime
+
+from sqlalchemy import *
+from migrate import *
+
+metadata = MetaData()
+
+media = Table('media', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    Column('live', Boolean, default=False, nullable=False),
+    Column('modified_on', DateTime, default=datetime.now, onupdate=datetime.now, nullable=False),
+    Column('comment_count', Integer, default=0, nullable=False, server_default='0'),
+    Column('comment_count_published', Integer, default=0, nullable=False, server_default='0'),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
+tags = Table('tags', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    Column('media_count', Integer, default=0, nullable=False, server_default='0'),
+    Column('media_count_published', Integer, default=0, nullable=False, server_default='0'),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
+categories = Table('categories', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    Column('media_count', Integer, default=0, nullable=False, server_default='0'),
+    Column('media_count_published', Integer, default=0, nullable=False, server_default='0'),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
+media_tags = Table('media_tags', metadata,
+    Column('media_id', Integer, ForeignKey('media.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True),
+    Column('tag_id', Integer, ForeignKey('tags.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
+media_categories = Table('media_categories', metadata,
+    Column('media_id', Integer, ForeignKey('media.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True),
+    Column('category_id', Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
+comments = Table('comments', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    Column('media_id', Integer, ForeignKey('media.id', onupdate='CASCADE', ondelete='CASCADE')),
+    Column('publishable', Boolean, default=False, nullable=False),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
+def upgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    conn = migrate_engine.connect()
+
+    transaction = conn.begin()
+    for table in (tags, categories):
+        table.c.media_count.create(table)
+        table.c.media_count_published.create(table)
+    media.c.comment_count.create(media)
+    media.c.comment_count_published.create(media)
+    transaction.commit()
+
+    transaction = conn.begin()
+    for table, assoc, fk in ((tags, media_tags, media_tags.c.tag_id),
+                             (categories, media_categories, media_categories.c.category_id)):
+        conn.execute(table.update().values({
+            table.c.media_count: select([func.count(assoc.c.media_id)],
+                fk == table.c.id).as_scalar(),
+            table.c.media_count_published: select([func.count(assoc.c.media_id)],
+                and_(fk == table.c.id,
+                     assoc.c.media_id == media.c.id,
+                     media.c.live == True)).as_scalar(),
+        }))
+    conn.execute(media.update().values({
+        media.c.comment_count: select([func.count(comments.c.id)],
+            comments.c.media_id == media.c.id).as_scalar(),
+        media.c.comment_count_published: select([func.count(comments.c.id)],
+            and_(comments.c.media_id == media.c.id,
+                 comments.c.publishable == True)).as_scalar(),
+        media.c.modified_on: media.c.modified_on,
+    }))
+    transaction.commit()
+
+def downgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    media.c.comment_count_published.drop()
+    media.c.comment_count.drop()
+    for table in (tags, categories):
+        table.c.media_count_published.drop()
+        table.c.media_count.drop()
@@ -0,0 +1,21 @@
+from sqlalchemy import *
+from migrate import *
+
+metadata = MetaData()
+
+media = Table('media', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    Column('playable_by', UnicodeText),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
+def upgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    # Left NULL until each media is next saved, until then the players
+    # are checked against its files on every page view as before.
+    media.c.playable_by.create(media)
+
+def downgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    media.c.playable_by.drop()
@@ -0,0 +1,75 @@
+from sqlalchemy import *
+from migrate import *
+
+from mediacore.lib.xhtml import excerpt_xhtml, line_break_xhtml, strip_xhtml
+
+metadata = MetaData()
+
+media = Table('media', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    Column('description', UnicodeText),
+    Column('description_excerpt', UnicodeText),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
+podcasts = Table('podcasts', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    Column('description', UnicodeText),
+    Column('description_plain', UnicodeText),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
+EXCERPT_LENGTH = 340
+CHUNK_SIZE = 500
+
+def upgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    conn = migrate_engine.connect()
+
+    transaction = conn.begin()
+    media.c.description_excerpt.create(media)
+    podcasts.c.description_plain.create(podcasts)
+    transaction.commit()
+
+    backfill(conn, media, media.c.description_excerpt, media_excerpt)
+    backfill(conn, podcasts, podcasts.c.description_plain, plain_description)
+
+def downgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    media.c.description_excerpt.drop()
+    podcasts.c.description_plain.drop()
+
+def media_excerpt(description):
+    excerpt = excerpt_xhtml(description, EXCERPT_LENGTH)
+    if excerpt == description:
+        return None
+    return excerpt
+
+def plain_description(description):
+    return strip_xhtml(line_break_xhtml(description, 2), True)
+
+def backfill(conn, table, column, derive):
+    """Fill the given column from the description, a chunk of rows at a time."""
+    update = table.update()\
+        .where(table.c.id == bindparam('_id'))\
+        .values({column: bindparam('_value')})
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            select([table.c.id, table.c.description],
+                   and_(table.c.id > last_id,
+                        table.c.description != None,
+                        table.c.description != u''))
+            .order_by(table.c.id)
+            .limit(CHUNK_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        values = [{'_id': id, '_value': derive(description)}
+                  for id, description in rows]
+        transaction = conn.begin()
+        conn.execute(update, values)
+        transaction.commit()
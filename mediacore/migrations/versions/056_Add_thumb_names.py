@@ -0,0 +1,31 @@
+from sqlalchemy import *
+from migrate import *
+
+metadata = MetaData()
+
+media = Table('media', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    Column('thumb_name', Unicode(40)),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
+podcasts = Table('podcasts', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    Column('thumb_name', Unicode(40)),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
+def upgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    # Left NULL, so existing thumbs are still found by the item ID. Run
+    # batch-scripts/maintenance/compact_thumbs.py to replace the copies
+    # of the default thumbs with references to the shared files.
+    media.c.thumb_name.create(media)
+    podcasts.c.thumb_name.create(podcasts)
+
+def downgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    media.c.thumb_name.drop()
+    podcasts.c.thumb_name.drop()
@@ -14,7 +14,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from datetime import datetime
-from sqlalchemy import Table, ForeignKey, Column, sql
+from operator import attrgetter
+from sqlalchemy import Table, ForeignKey, Column, Index, sql
 from sqlalchemy.types import Unicode, UnicodeText, Integer, DateTime, Boolean, Float
 from sqlalchemy.orm import mapper, relation, backref, synonym, interfaces, validates, Query
 from sqlalchemy.orm.attributes import set_committed_value
@@ -30,10 +31,32 @@ categories = Table('categories', metadata,
     Column('name', Unicode(50), nullable=False, index=True),
     Column('slug', Unicode(SLUG_LENGTH), nullable=False, unique=True),
     Column('parent_id', Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='CASCADE')),
+    Column('media_count', Integer, default=0, nullable=False),
+    Column('media_count_published', Integer, default=0, nullable=False),
     mysql_engine='InnoDB',
     mysql_charset='utf8'
 )
 
+category_closure = Table('category_closure', metadata,
+    Column('ancestor_id', Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True),
+    Column('descendant_id', Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True),
+    Column('depth', Integer, nullable=False),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8'
+)
+"""Every (ancestor, descendant) pair in the category tree.
+
+Each category is also paired with itself at a depth of 0, so that a
+subtree can be selected by ancestor_id alone. The table is kept up to
+date by the :class:`mediacore.plugin.events.Category` observers below.
+"""
+
+# Ancestor paths and depths are looked up by descendant
+Index('category_closure_descendant', category_closure.c.descendant_id,
+      category_closure.c.depth)
+
 class CategoryNestingException(Exception):
     pass
 
@@ -52,6 +75,8 @@ def traverse(cats, depth=0, ancestors=None):
     """
     if ancestors is None:
         ancestors = {}
+        cats = list(cats)
+        populate_descendants(cats)
     for cat in cats:
         if cat.id in ancestors:
             raise CategoryNestingException, 'Category tree contains ' \
@@ -64,6 +89,41 @@ def traverse(cats, depth=0, ancestors=None):
         for subcat, subdepth in traverse(cat.children, depth + 1, child_anc):
             yield subcat, subdepth
 
+def populate_descendants(cats, max_depth=None):
+    """Load the children of the given categories to any depth in one query.
+
+    Categories whose children have already been loaded are left alone.
+
+    :param cats: A list of :class:`Category` instances.
+    :param max_depth: Optionally stop loading at this many levels deep.
+        The children of categories at the last level are lazy loaded if
+        they are accessed.
+
+    """
+    unloaded = [cat for cat in cats
+                if cat.id is not None and 'children' not in cat.__dict__]
+    if not unloaded:
+        return
+    query = DBSession.query(Category, category_closure.c.depth)\
+        .join((category_closure,
+               category_closure.c.descendant_id == Category.id))\
+        .filter(category_closure.c.ancestor_id.in_([c.id for c in unloaded]))\
+        .filter(category_closure.c.depth > 0)
+    if max_depth is not None:
+        query = query.filter(category_closure.c.depth <= max_depth)
+
+    depths = dict((cat, 0) for cat in unloaded)
+    for cat, depth in query:
+        depths[cat] = min(depth, depths.get(cat, depth))
+
+    children = defaultdict(CategoryList)
+    for cat in sorted(depths, key=attrgetter('name')):
+        children[cat.parent_id].append(cat)
+    for cat, depth in depths.iteritems():
+        if 'children' not in cat.__dict__ \
+        and (max_depth is None or depth < max_depth):
+            set_committed_value(cat, 'children', children[cat.id])
+
 def populated_tree(cats):
     """Return the root categories with children populated to any depth.
 
@@ -75,12 +135,11 @@ def populated_tree(cats):
 
     For example, printing the entire tree can be done with one query::
 
-        query = Category.query.options(undefer('media_count'))
-        for cat, depth in query.populated_tree().traverse():
+        for cat, depth in Category.query.populated_tree().traverse():
             print "    " * depth, cat.name, '(%d)' % cat.media_count
 
-    Without this method, especially with the media_count undeferred,
-    this would require a lot of extra queries for nested categories.
+    Without this method, this would require a lot of extra queries for
+    nested categories.
 
     NOTE: If the tree contains circular nesting, the circular portion
           of the tree will be silently omitted from the results.
@@ -121,6 +180,18 @@ class CategoryList(list):
 class Category(object):
     """
     Category Mapped Class
+
+    .. attribute:: media_count
+
+        The number of media directly in this category.
+
+    .. attribute:: media_count_published
+
+        The number of live media directly in this category.
+
+    Both counts exclude media in subcategories and are kept up to date by
+    the :class:`mediacore.plugin.events.Media` observers in
+    :mod:`mediacore.model.media`.
     """
     query = DBSession.query_property(CategoryQuery)
 
@@ -140,6 +211,7 @@ class Category(object):
 
     def traverse(self):
         """Iterate over all nested categories in depth-first order."""
+        populate_descendants([self])
         return traverse(self.children)
 
     def descendants(self):
@@ -149,13 +221,9 @@ class Category(object):
     def ancestors(self):
         """Return a list of ancestors, starting with the root node.
 
-        This method is optimized for when all categories have already
-        been fetched in the current DBSession::
+        The ancestors are fetched with one query::
 
-            >>> Category.query.all()    # run one query
-            >>> row = Category.query.get(50)   # doesn't use a query
-            >>> row.parent    # the DBSession recognized the primary key
-            <Category: parent>
+            >>> row = Category.query.get(50)
             >>> print row.ancestors()
             [...,
              <Category: great-grand-parent>,
@@ -163,19 +231,23 @@ class Category(object):
              <Category: parent>]
 
         """
-        ancestors = CategoryList()
-        anc = self.parent
-        while anc:
-            if anc is self:
-                raise CategoryNestingException, 'Category %s is defined as a ' \
-                    'parent of one of its ancestors.' % anc
-            ancestors.insert(0, anc)
-            anc = anc.parent
-        return ancestors
+        if self.id is None:
+            return CategoryList()
+        return CategoryList(Category.query\
+            .join((category_closure,
+                   category_closure.c.ancestor_id == Category.id))\
+            .filter(category_closure.c.descendant_id == self.id)\
+            .filter(category_closure.c.depth > 0)\
+            .order_by(None)\
+            .order_by(category_closure.c.depth.desc()))
 
     def depth(self):
         """Return this category's distance from the root of the tree."""
-        return len(self.ancestors())
+        if self.id is None:
+            return 0
+        return DBSession.query(sql.func.max(category_closure.c.depth))\
+            .filter(category_closure.c.descendant_id == self.id)\
+            .scalar() or 0
 
 
 mapper(Category, categories, order_by=categories.c.name, extension=events.MapperObserver(events.Category), properties={
@@ -185,3 +257,61 @@ mapper(Category, categories, order_by=categories.c.name, extension=events.Mapper
         collection_class=CategoryList,
         join_depth=2),
 })
+
+def _parent_in_closure(conn, cat_id):
+    return conn.execute(sql.select(
+        [category_closure.c.ancestor_id],
+        sql.and_(category_closure.c.descendant_id == cat_id,
+                 category_closure.c.depth == 1),
+    )).scalar()
+
+def _attach_subtree(conn, cat_id, parent_id):
+    """Pair every category in the given subtree with its new ancestors."""
+    subtree = conn.execute(sql.select(
+        [category_closure.c.descendant_id, category_closure.c.depth],
+        category_closure.c.ancestor_id == cat_id,
+    )).fetchall()
+    if parent_id is None:
+        return
+    ancestors = conn.execute(sql.select(
+        [category_closure.c.ancestor_id, category_closure.c.depth],
+        category_closure.c.descendant_id == parent_id,
+    )).fetchall()
+    rows = [{'ancestor_id': ancestor_id,
+             'descendant_id': descendant_id,
+             'depth': ancestor_depth + descendant_depth + 1}
+            for ancestor_id, ancestor_depth in ancestors
+            for descendant_id, descendant_depth in subtree]
+    if rows:
+        conn.execute(category_closure.insert(), rows)
+
+@events.observes(events.Category.after_insert)
+def _insert_closure(instance):
+    conn = DBSession.connection()
+    conn.execute(category_closure.insert(), ancestor_id=instance.id,
+                 descendant_id=instance.id, depth=0)
+    _attach_subtree(conn, instance.id, instance.parent_id)
+
+@events.observes(events.Category.after_update)
+def _move_closure(instance):
+    conn = DBSession.connection()
+    if _parent_in_closure(conn, instance.id) == instance.parent_id:
+        return
+    # Detach the subtree from its old ancestors, then attach it to the new
+    subtree_ids = [cat_id for cat_id, in conn.execute(sql.select(
+        [category_closure.c.descendant_id],
+        category_closure.c.ancestor_id == instance.id,
+    ))]
+    conn.execute(category_closure.delete(sql.and_(
+        category_closure.c.descendant_id.in_(subtree_ids),
+        sql.not_(category_closure.c.ancestor_id.in_(subtree_ids)),
+    )))
+    _attach_subtree(conn, instance.id, instance.parent_id)
+
+@events.observes(events.Category.after_delete)
+def _delete_closure(instance):
+    # Not every database enforces our ON DELETE CASCADE
+    DBSession.connection().execute(category_closure.delete(sql.or_(
+        category_closure.c.ancestor_id == instance.id,
+        category_closure.c.descendant_id == instance.id,
+    )))
@@ -118,3 +118,47 @@ mapper(Comment, comments, order_by=comments.c.created_on, extension=events.Mappe
         comments.c.author_email,
         comments.c.author_ip),
 })
+
+def rescan_comments(bind, vulgarity_filter, chunk_size=500):
+    """Star out filtered words in the author names and bodies of all comments.
+
+    The comments table is read in chunks, in order of ID, and only the
+    comments whose text changes are updated. Their modified_on dates are
+    left as is.
+
+    :param bind: The engine or connection to execute with.
+    :param vulgarity_filter: A
+        :class:`~mediacore.lib.vulgarity.VulgarityFilter` instance.
+    :param chunk_size: The number of comments to read at once.
+    :rtype: list
+    :returns: The IDs of the media whose comments were changed.
+    """
+    select = sql.select([comments.c.id, comments.c.media_id,
+                         comments.c.author_name, comments.c.body])\
+        .order_by(comments.c.id)\
+        .limit(chunk_size)
+    update = comments.update()\
+        .where(comments.c.id == sql.bindparam('_id'))\
+        .values({comments.c.author_name: sql.bindparam('_author_name'),
+                 comments.c.body: sql.bindparam('_body'),
+                 comments.c.modified_on: comments.c.modified_on})
+    media_ids = set()
+    last_id = 0
+    while True:
+        rows = bind.execute(select.where(comments.c.id > last_id)).fetchall()
+        if not rows:
+            break
+        changed = []
+        for comment_id, media_id, author_name, body in rows:
+            new_author_name = vulgarity_filter.sub(author_name)
+            new_body = vulgarity_filter.sub(body)
+            if new_author_name != author_name or new_body != body:
+                changed.append({'_id': comment_id,
+                                '_author_name': new_author_name,
+                                '_body': new_body})
+                if media_id is not None:
+                    media_ids.add(media_id)
+        if changed:
+            bind.execute(update, changed)
+        last_id = rows[-1][0]
+    return sorted(media_ids)
@@ -33,30 +33,36 @@ import os.path
 
 from datetime import datetime
 
-from sqlalchemy import Table, ForeignKey, Column, sql
-from sqlalchemy.exc import OperationalError
+from sqlalchemy import Table, ForeignKey, Column, Index, sql
 from sqlalchemy.ext.associationproxy import association_proxy
-from sqlalchemy.orm import (attributes, backref, class_mapper, column_property,
-    composite, dynamic_loader, mapper, Query, relation, validates)
+from sqlalchemy.orm import (attributes, backref, composite, dynamic_loader,
+    mapper, Query, relation, validates)
 from sqlalchemy.orm.collections import attribute_mapped_collection
 from sqlalchemy.schema import DDL
-from sqlalchemy.types import Boolean, DateTime, Integer, Unicode, UnicodeText
+from sqlalchemy.types import Boolean, DateTime, Float, Integer, Unicode, UnicodeText
 
 from pylons import app_globals
 
 from mediacore.lib.compat import any
+from mediacore.lib.counters import COUNTER_COLUMNS, media_counters
 from mediacore.lib.filetypes import AUDIO, AUDIO_DESC, CAPTIONS, VIDEO, guess_mimetype
-from mediacore.lib.players import pick_any_media_file, pick_podcast_media_file
-from mediacore.lib.util import calculate_popularity
-from mediacore.lib.xhtml import line_break_xhtml, strip_xhtml
-from mediacore.model import SLUG_LENGTH, _mtm_count_property, _properties_dict_from_labels, MatchAgainstClause
+from mediacore.lib.players import (pick_any_media_file,
+    pick_podcast_media_file, playability)
+from mediacore.lib.scheduler import publication_scheduler
+from mediacore.lib.uri import uri_cache
+from mediacore.lib.util import calculate_popularity, calculate_popularity_scores
+from mediacore.lib.xhtml import excerpt_xhtml, line_break_xhtml, strip_xhtml
+from mediacore.model import SLUG_LENGTH
 from mediacore.model.meta import DBSession, metadata
 from mediacore.model.authors import Author
-from mediacore.model.categories import Category, CategoryList, categories
+from mediacore.model.categories import Category, CategoryList, categories, category_closure
 from mediacore.model.comments import Comment, CommentQuery, comments
+from mediacore.model.settings import settings
 from mediacore.model.tags import Tag, TagList, tags, extract_tags, fetch_and_create_tags
 from mediacore.plugin import events
 
+EXCERPT_LENGTH = 340
+"""The approximate length of :attr:`Media.description_excerpt`."""
 
 media = Table('media', metadata,
     Column('id', Integer, autoincrement=True, primary_key=True, doc=\
@@ -83,11 +89,32 @@ media = Table('media', metadata,
     Column('encoded', Boolean, default=False, nullable=False, doc=\
         """A flag to indicate whether this file is encoded in a web-ready state."""),
 
+    Column('playable_by', UnicodeText, doc=\
+        """A comma separated list of the players that can play this media.
+
+        This is set by :meth:`Media.update_status` so that the players
+        needn't be tried on every page that lists this media. It is NULL
+        until then, in which case every enabled player is tried."""),
+
+    Column('thumb_name', Unicode(40), doc=\
+        """The name of the thumb files in the image_dir: ``new`` for the
+        default thumbs, or the hash of the uploaded image. If NULL, the
+        thumbs are named after the ID. See :mod:`mediacore.lib.thumbnails`."""),
+
     Column('publishable', Boolean, default=False, nullable=False, doc=\
         """A flag to indicate if this media should be published in between its
         publish_on and publish_until dates. If this is false, this is
         considered to be in draft state and will not appear on the site."""),
 
+    Column('live', Boolean, default=False, nullable=False, doc=\
+        """A materialized flag indicating whether this media is published.
+
+        This is true when the media is reviewed, encoded, publishable and
+        the current time is within the publish_on/publish_until range. It
+        is kept up to date whenever the media is saved, and the
+        :class:`mediacore.lib.scheduler.PublicationScheduler` flips it
+        when a publish_on or publish_until date is reached."""),
+
     Column('created_on', DateTime, default=datetime.now, nullable=False, doc=\
         """The date and time this player was first created."""),
 
@@ -115,6 +142,10 @@ media = Table('media', metadata,
     Column('description_plain', UnicodeText, doc=\
         """A public-facing plaintext description. Should be a paragraph or more."""),
 
+    Column('description_excerpt', UnicodeText, doc=\
+        """The XHTML description truncated to roughly :data:`EXCERPT_LENGTH`
+        characters, or None if the description is short enough as it is."""),
+
     Column('notes', UnicodeText, doc=\
         """Notes for administrative use -- never displayed publicly."""),
 
@@ -154,6 +185,13 @@ media = Table('media', metadata,
         bring the newest most liked items to the top. `More info
         <http://amix.dk/blog/post/19588>`_."""),
 
+    Column('comment_count', Integer, default=0, nullable=False, doc=\
+        """The number of comments on this media, including those awaiting
+        review or in the trash."""),
+
+    Column('comment_count_published', Integer, default=0, nullable=False, doc=\
+        """The number of publishable comments on this media."""),
+
     Column('author_name', Unicode(50), nullable=False),
     Column('author_email', Unicode(255), nullable=False),
 
@@ -161,6 +199,10 @@ media = Table('media', metadata,
     mysql_charset='utf8',
 )
 
+# Published listings filter on the live flag and order by one of these
+Index('media_live_publish_on', media.c.live, media.c.publish_on)
+Index('media_live_popularity', media.c.live, media.c.popularity_points)
+
 media_meta = Table('media_meta', metadata,
     Column('id', Integer, autoincrement=True, primary_key=True),
     Column('media_id', Integer, ForeignKey('media.id', onupdate='CASCADE', ondelete='CASCADE'), nullable=False),
@@ -221,6 +263,19 @@ media_categories = Table('media_categories', metadata,
     mysql_charset='utf8',
 )
 
+media_related = Table('media_related', metadata,
+    Column('media_id', Integer, ForeignKey('media.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True),
+    Column('related_id', Integer, ForeignKey('media.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True),
+    Column('score', Float, nullable=False),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
+# The nearest neighbours of each media item are read in order of similarity
+Index('media_related_score', media_related.c.media_id, media_related.c.score)
+
 media_fulltext = Table('media_fulltext', metadata,
     Column('media_id', Integer, ForeignKey('media.id'), primary_key=True),
     Column('title', Unicode(255), nullable=False),
@@ -260,6 +315,207 @@ def _setup_mysql_fulltext_indexes():
         DDL(sql, on='mysql').execute_at('after-create', media_fulltext)
 _setup_mysql_fulltext_indexes()
 
+def _live_clause(now=None):
+    """Return the full publication criteria that the live flag mirrors.
+
+    This is expensive to evaluate on large tables and is only intended
+    for maintaining and verifying :attr:`Media.live`. Use
+    :meth:`MediaQuery.published` for normal queries.
+
+    :param now: The time to check against, defaults to now.
+    :type now: :class:`datetime.datetime` or ``None``
+    """
+    if now is None:
+        now = datetime.now()
+    return sql.and_(
+        media.c.reviewed == True,
+        media.c.encoded == True,
+        media.c.publishable == True,
+        media.c.publish_on <= now,
+        sql.or_(media.c.publish_until == None,
+                media.c.publish_until >= now),
+    )
+
+def update_live_flags(bind, now=None, flipped=None):
+    """Set :attr:`Media.live` for all media whose publication state changed.
+
+    Only rows that need to be flipped are touched, and their modified_on
+    dates are left as is. The published media counts of their tags and
+    categories are adjusted to match, only for the rows that were actually
+    flipped, so that other processes can safely run this at the same time.
+
+    :param bind: The engine or connection to execute with.
+    :param now: The time to check against, defaults to now.
+    :type now: :class:`datetime.datetime` or ``None``
+    :param flipped: An optional list to append the IDs of the updated
+        media to.
+    :rtype: int
+    :returns: The number of rows that were updated.
+    """
+    if now is None:
+        now = datetime.now()
+    live = _live_clause(now)
+    updated = 0
+    for value, where in ((True, sql.and_(media.c.live == False, live)),
+                         (False, sql.and_(media.c.live == True,
+                                          sql.not_(live)))):
+        # Where the database supports it, lock the rows until the commit, so
+        # that other processes wait and then find nothing left to flip.
+        ids = [media_id for media_id, in bind.execute(
+            sql.select([media.c.id], where, for_update=True))]
+        # Only count the rows flipped here, in case another process has
+        # flipped some of them since they were selected.
+        update = media.update()\
+            .where(sql.and_(media.c.id == sql.bindparam('_id'),
+                            media.c.live != value))\
+            .values(live=value, modified_on=media.c.modified_on)
+        changed = [media_id for media_id in ids
+                   if bind.execute(update, {'_id': media_id}).rowcount]
+        for i in xrange(0, len(changed), 500):
+            _adjust_published_counts(bind, changed[i:i + 500],
+                                     value and 1 or -1)
+        updated += len(changed)
+        if flipped is not None:
+            flipped.extend(changed)
+    return updated
+
+def next_live_boundary(bind, now=None):
+    """Return the next time that any media's :attr:`Media.live` flag changes.
+
+    :param bind: The engine or connection to execute with.
+    :param now: The time to check against, defaults to now.
+    :type now: :class:`datetime.datetime` or ``None``
+    :rtype: :class:`datetime.datetime` or ``None``
+    """
+    if now is None:
+        now = datetime.now()
+    ready = sql.and_(
+        media.c.reviewed == True,
+        media.c.encoded == True,
+        media.c.publishable == True,
+    )
+    next_publish = sql.select([sql.func.min(media.c.publish_on)],
+        sql.and_(ready, media.c.live == False, media.c.publish_on > now))
+    next_unpublish = sql.select([sql.func.min(media.c.publish_until)],
+        sql.and_(media.c.live == True, media.c.publish_until >= now))
+    boundaries = [bind.execute(next_publish).scalar(),
+                  bind.execute(next_unpublish).scalar()]
+    boundaries = [b for b in boundaries if b is not None]
+    return boundaries and min(boundaries) or None
+
+def update_counters(bind, deltas):
+    """Add the given deltas to the view, like and dislike counts in bulk.
+
+    All counts are incremented with a single UPDATE statement. The
+    popularity scores of any media whose likes or dislikes have changed
+    are then recalculated. modified_on dates are left as is.
+
+    :param bind: The engine or connection to execute with.
+    :param deltas: A dict of media IDs to lists of deltas, ordered as
+        in :data:`mediacore.lib.counters.COUNTER_COLUMNS`.
+    :type deltas: dict
+    """
+    if not deltas:
+        return
+    values = {media.c.modified_on: media.c.modified_on}
+    for i, name in enumerate(COUNTER_COLUMNS):
+        whens = [(media_id, delta[i])
+                 for media_id, delta in deltas.iteritems() if delta[i]]
+        if whens:
+            column = media.c[name]
+            values[column] = column + sql.case(whens, value=media.c.id,
+                                               else_=0)
+    bind.execute(media.update()\
+        .where(media.c.id.in_(deltas.keys()))\
+        .values(values))
+
+    rated_ids = [media_id for media_id, delta in deltas.iteritems()
+                 if delta[1] or delta[2]]
+    if rated_ids:
+        recalculate_popularity(bind, rated_ids)
+
+def recalculate_popularity(bind, ids=None, chunk_size=10000):
+    """Recalculate the popularity scores of all media, or the given media.
+
+    Rows are streamed in chunks ordered by ID and the scores for each
+    chunk are computed at once with
+    :func:`mediacore.lib.util.calculate_popularity_scores`. Only the rows
+    whose scores have changed are written back, with one executemany
+    UPDATE per chunk. The decay settings are read once.
+
+    :param bind: The engine or connection to execute with. When given
+        an engine, each chunk is committed as it is written.
+    :param ids: Optionally limit the recalculation to these media IDs.
+    :param chunk_size: The number of rows to process at a time.
+    :rtype: tuple
+    :returns: The number of media scanned and the number updated.
+    """
+    decay = dict(bind.execute(sql.select(
+        [settings.c.key, settings.c.value],
+        settings.c.key.in_(['popularity_decay_exponent',
+                            'popularity_decay_lifetime']),
+    )).fetchall())
+    exponent = decay['popularity_decay_exponent']
+    lifetime = decay['popularity_decay_lifetime']
+
+    columns = [
+        media.c.id, media.c.live, media.c.publish_on,
+        media.c.likes, media.c.dislikes, media.c.popularity_points,
+        media.c.popularity_likes, media.c.popularity_dislikes,
+    ]
+    update = media.update()\
+        .where(media.c.id == sql.bindparam('_id'))\
+        .values({
+            media.c.popularity_points: sql.bindparam('_points'),
+            media.c.popularity_likes: sql.bindparam('_likes'),
+            media.c.popularity_dislikes: sql.bindparam('_dislikes'),
+            media.c.modified_on: media.c.modified_on,
+        })
+
+    scanned = updated = 0
+    last_id = None
+    while True:
+        where = []
+        if ids is not None:
+            where.append(media.c.id.in_(ids))
+        if last_id is not None:
+            where.append(media.c.id > last_id)
+        query = sql.select(columns).order_by(media.c.id).limit(chunk_size)
+        if where:
+            query = query.where(sql.and_(*where))
+        rows = bind.execute(query).fetchall()
+        if not rows:
+            break
+        scanned += len(rows)
+        last_id = rows[-1][0]
+
+        scores = dict((row[0], (0, 0, 0)) for row in rows)
+        live = [row for row in rows if row[1] and row[2] is not None]
+        if live:
+            live_ids, _, publish_dates, likes, dislikes = zip(*live)[:5]
+            points = calculate_popularity_scores(
+                publish_dates,
+                [[l - d for l, d in zip(likes, dislikes)], likes, dislikes],
+                exponent, lifetime)
+            scores.update(zip(live_ids, zip(*points)))
+
+        changes = []
+        for row in rows:
+            new = tuple(scores[row[0]])
+            if new != tuple(row[5:8]):
+                changes.append({
+                    '_id': row[0],
+                    '_points': new[0],
+                    '_likes': new[1],
+                    '_dislikes': new[2],
+                })
+        if changes:
+            bind.execute(update, changes)
+            updated += len(changes)
+        if len(rows) < chunk_size:
+            break
+    return scanned, updated
+
 class MediaQuery(Query):
     def reviewed(self, flag=True):
         return self.filter(Media.reviewed == flag)
@@ -279,18 +535,7 @@ class MediaQuery(Query):
             return self.filter(sql.not_(drafts))
 
     def published(self, flag=True):
-        published = sql.and_(
-            Media.reviewed == True,
-            Media.encoded == True,
-            Media.publishable == True,
-            Media.publish_on <= datetime.now(),
-            sql.or_(Media.publish_until == None,
-                    Media.publish_until >= datetime.now()),
-        )
-        if flag:
-            return self.filter(published)
-        else:
-            return self.filter(sql.not_(published))
+        return self.filter(Media.live == flag)
 
     def order_by_status(self):
         return self.order_by(Media.reviewed.asc(),
@@ -301,57 +546,30 @@ class MediaQuery(Query):
         return self.order_by(Media.popularity_points.desc())
 
     def search(self, search, bool=False, order_by=True):
-        search_cols = _fulltext_indexes['public']
-        return self._search(search_cols, search, bool, order_by)
+        return self._search('public', search, bool, order_by)
 
     def admin_search(self, search, bool=False, order_by=True):
-        search_cols = _fulltext_indexes['admin']
-        return self._search(search_cols, search, bool, order_by)
-
-    def _search(self, search_cols, search, bool=False, order_by=True):
-        # XXX: If full text searching is not enabled, we use a very
-        #      rudimentary fallback.
-        if not self._fulltext_enabled():
-            return self.filter(Media.title.like("%%%s%%" % search))
-
-        filter = MatchAgainstClause(search_cols, search, bool)
-        query = self.join(MediaFullText).filter(filter)
-        if order_by:
-            # MySQL automatically orders natural lang searches by relevance,
-            # so override any existing ordering
-            query = query.order_by(None)
-            if bool:
-                # To mimic the same behaviour in boolean mode, we must do an
-                # extra natural language search on our boolean-filtered results
-                relevance = MatchAgainstClause(search_cols, search, bool=False)
-                query = query.order_by(relevance)
-        return query
-
-    def _fulltext_enabled(self):
-        connection = self.session.connection()
-        if connection.dialect.name == 'mysql':
-            # use a fun trick to see if the media_fulltext table is being used
-            # thanks to this guy: http://data.agaric.com/node/2241#comment-544
-            select = sql.select('1').select_from(media_fulltext).limit(1)
-            result = connection.execute(select)
-            if result.scalar() is not None:
-                return True
-        return False
+        return self._search('admin', search, bool, order_by)
+
+    def _search(self, index, search, bool=False, order_by=True):
+        from mediacore.lib.search import get_search_backend
+        backend = get_search_backend(self.session.connection())
+        return backend.search(self, index, search, bool, order_by)
 
     def in_category(self, cat):
         """Filter results to Media in the given category"""
         return self.in_categories([cat])
 
     def in_categories(self, cats):
-        """Filter results to Media in at least one of the given categories"""
-        all_cats = cats[:]
-        for cat in cats:
-            all_cats.extend(cat.descendants())
-        all_ids = [c.id for c in all_cats]
+        """Filter results to Media in at least one of the given categories
+
+        Media in any descendant of the given categories are included too.
+        """
         return self.filter(sql.exists(sql.select(
             [media_categories.c.media_id],
             sql.and_(media_categories.c.media_id == Media.id,
-                     media_categories.c.category_id.in_(all_ids))
+                     media_categories.c.category_id == category_closure.c.descendant_id,
+                     category_closure.c.ancestor_id.in_([c.id for c in cats]))
         )))
 
     def exclude(self, *args):
@@ -377,19 +595,26 @@ class MediaQuery(Query):
             return self
 
     def related(self, media):
-        query = self.published().filter(Media.id != media.id)
-
-        # XXX: If full text searching is not enabled, we simply return media
-        #      in the same categories.
-        if not self._fulltext_enabled():
-            return query.in_categories(media.categories)
+        """Filter results to the published nearest neighbours of the given media.
 
-        search_terms = '%s %s %s' % (
-            media.title,
-            media.fulltext and media.fulltext.tags or '',
-            media.fulltext and media.fulltext.categories or '',
-        )
-        return query.search(search_terms, bool=True)
+        The neighbours are precomputed by
+        :class:`mediacore.lib.related.RelatedMediaIndex`, and the results
+        are ordered by similarity, most similar first. Media whose
+        neighbours haven't been computed yet fall back to the published
+        media in the same categories.
+        """
+        has_neighbours = self.session.execute(sql.select(
+            [media_related.c.media_id],
+            media_related.c.media_id == media.id).limit(1)).scalar()
+        if has_neighbours is None:
+            return self.published()\
+                .filter(Media.id != media.id)\
+                .in_categories(media.categories)
+        return self.published()\
+            .join((media_related, media_related.c.related_id == Media.id))\
+            .filter(media_related.c.media_id == media.id)\
+            .order_by(None)\
+            .order_by(media_related.c.score.desc())
 
 class Meta(object):
     """
@@ -463,6 +688,9 @@ class Media(object):
 
         """
         self.type = self._update_type()
+        self.playable_by = u','.join(sorted(
+            name for name, plays in playability(self.get_uris()).iteritems()
+            if plays))
         self.encoded = self._update_encoding()
 
     def _update_type(self):
@@ -494,55 +722,76 @@ class Media(object):
     def is_published(self):
         if self.id is None:
             return False
-        return self.publishable and self.reviewed and self.encoded\
-           and (self.publish_on is not None and self.publish_on <= datetime.now())\
-           and (self.publish_until is None or self.publish_until >= datetime.now())
+        return self._is_live()
+
+    def _is_live(self, now=None):
+        """Evaluate the criteria that :attr:`live` is materialized from."""
+        if now is None:
+            now = datetime.now()
+        return bool(self.publishable and self.reviewed and self.encoded\
+           and (self.publish_on is not None and self.publish_on <= now)\
+           and (self.publish_until is None or self.publish_until >= now))
+
+    def _next_live_boundary(self, now=None):
+        """Return the future time when :attr:`live` should flip, if any."""
+        if now is None:
+            now = datetime.now()
+        if not (self.publishable and self.reviewed and self.encoded):
+            return None
+        if self.publish_on is not None and self.publish_on > now:
+            return self.publish_on
+        if self.publish_until is not None and self.publish_until >= now:
+            return self.publish_until
+        return None
 
     def increment_views(self):
         """Increment the number of views in the database.
 
-        We avoid concurrency issues by incrementing JUST the views and
-        not allowing modified_on to be updated automatically.
+        Views are buffered and written in bulk by
+        :data:`mediacore.lib.counters.media_counters`, so we avoid locking
+        the media row (and the media_fulltext table, by way of our
+        triggers) for every page view.
+
+        :returns: The committed number of views plus any that are still
+            pending in this process.
 
         """
-        if self.id is None:
-            self.views += 1
-            return self.views
-
-        # Don't raise an exception should concurrency problems occur.
-        # Views will not actually be incremented in this case, but thats
-        # relatively unimportant compared to rendering the page for the user.
-        # We may be able to remove this after we improve our triggers to not
-        # issue an UPDATE on media_fulltext unless one of its columns are
-        # actually changed. Even when just media.views is updated, all the
-        # columns in the corresponding media_fulltext row are updated, and
-        # media_fulltext's MyISAM engine must lock the whole table to do so.
-        transaction = DBSession.begin_nested()
-        try:
-            DBSession.query(self.__class__)\
-                .filter(self.__class__.id == self.id)\
-                .update({self.__class__.views: self.__class__.views + 1})
-            transaction.commit()
-        except OperationalError, e:
-            transaction.rollback()
-            # (OperationalError) (1205, 'Lock wait timeout exceeded, try restarting the transaction')
-            if not '1205' in e.message:
-                raise
-
-        # Increment the views by one for the rest of the request,
-        # but don't allow the ORM to increment the views too.
-        attributes.set_committed_value(self, 'views', self.views + 1)
-        return self.views
+        return self._increment_counter('views')
 
     def increment_likes(self):
-        self.likes += 1
-        self.update_popularity()
-        return self.likes
+        return self._increment_counter('likes')
 
     def increment_dislikes(self):
-        self.dislikes += 1
-        self.update_popularity()
-        return self.dislikes
+        return self._increment_counter('dislikes')
+
+    def _increment_counter(self, name):
+        if self.id is None:
+            setattr(self, name, getattr(self, name) + 1)
+            if name != 'views':
+                self.update_popularity()
+            return getattr(self, name)
+
+        if media_counters.increment(self.id, name):
+            return self.current_count(name)
+
+        # The buffer isn't running so the database was updated directly.
+        # Increment the count for the rest of the request, but don't allow
+        # the ORM to write the counter too.
+        attributes.set_committed_value(self, name, getattr(self, name) + 1)
+        return getattr(self, name)
+
+    def current_count(self, name):
+        """Return the given counter including increments not yet written.
+
+        :param name: 'views', 'likes' or 'dislikes'
+        :rtype: int
+        :returns: The committed value plus any increments that are still
+            pending in this process.
+        """
+        value = getattr(self, name)
+        if self.id is not None:
+            value += media_counters.pending(self.id, name)
+        return value
 
     def update_popularity(self):
         if self.is_published:
@@ -565,9 +814,13 @@ class Media(object):
 
     @validates('description')
     def _validate_description(self, key, value):
-        self.description_plain = line_break_xhtml(
-            line_break_xhtml(value)
-        )
+        # Derived once here so that listings and feeds needn't parse the
+        # description every time it's displayed.
+        self.description_plain = line_break_xhtml(value, 2)
+        excerpt = excerpt_xhtml(value, EXCERPT_LENGTH)
+        if not value or excerpt == value:
+            excerpt = None
+        self.description_excerpt = excerpt
         return value
 
     @validates('description_plain')
@@ -613,7 +866,7 @@ class MediaFile(object):
         :returns: :class:`mediacore.lib.storage.StorageURI` instances.
 
         """
-        return self.storage.get_uris(self)
+        return uri_cache.get_uris(self)
 
 class MediaFullText(object):
     query = DBSession.query_property()
@@ -689,53 +942,193 @@ _media_mapper = mapper(
             doc="""A query pre-filtered for associated comments.
                    Returns :class:`mediacore.model.comments.CommentQuery`."""
         ),
-        'comment_count': column_property(
-            sql.select(
-                [sql.func.count(comments.c.id)],
-                media.c.id == comments.c.media_id,
-            ).label('comment_count'),
-            deferred=True,
-        ),
-        'comment_count_published': column_property(
-            sql.select(
-                [sql.func.count(comments.c.id)],
-                sql.and_(
-                    comments.c.media_id == media.c.id,
-                    comments.c.publishable == True,
-                )
-            ).label('comment_count_published'),
-            deferred=True,
-        ),
 })
 
-# Add properties for counting how many media items have a given Tag
-_tags_mapper = class_mapper(Tag, compile=False)
-_tags_mapper.add_properties(_properties_dict_from_labels(
-    _mtm_count_property('media_count', media_tags),
-    _mtm_count_property('media_count_published', media_tags, [
-        media.c.reviewed == True,
-        media.c.encoded == True,
-        media.c.publishable == True,
-        media.c.publish_on <= datetime.now(),
-        sql.or_(
-            media.c.publish_until == None,
-            media.c.publish_until >= datetime.now(),
-        ),
-    ]),
-))
-
-# Add properties for counting how many media items have a given Category
-_categories_mapper = class_mapper(Category, compile=False)
-_categories_mapper.add_properties(_properties_dict_from_labels(
-    _mtm_count_property('media_count', media_categories),
-    _mtm_count_property('media_count_published', media_categories, [
-        media.c.reviewed == True,
-        media.c.encoded == True,
-        media.c.publishable == True,
-        media.c.publish_on <= datetime.now(),
-        sql.or_(
-            media.c.publish_until == None,
-            media.c.publish_until >= datetime.now(),
-        ),
-    ]),
-))
+@events.observes(events.Media.before_insert, events.Media.before_update)
+def _update_live_flag(instance):
+    """Keep :attr:`Media.live` in sync and schedule its next flip."""
+    now = datetime.now()
+    instance.live = instance._is_live(now)
+    boundary = instance._next_live_boundary(now)
+    if boundary is not None:
+        publication_scheduler.schedule(boundary)
+
+###############################################################################
+# Denormalized Counts
+#
+# Tags and categories store how many media (and live media) they have, and
+# media store how many comments (and publishable comments) they have. The
+# counts are adjusted in place as associations, the live flag and comments
+# change, so listings don't need a COUNT(*) subquery per row. If they ever
+# drift, reconcile_counts() recounts everything from scratch.
+
+MEDIA_COUNT_COLUMNS = ('media_count', 'media_count_published')
+COMMENT_COUNT_COLUMNS = ('comment_count', 'comment_count_published')
+
+_media_count_tables = (
+    ('tags', tags, media_tags, media_tags.c.tag_id),
+    ('categories', categories, media_categories, media_categories.c.category_id),
+)
+
+def _adjust_counts(bind, table, columns, deltas):
+    """Add deltas to the counter columns of the given rows.
+
+    Rows that share the same deltas are updated with a single statement.
+
+    :param bind: The engine or connection to execute with.
+    :param table: The table to update.
+    :param columns: The names of the counter columns.
+    :param deltas: A dict of row IDs to tuples of deltas, ordered as in
+        ``columns``.
+    """
+    grouped = {}
+    for id, delta in deltas.iteritems():
+        if any(delta):
+            grouped.setdefault(tuple(delta), []).append(id)
+    for delta, ids in grouped.iteritems():
+        values = {}
+        for name, d in zip(columns, delta):
+            if d:
+                values[table.c[name]] = table.c[name] + d
+        if 'modified_on' in table.c:
+            values[table.c.modified_on] = table.c.modified_on
+        bind.execute(table.update().where(table.c.id.in_(ids)).values(values))
+
+def _adjust_published_counts(bind, media_ids, delta):
+    """Adjust the published media counts for media that went live or dark.
+
+    :param bind: The engine or connection to execute with.
+    :param media_ids: The IDs of media whose live flag was flipped.
+    :param delta: 1 if they went live, -1 if they went dark.
+    """
+    for key, table, assoc, fk in _media_count_tables:
+        matches = sql.select([sql.func.count(assoc.c.media_id)],
+            sql.and_(fk == table.c.id, assoc.c.media_id.in_(media_ids)))\
+            .as_scalar()
+        bind.execute(table.update()\
+            .where(table.c.id.in_(sql.select([fk],
+                                             assoc.c.media_id.in_(media_ids))))\
+            .values({table.c.media_count_published:
+                     table.c.media_count_published + delta * matches}))
+
+def _committed_value(instance, key):
+    """Return the value of the given attribute as it was before the flush."""
+    added, unchanged, deleted = attributes.get_history(instance, key)
+    if deleted:
+        return deleted[0]
+    return getattr(instance, key)
+
+def _update_media_counts(instance, old_live, new_live, deleting=False):
+    """Adjust the counts of the tags and categories of a media item.
+
+    Collections that were never loaded can't have been modified, so the
+    current associations are read from the database instead.
+    """
+    conn = DBSession.connection()
+    old_live, new_live = int(bool(old_live)), int(bool(new_live))
+    if deleting:
+        kept_delta = (-1, -old_live)
+    else:
+        kept_delta = (0, new_live - old_live)
+    for key, table, assoc, fk in _media_count_tables:
+        deltas = {}
+        if key in instance.__dict__:
+            added, kept, removed = attributes.get_history(
+                instance, key, passive=attributes.PASSIVE_NO_INITIALIZE)
+            if deleting:
+                kept, added, removed = list(kept) + list(removed), (), ()
+            changes = [(obj, (1, new_live)) for obj in added]
+            changes.extend((obj, (-1, -old_live)) for obj in removed)
+            changes.extend((obj, kept_delta) for obj in kept)
+            for obj, delta in changes:
+                if obj.id is None:
+                    # Not yet inserted, so its counts are written with it
+                    for name, d in zip(MEDIA_COUNT_COLUMNS, delta):
+                        setattr(obj, name, (getattr(obj, name) or 0) + d)
+                else:
+                    prev = deltas.get(obj.id, (0, 0))
+                    deltas[obj.id] = (prev[0] + delta[0], prev[1] + delta[1])
+        elif instance.id is not None and any(kept_delta):
+            for id, in conn.execute(sql.select([fk],
+                                               assoc.c.media_id == instance.id)):
+                deltas[id] = kept_delta
+        _adjust_counts(conn, table, MEDIA_COUNT_COLUMNS, deltas)
+
+@events.observes(events.Media.after_insert)
+def _count_inserted_media(instance):
+    _update_media_counts(instance, False, instance.live)
+
+@events.observes(events.Media.after_update)
+def _count_updated_media(instance):
+    _update_media_counts(instance, _committed_value(instance, 'live'),
+                         instance.live)
+
+@events.observes(events.Media.before_delete)
+def _count_deleted_media(instance):
+    # Before the database cascades the delete to the association tables
+    _update_media_counts(instance, _committed_value(instance, 'live'), False,
+                         deleting=True)
+
+def _update_comment_counts(media_id, delta, published_delta):
+    if media_id is not None:
+        _adjust_counts(DBSession.connection(), media, COMMENT_COUNT_COLUMNS,
+                       {media_id: (delta, published_delta)})
+
+@events.observes(events.Comment.after_insert)
+def _count_inserted_comment(instance):
+    _update_comment_counts(instance.media_id, 1, int(bool(instance.publishable)))
+
+@events.observes(events.Comment.after_update)
+def _count_updated_comment(instance):
+    old_media_id = _committed_value(instance, 'media_id')
+    old_published = int(bool(_committed_value(instance, 'publishable')))
+    new_published = int(bool(instance.publishable))
+    if old_media_id == instance.media_id:
+        _update_comment_counts(instance.media_id, 0,
+                               new_published - old_published)
+    else:
+        _update_comment_counts(old_media_id, -1, -old_published)
+        _update_comment_counts(instance.media_id, 1, new_published)
+
+@events.observes(events.Comment.after_delete)
+def _count_deleted_comment(instance):
+    _update_comment_counts(_committed_value(instance, 'media_id'), -1,
+        -int(bool(_committed_value(instance, 'publishable'))))
+
+def reconcile_counts(bind):
+    """Recount all the denormalized media and comment counts.
+
+    Only rows whose counts have drifted are written.
+
+    :param bind: The engine or connection to execute with.
+    :rtype: dict
+    :returns: The number of corrected rows, by table name.
+    """
+    corrected = {}
+    for key, table, assoc, fk in _media_count_tables:
+        total = sql.select([sql.func.count(assoc.c.media_id)],
+                           fk == table.c.id).as_scalar()
+        published = sql.select([sql.func.count(assoc.c.media_id)],
+            sql.and_(fk == table.c.id,
+                     assoc.c.media_id == media.c.id,
+                     media.c.live == True)).as_scalar()
+        result = bind.execute(table.update()\
+            .where(sql.or_(table.c.media_count != total,
+                           table.c.media_count_published != published))\
+            .values({table.c.media_count: total,
+                     table.c.media_count_published: published}))
+        corrected[table.name] = result.rowcount
+
+    total = sql.select([sql.func.count(comments.c.id)],
+                       comments.c.media_id == media.c.id).as_scalar()
+    published = sql.select([sql.func.count(comments.c.id)],
+        sql.and_(comments.c.media_id == media.c.id,
+                 comments.c.publishable == True)).as_scalar()
+    result = bind.execute(media.update()\
+        .where(sql.or_(media.c.comment_count != total,
+                       media.c.comment_count_published != published))\
+        .values({media.c.comment_count: total,
+                 media.c.comment_count_published: published,
+                 media.c.modified_on: media.c.modified_on}))
+    corrected[media.name] = result.rowcount
+    return corrected
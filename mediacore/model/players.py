@@ -31,8 +31,10 @@ from sqlalchemy.types import Boolean, DateTime, Integer, Unicode
 
 from mediacore.lib.decorators import memoize
 from mediacore.lib.players import AbstractPlayer
+from mediacore.lib.versioned_cache import VersionedCache
 from mediacore.model import JsonType
 from mediacore.model.meta import DBSession, metadata
+from mediacore.plugin import events
 
 log = logging.getLogger(__name__)
 
@@ -114,6 +116,7 @@ class PlayerPrefs(object):
 
 mapper(
     PlayerPrefs, players,
+    extension=events.MapperObserver(events.PlayerPrefs),
     order_by=(
         players.c.enabled.desc(),
         players.c.priority,
@@ -124,14 +127,22 @@ mapper(
 def fetch_enabled_players():
     """Return player classes and their data dicts in ascending priority.
 
-    Warnings are logged any time a row is found that does not match up to
-    one of the classes that are currently registered. A warning will also
-    be raised if there are no players configured/enabled.
+    The players are kept in memory by :data:`enabled_players` until any
+    :class:`PlayerPrefs` are saved, in this or another process.
 
     :rtype: list of tuples
     :returns: :class:`~mediacore.lib.players.AbstractPlayer` subclasses
         and the configured data associated with them.
 
+    """
+    return enabled_players.get()
+
+def _load_enabled_players():
+    """Return player classes and their data dicts from the database.
+
+    Warnings are logged any time a row is found that does not match up to
+    one of the classes that are currently registered. A warning will also
+    be raised if there are no players configured/enabled.
     """
     player_classes = dict((p.name, p) for p in AbstractPlayer)
     query = sql.select((players.c.name, players.c.data))\
@@ -148,6 +159,15 @@ def fetch_enabled_players():
     log.warn('No registered players are configured in your database.')
     return []
 
+enabled_players = VersionedCache(_load_enabled_players)
+"""The enabled players, as returned by :func:`fetch_enabled_players`."""
+
+@events.observes(events.PlayerPrefs.after_insert,
+                 events.PlayerPrefs.after_update,
+                 events.PlayerPrefs.after_delete)
+def _clear_enabled_players(instance):
+    enabled_players.clear()
+
 def cleanup_players_table(enabled=False):
     """
     Ensure that all available players are added to the database
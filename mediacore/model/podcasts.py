@@ -29,6 +29,7 @@ from sqlalchemy.types import Unicode, UnicodeText, Integer, DateTime, Boolean, F
 from sqlalchemy.orm import mapper, relation, backref, synonym, composite, validates, dynamic_loader, column_property
 from pylons import request
 
+from mediacore.lib.xhtml import line_break_xhtml, strip_xhtml
 from mediacore.model import Author, SLUG_LENGTH, slugify, get_available_slug
 from mediacore.model.meta import DBSession, metadata
 from mediacore.model.media import Media, MediaQuery, media
@@ -58,6 +59,9 @@ podcasts = Table('podcasts', metadata,
 
     Column('description', UnicodeText),
 
+    Column('description_plain', UnicodeText, doc=\
+        """A plaintext copy of the description, for feeds and listings."""),
+
     Column('category', Unicode(50), doc=\
         """The `iTunes category <http://www.apple.com/itunes/podcasts/specs.html#categories>`_
 
@@ -89,6 +93,11 @@ podcasts = Table('podcasts', metadata,
         this address -- unless, of course, the request is coming from
         Feedburner."""),
 
+    Column('thumb_name', Unicode(40), doc=\
+        """The name of the thumb files in the image_dir: ``new`` for the
+        default thumbs, or the hash of the uploaded image. If NULL, the
+        thumbs are named after the ID. See :mod:`mediacore.lib.thumbnails`."""),
+
     mysql_engine='InnoDB',
     mysql_charset='utf8',
 )
@@ -112,6 +121,15 @@ class Podcast(object):
     def validate_slug(self, key, slug):
         return slugify(slug)
 
+    @validates('description')
+    def _validate_description(self, key, value):
+        self.description_plain = line_break_xhtml(value, 2)
+        return value
+
+    @validates('description_plain')
+    def _validate_description_plain(self, key, value):
+        return strip_xhtml(value, True)
+
 
 mapper(Podcast, podcasts, order_by=podcasts.c.title, extension=events.MapperObserver(events.Podcast), properties={
     'author': composite(Author,
@@ -141,14 +159,7 @@ mapper(Podcast, podcasts, order_by=podcasts.c.title, extension=events.MapperObse
                 [sql.func.count(media.c.id)],
                 sql.and_(
                     media.c.podcast_id == podcasts.c.id,
-                    media.c.reviewed == True,
-                    media.c.encoded == True,
-                    media.c.publishable == True,
-                    media.c.publish_on <= datetime.now(),
-                    sql.or_(
-                        media.c.publish_until == None,
-                        media.c.publish_until >= datetime.now()
-                    ),
+                    media.c.live == True,
                 )
             ).label('media_count_published'),
             deferred=True,
@@ -28,7 +28,7 @@ from sqlalchemy import Table, ForeignKey, Column, sql, func
 from sqlalchemy.types import Unicode, UnicodeText, Integer, DateTime, Boolean, Float
 from sqlalchemy.orm import mapper, relation, backref, synonym, interfaces, validates, column_property
 
-from mediacore.model import SLUG_LENGTH, slugify, _mtm_count_property
+from mediacore.model import SLUG_LENGTH, slugify
 from mediacore.model.meta import DBSession, metadata
 from mediacore.plugin import events
 
@@ -37,6 +37,8 @@ tags = Table('tags', metadata,
     Column('id', Integer, autoincrement=True, primary_key=True),
     Column('name', Unicode(50), unique=True, nullable=False),
     Column('slug', Unicode(SLUG_LENGTH), unique=True, nullable=False),
+    Column('media_count', Integer, default=0, nullable=False),
+    Column('media_count_published', Integer, default=0, nullable=False),
     mysql_engine='InnoDB',
     mysql_charset='utf8'
 )
@@ -55,10 +57,18 @@ class Tag(object):
 
         A unique URL-friendly permalink string for looking up this object.
 
-    .. attribute:: media_content
+    .. attribute:: media_count
+
+        The number of media with this tag.
 
     .. attribute:: media_count_published
 
+        The number of live media with this tag.
+
+    Both counts are kept up to date by the
+    :class:`mediacore.plugin.events.Media` observers in
+    :mod:`mediacore.model.media`.
+
     """
     query = DBSession.query_property()
 
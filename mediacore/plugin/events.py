@@ -265,6 +265,14 @@ class MultiSetting(object):
     before_update = Event(['instance'])
     after_update = Event(['instance'])
 
+class PlayerPrefs(object):
+    before_delete = Event(['instance'])
+    after_delete = Event(['instance'])
+    before_insert = Event(['instance'])
+    after_insert = Event(['instance'])
+    before_update = Event(['instance'])
+    after_update = Event(['instance'])
+
 class User(object):
     before_delete = Event(['instance'])
     after_delete = Event(['instance'])
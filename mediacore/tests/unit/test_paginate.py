@@ -0,0 +1,117 @@
+from datetime import datetime
+
+import pylons
+from mediacore.tests import *
+from mediacore.lib.paginate import (KeysetPage, decode_cursor, encode_cursor,
+    keyset_filter)
+from mediacore.model import DBSession, Media
+
+class TestCursors(TestCase):
+
+    def test_round_trip(self):
+        values_list = [
+            [],
+            [0, -1, 2 ** 40],
+            [datetime(2010, 3, 4, 5, 6, 7), 12],
+            [datetime(1999, 12, 31, 23, 59, 59, 999999), 1],
+            [1.5, u'title', u'caf\xe9 \u2603', True, None],
+        ]
+        for values in values_list:
+            cursor = encode_cursor(values)
+            assert isinstance(cursor, str)
+            assert '=' not in cursor and '+' not in cursor \
+                and '/' not in cursor, "Cursors should be safe in URLs"
+            assert decode_cursor(cursor) == values
+            assert decode_cursor(unicode(cursor)) == values, \
+                "Cursors read from the query string are unicode"
+
+    def test_first_page(self):
+        assert decode_cursor(None) is None
+        assert decode_cursor('') is None
+
+    def test_malformed(self):
+        for cursor in ['!!!', 'a', encode_cursor([1])[:-2],
+                       'eyJhIjoxfQ', # {"a":1}
+                       'W3siZHQiOjF9XQ', # [{"dt":1}]
+                       'W3sieCI6MX1d', # [{"x":1}]
+                       u'\u2603']:
+            self.assertRaises(ValueError, decode_cursor, cursor)
+
+class TestKeysetPage(TestController):
+
+    def __init__(self, *args, **kwargs):
+        TestController.__init__(self, *args, **kwargs)
+
+        # Initialize pylons.app_globals, for use in main thread.
+        self.response = self.app.get('/_test_vars')
+        pylons.app_globals._push_object(self.response.app_globals)
+
+    def setUp(self):
+        # Ties on both publish_on and popularity_points, so that the pages
+        # depend on the id to break them.
+        dates = [datetime(2010, 1, 1), datetime(2010, 1, 2)]
+        self.media = []
+        for i in range(7):
+            media = self._new_publishable_media(u'keyset-%d' % i,
+                                                u'Keyset %d' % i)
+            media.publish_on = dates[i % 2]
+            media.popularity_points = i // 3
+            DBSession.add(media)
+            self.media.append(media)
+        DBSession.commit()
+        self.query = Media.query.filter(Media.slug.like(u'keyset-%'))
+
+    def tearDown(self):
+        for media in self.media:
+            DBSession.delete(media)
+        DBSession.commit()
+
+    def _sorted(self, sort_keys):
+        items = list(self.media)
+        for attr, direction in reversed(sort_keys):
+            items.sort(key=lambda m: getattr(m, attr.key),
+                       reverse=direction == 'desc')
+        return [m.id for m in items]
+
+    def _pages(self, sort_keys, items_per_page):
+        pages = []
+        cursor = None
+        while True:
+            page = KeysetPage(self.query, sort_keys, cursor, items_per_page)
+            pages.append([m.id for m in page])
+            cursor = page.next_cursor
+            if cursor is None:
+                return pages
+            assert len(page) == items_per_page
+
+    def test_pages(self):
+        sort_keys_list = [
+            [(Media.publish_on, 'desc'), (Media.id, 'desc')],
+            [(Media.popularity_points, 'desc'), (Media.id, 'desc')],
+            [(Media.publish_on, 'asc'), (Media.id, 'asc')],
+            [(Media.publish_on, 'desc'), (Media.popularity_points, 'asc'),
+             (Media.id, 'desc')],
+        ]
+        for sort_keys in sort_keys_list:
+            expected = self._sorted(sort_keys)
+            for items_per_page in (1, 2, 3, 7, 10):
+                pages = self._pages(sort_keys, items_per_page)
+                assert sum(pages, []) == expected, \
+                    "Every item should be listed once, in order: %r, %r" \
+                    % (sort_keys, pages)
+                assert pages[-1] or len(pages) == 1, \
+                    "The last page shouldn't be empty"
+
+    def test_keyset_filter(self):
+        sort_keys = [(Media.publish_on, 'desc'), (Media.id, 'desc')]
+        expected = self._sorted(sort_keys)
+        for media in self.media:
+            values = [media.publish_on, media.id]
+            query = keyset_filter(self.query, sort_keys, values)
+            results = [m.id for m in query.order_by(Media.publish_on.desc(),
+                                                    Media.id.desc())]
+            position = expected.index(media.id)
+            assert results == expected[position + 1:], \
+                "Only the rows after %r should match" % values
+        self.assertRaises(ValueError, keyset_filter, self.query, sort_keys,
+                          [datetime(2010, 1, 1)])
@@ -0,0 +1,82 @@
+import pylons
+from mediacore.tests import *
+from mediacore.lib.related import RelatedMediaIndex
+from mediacore.model import DBSession
+from mediacore.model.media import media_related
+from sqlalchemy import sql
+
+class TestRelatedMediaIndex(TestController):
+
+    def __init__(self, *args, **kwargs):
+        TestController.__init__(self, *args, **kwargs)
+
+        # Initialize pylons.app_globals, for use in main thread.
+        self.response = self.app.get('/_test_vars')
+        pylons.app_globals._push_object(self.response.app_globals)
+
+    def _new_live_media(self, slug, name, tags):
+        media = self._new_publishable_media(slug, name)
+        media.encoded = True
+        media.set_tags(tags)
+        DBSession.add(media)
+        return media
+
+    def _related_ids(self, media):
+        return set([related_id for related_id, in DBSession.execute(
+            sql.select([media_related.c.related_id],
+                       media_related.c.media_id == media.id))])
+
+    def test_update_cold_index(self):
+        """The first queued changes of a new index are written."""
+        media_a = self._new_live_media(u'related-cold-a', u'Cold A',
+                                       u'related-cold')
+        media_b = self._new_live_media(u'related-cold-b', u'Cold B',
+                                       u'related-cold')
+        DBSession.commit()
+
+        index = RelatedMediaIndex()
+        index.queue(media_a.id)
+        index.update_queued(DBSession.bind)
+        DBSession.commit()
+        assert media_b.id in self._related_ids(media_a)
+        assert media_a.id in self._related_ids(media_b)
+
+    def test_update_retagged(self):
+        """Media become related once they share a tag."""
+        media_a = self._new_live_media(u'related-retag-a', u'Aardvark',
+                                       u'related-retag-x')
+        media_b = self._new_live_media(u'related-retag-b', u'Buffalo',
+                                       u'related-retag-y')
+        DBSession.commit()
+
+        index = RelatedMediaIndex()
+        index.rebuild(DBSession.bind)
+        assert media_b.id not in self._related_ids(media_a)
+
+        media_a.set_tags(u'related-retag-y')
+        DBSession.commit()
+        index.queue(media_a.id)
+        index.update_queued(DBSession.bind)
+        DBSession.commit()
+        assert media_b.id in self._related_ids(media_a)
+        assert media_a.id in self._related_ids(media_b)
+
+    def test_update_unpublished(self):
+        """Unpublished media lose their related media and are unlisted."""
+        media_a = self._new_live_media(u'related-unpub-a', u'Unpublished A',
+                                       u'related-unpub')
+        media_b = self._new_live_media(u'related-unpub-b', u'Unpublished B',
+                                       u'related-unpub')
+        DBSession.commit()
+
+        index = RelatedMediaIndex()
+        index.rebuild(DBSession.bind)
+        assert media_a.id in self._related_ids(media_b)
+
+        media_a.publishable = False
+        DBSession.commit()
+        index.queue(media_a.id)
+        index.update_queued(DBSession.bind)
+        DBSession.commit()
+        assert not self._related_ids(media_a)
+        assert media_a.id not in self._related_ids(media_b)
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+import pylons
+from mediacore.tests import *
+from mediacore.model import DBSession, Tag
+from mediacore.model.media import update_live_flags
+from sqlalchemy import sql
+
+class _RacingBind(object):
+    """Let another worker flip the live flags as soon as they're selected."""
+
+    def __init__(self, bind, now):
+        self.bind = bind
+        self.now = now
+        self.raced = False
+
+    def execute(self, clause, *args, **kwargs):
+        result = self.bind.execute(clause, *args, **kwargs)
+        if not self.raced and isinstance(clause, sql.expression.Select):
+            self.raced = True
+            rows = result.fetchall()
+            update_live_flags(self.bind, self.now)
+            return rows
+        return result
+
+class TestUpdateLiveFlags(TestController):
+
+    def __init__(self, *args, **kwargs):
+        TestController.__init__(self, *args, **kwargs)
+
+        # Initialize pylons.app_globals, for use in main thread.
+        self.response = self.app.get('/_test_vars')
+        pylons.app_globals._push_object(self.response.app_globals)
+
+    def setUp(self):
+        self.publish_on = datetime.now().replace(microsecond=0) \
+            + timedelta(days=1)
+        self.media = self._new_publishable_media(u'live-race',
+                                                 u'Live Race')
+        self.media.encoded = True
+        self.media.publish_on = self.publish_on
+        self.media.set_tags(u'live-race-tag')
+        DBSession.add(self.media)
+        DBSession.commit()
+        assert not self.media.live
+
+    def tearDown(self):
+        # SQLite doesn't cascade the deletes to media_tags
+        tags = list(self.media.tags)
+        self.media.tags = []
+        DBSession.delete(self.media)
+        for tag in tags:
+            DBSession.delete(tag)
+        DBSession.commit()
+
+    def _published_count(self):
+        return DBSession.query(Tag.media_count_published)\
+            .filter(Tag.slug == u'live-race-tag').scalar()
+
+    def test_update(self):
+        now = self.publish_on + timedelta(seconds=1)
+        flipped = []
+        assert update_live_flags(DBSession, now, flipped) == 1
+        assert flipped == [self.media.id]
+        assert self._published_count() == 1
+        assert update_live_flags(DBSession, now) == 0
+        assert self._published_count() == 1
+
+    def test_concurrent_update(self):
+        """Rows flipped by another worker aren't counted again."""
+        now = self.publish_on + timedelta(seconds=1)
+        bind = _RacingBind(DBSession, now)
+        flipped = []
+        assert update_live_flags(bind, now, flipped) == 0
+        assert bind.raced
+        assert flipped == []
+        assert self._published_count() == 1, \
+            "The published media count should only be bumped once"
+        DBSession.commit()
+        DBSession.refresh(self.media)
+        assert self.media.live
@@ -0,0 +1,183 @@
+import os
+import shutil
+import tempfile
+
+import pylons
+from mediacore.tests import *
+from mediacore.lib.search import get_search_backend
+from mediacore.lib.search.index import InvertedIndex, parse_query
+from mediacore.lib.search.native import InvertedIndexSearch
+from mediacore.model import DBSession, Media
+
+class TestInvertedIndex(TestCase):
+
+    documents = [
+        (1, {u'apple': 3, u'banana': 1}),
+        (2, {u'banana': 2, u'cherry': 1}),
+        (3, {u'cherry': 2, u'apricot': 1}),
+    ]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'test')
+        self.index = InvertedIndex(self.path)
+        self.index.write(self.documents)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _search(self, search, bool=False, index=None):
+        results = (index or self.index).search(parse_query(search, bool))
+        return [doc_id for doc_id, score in results]
+
+    def test_write(self):
+        assert self.index.exists()
+        assert self._search(u'apple') == [1]
+        assert self._search(u'cherry') == [3, 2], \
+            "Documents with more matches should rank higher"
+        results = self._search(u'banana cherry')
+        assert results[0] == 2, "Documents matching more terms rank higher"
+        assert sorted(results) == [1, 2, 3]
+        assert self._search(u'durian') == []
+
+    def test_update(self):
+        other = InvertedIndex(self.path)
+        assert self._search(u'cherry', index=other) == [3, 2]
+        self.index.update({
+            2: {u'durian': 1},
+            3: None,
+            4: {u'cherry': 1, u'elderberry': 1},
+        })
+        assert self._search(u'cherry', index=other) == [4], \
+            "Updates should be seen by other instances of the same index"
+        assert self._search(u'durian', index=other) == [2]
+        assert self._search(u'apricot', index=other) == []
+        assert self._search(u'banana', index=other) == [1]
+
+    def test_compact(self):
+        self.index.update({2: None, 4: {u'apple': 1, u'fig': 1}})
+        before = self.index.search(parse_query(u'apple fig banana'))
+        assert self.index.journal_size() > 0
+        self.index.compact()
+        assert self.index.journal_size() == 0
+        other = InvertedIndex(self.path)
+        assert other.search(parse_query(u'apple fig banana')) == before
+        self.index.update({1: None})
+        assert self._search(u'apple', index=other) == [4], \
+            "The journal should be replayed on top of the compacted index"
+
+    def test_boolean_queries(self):
+        assert self._search(u'+banana -cherry', True) == [1]
+        assert self._search(u'banana -apple', True) == [2]
+        assert self._search(u'+apple +cherry', True) == []
+        assert self._search(u'ap*', True) == [1, 3]
+        assert self._search(u'apple AND banana', True) == [1]
+        assert self._search(u'cherry NOT apricot', True) == [2]
+        assert self._search(u'ap*', False) == [], \
+            "Prefixes should only be expanded in boolean mode"
+
+    def test_parse_query(self):
+        assert parse_query(u'Big apple pie') == \
+            ([], [(u'big', False), (u'apple', False), (u'pie', False)], [])
+        assert parse_query(u'"big apple" AND pie NOT crust', True) == \
+            ([(u'big', False), (u'apple', False), (u'pie', False)], [],
+             [(u'crust', False)])
+        assert parse_query(u'-ap* +pie tart', True) == \
+            ([(u'pie', False)], [(u'tart', False)], [(u'ap', True)])
+
+class TestInvertedIndexSearch(TestController):
+
+    def __init__(self, *args, **kwargs):
+        TestController.__init__(self, *args, **kwargs)
+
+        # Initialize pylons.app_globals, for use in main thread.
+        self.response = self.app.get('/_test_vars')
+        pylons.app_globals._push_object(self.response.app_globals)
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.backend = InvertedIndexSearch()
+        self.backend.configure({'search_index_dir': self.dir})
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _search(self, query, search, index='public'):
+        return set(m.slug for m in self.backend.search(query, index, search))
+
+    def test_public_index(self):
+        """Only published media are in the public index."""
+        published = self._new_publishable_media(u'search-published',
+                                                u'Quokka Published')
+        published.encoded = True
+        draft = self._new_publishable_media(u'search-draft', u'Quokka Draft')
+        draft.publishable = False
+        stub = self._new_publishable_media(u'_stub_search', u'Quokka Stub')
+        stub.encoded = True
+        DBSession.add_all([published, draft, stub])
+        DBSession.commit()
+        self.backend.rebuild(DBSession.bind)
+
+        assert self._search(Media.query, u'quokka') == \
+            set([u'search-published'])
+        assert self._search(Media.query, u'quokka', 'admin') == \
+            set([u'search-published', u'search-draft', u'_stub_search'])
+
+        draft.publishable = True
+        draft.encoded = True
+        DBSession.commit()
+        self.backend.queue('media', draft.id)
+        self.backend.update_queued(DBSession.bind)
+        assert self._search(Media.query, u'quokka') == \
+            set([u'search-published', u'search-draft'])
+
+    def test_no_truncation(self):
+        """Matches aren't cut off before the query's own filters."""
+        for i in range(5):
+            media = self._new_publishable_media(u'search-many-%d' % i,
+                                                u'Wombat %d' % i)
+            media.encoded = True
+            DBSession.add(media)
+        DBSession.commit()
+        self.backend.rebuild(DBSession.bind)
+        self.backend.ranked_results = 2
+        query = Media.query.published()
+        results = self.backend.search(query, 'public', u'wombat').all()
+        assert len(results) == 5
+        assert self.backend.search(query, 'public', u'wombat').count() == 5
+
+    def test_queue_before_build(self):
+        """Changes queued before the index exists are applied once it does."""
+        media = self._new_publishable_media(u'search-queued', u'Numbat')
+        media.encoded = True
+        DBSession.add(media)
+        DBSession.commit()
+        self.backend.queue('media', media.id)
+        self.backend.update_queued(DBSession.bind)
+        assert not self.backend.is_available(DBSession.bind)
+
+        # Build the index from a copy of the media as they were before the
+        # change, as if the change was made while it was being built.
+        media.title = u'Numbat Bilby'
+        DBSession.commit()
+        self.backend.indexes['public'].write([])
+        self.backend.indexes['admin'].write([])
+        self.backend.update_queued(DBSession.bind)
+        assert self._search(Media.query, u'bilby') == set([u'search-queued'])
+
+class TestGetSearchBackend(TestController):
+
+    def test_recheck_fallback(self):
+        from mediacore.lib import search
+        saved = dict(search._engine_backends)
+        try:
+            engine = DBSession.bind
+            search._engine_backends[engine] = (search.get_backends()[-1], 0)
+            backend = get_search_backend(engine)
+            preferred = [b for b in search.get_backends()
+                         if b.is_available(engine)][0]
+            assert backend is preferred, \
+                "A fallback backend should be rechecked once it's due"
+        finally:
+            search._engine_backends.clear()
+            search._engine_backends.update(saved)
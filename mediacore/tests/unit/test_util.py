@@ -0,0 +1,77 @@
+import random
+from datetime import datetime, timedelta
+
+from nose.plugins.skip import SkipTest
+
+from mediacore.tests import *
+from mediacore.lib import util
+
+class TestCalculatePopularityScores(TestCase):
+
+    settings = [(4, 36), (2, 1), (10, 720)]
+
+    def _cases(self):
+        epoch = datetime(2000, 1, 1)
+        dates = [
+            epoch,
+            epoch + timedelta(microseconds=999999),
+            epoch - timedelta(microseconds=1),
+            epoch - timedelta(days=400, seconds=5),
+            epoch + timedelta(hours=36),
+            epoch + timedelta(hours=36) - timedelta(microseconds=1),
+            datetime(2010, 6, 15, 12, 30, 45, 123456),
+        ]
+        scores = [0, 1, -1, 2, -2, 4, 16, 64, 100, -100, 1000, 10 ** 6]
+        rand = random.Random(2010)
+        span = (datetime(2011, 1, 1) - datetime(1995, 1, 1)).days * 86400
+        for i in range(200):
+            dates.append(datetime(1995, 1, 1) + timedelta(
+                seconds=rand.randint(0, span),
+                microseconds=rand.randint(0, 999999)))
+            scores.append(rand.randint(-500, 50000))
+        # Every date with every hand-picked score, then the random pairs
+        pairs = [(date, score) for date in dates[:7] for score in scores[:12]]
+        pairs += zip(dates[7:], scores[12:])
+        return [date for date, score in pairs], [score for date, score in pairs]
+
+    def _compare(self):
+        dates, scores = self._cases()
+        negated = [-score for score in scores]
+        for exponent, lifetime in self.settings:
+            results = util.calculate_popularity_scores(
+                dates, [scores, negated], exponent, lifetime)
+            assert len(results) == 2
+            for score_list, result in zip([scores, negated], results):
+                expected = [util.calculate_popularity(date, score,
+                                                      exponent, lifetime)
+                            for date, score in zip(dates, score_list)]
+                assert len(result) == len(expected)
+                for i, (a, b) in enumerate(zip(expected, result)):
+                    assert a == b, "%s, %d with (%d, %d): %d != %d" % \
+                        (dates[i], score_list[i], exponent, lifetime, a, b)
+
+    def test_numpy(self):
+        if util.numpy is None:
+            raise SkipTest('NumPy is not installed')
+        self._compare()
+
+    def test_pure_python(self):
+        saved = util.numpy
+        util.numpy = None
+        try:
+            self._compare()
+        finally:
+            util.numpy = saved
+
+    def test_empty(self):
+        assert util.calculate_popularity_scores([], [[], []], 4, 36) == \
+            [[], []]
+
+class TestChunks(TestCase):
+
+    def test_chunks(self):
+        assert list(util.chunks([])) == []
+        assert list(util.chunks(xrange(5), 2)) == [[0, 1], [2, 3], [4]]
+        assert list(util.chunks(set([1]), 2)) == [[1]]
+        assert [len(chunk) for chunk in util.chunks(xrange(1000))] == \
+            [500, 500]
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+
+import pylons
+from mediacore.tests import *
+from mediacore.lib.decorators import autocommit
+from mediacore.lib.versioned_cache import VersionedCache
+
+class _Request(object):
+    pass
+
+class TestVersionedCache(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.stored = {'value': u'committed'}
+        self.current = dict(self.stored)
+        self.cache = VersionedCache(lambda: self.current['value'],
+                                    os.path.join(self.dir, 'version'),
+                                    check_interval=0)
+        pylons.request._push_object(_Request())
+
+    def tearDown(self):
+        pylons.request._pop_object()
+        shutil.rmtree(self.dir)
+
+    def _update(self, value, fail=False):
+        """Change the value within a transaction, and read it back."""
+        def action():
+            self.current['value'] = value
+            self.cache.clear()
+            assert self.cache.get() == value, \
+                "The request should read its own changes"
+            if fail:
+                raise ValueError
+            self.stored['value'] = value
+        try:
+            autocommit(action)()
+        finally:
+            # Emulate the end of the transaction
+            self.current = dict(self.stored)
+
+    def test_commit(self):
+        assert self.cache.get() == u'committed'
+        self._update(u'changed')
+        assert self.cache.get() == u'changed'
+
+    def test_rollback(self):
+        assert self.cache.get() == u'committed'
+        self.assertRaises(ValueError, self._update, u'changed', True)
+        assert self.cache.get() == u'committed', \
+            "Values read before a rollback shouldn't be kept"
+
+    def test_other_processes(self):
+        other = VersionedCache(lambda: self.current['value'],
+                               self.cache.version_path, check_interval=0)
+        assert other.get() == u'committed'
+        self._update(u'changed')
+        assert other.get() == u'changed'
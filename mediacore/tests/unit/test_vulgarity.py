@@ -0,0 +1,85 @@
+import random
+import re
+
+from mediacore.tests import *
+from mediacore.lib.vulgarity import VulgarityFilter, get_vulgarity_filter
+
+def regex_sub(words, text):
+    """Star out the words as filter_vulgarity did before VulgarityFilter."""
+    word_pattern = '|'.join(re.escape(word) for word in words if word)
+    word_expr = re.compile(word_pattern, re.IGNORECASE)
+    def word_replacer(matchobj):
+        word = matchobj.group(0)
+        return '*' * len(word)
+    return word_expr.sub(word_replacer, text)
+
+class TestVulgarityFilter(TestCase):
+
+    def _random_cases(self, count, alphabet):
+        rand = random.Random(2010)
+        for i in range(count):
+            words = [u''.join(rand.choice(alphabet)
+                              for j in range(rand.randint(1, 4)))
+                     for k in range(rand.randint(1, 5))]
+            text = u''.join(rand.choice(alphabet + u' .')
+                            for j in range(rand.randint(0, 40)))
+            yield words, text
+
+    def test_regex(self):
+        """Words that don't start at the same place match as before."""
+        cases = [
+            ([u'darn', u'heck'], u'Darn it, what the HECK?'),
+            ([u'abc', u'bcd'], u'abcd bcda xabcdx'),
+            ([u'aa'], u'aaaaa'),
+            ([u'ab', u'ba'], u'ababa'),
+            ([u'a.b', u'(c)'], u'a.b axb (c) c'),
+            ([u'word', u'', u'other'], u'a word or another'),
+            ([u'ass', u'ssa'], u'assassin'),
+        ]
+        for words, text in cases:
+            expected = regex_sub(words, text)
+            assert VulgarityFilter(words).sub(text) == expected, \
+                "%r in %r should be %r" % (words, text, expected)
+
+        for words, text in self._random_cases(2000, u'abcAB'):
+            prefixes = [w for w in words for v in words
+                        if w.lower() != v.lower()
+                        and v.lower().startswith(w.lower())]
+            if prefixes:
+                continue
+            assert VulgarityFilter(words).sub(text) == \
+                regex_sub(words, text), "%r in %r" % (words, text)
+
+    def test_overlapping(self):
+        """Where words start at the same place, the longest one is used.
+
+        This is what the old regex did if the words were longest first.
+        """
+        vulgarity_filter = VulgarityFilter([u'ass', u'assassin'])
+        assert vulgarity_filter.sub(u'An assassin') == u'An ********'
+        assert regex_sub([u'ass', u'assassin'], u'An assassin') == \
+            u'An ******in'
+        assert VulgarityFilter([u'ab', u'abc', u'bcd']).sub(u'abcd') == \
+            u'***d'
+
+        for words, text in self._random_cases(2000, u'abcAB'):
+            longest_first = sorted(words, key=len, reverse=True)
+            assert VulgarityFilter(words).sub(text) == \
+                regex_sub(longest_first, text), "%r in %r" % (words, text)
+
+    def test_case_folding(self):
+        vulgarity_filter = VulgarityFilter([u'Caf\xe9', u'STRASSE'])
+        assert vulgarity_filter.sub(u'CAF\xc9 caf\xe9 Stra\xdfe strasse') == \
+            u'**** **** Stra\xdfe *******'
+
+    def test_empty(self):
+        assert VulgarityFilter([]).sub(u'text') == u'text'
+        assert VulgarityFilter([u'', u'word']).sub(u'') == u''
+        assert VulgarityFilter([u'']).sub(u'text') == u'text'
+
+    def test_get_vulgarity_filter(self):
+        vulgarity_filter = get_vulgarity_filter(u'darn, heck,')
+        assert vulgarity_filter.words == frozenset([u'darn', u'heck'])
+        assert get_vulgarity_filter(u'darn, heck,') is vulgarity_filter, \
+            "The filter should be built once for each setting"
+        assert get_vulgarity_filter(u'darn').words == frozenset([u'darn'])
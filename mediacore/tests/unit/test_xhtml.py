@@ -0,0 +1,62 @@
+import os
+
+import simplejson
+from nose.plugins.skip import SkipTest
+
+from mediacore.tests import *
+from mediacore.lib.cache_stats import cache_stats
+from mediacore.lib.xhtml import _clean_xhtml, cleaner_settings
+from mediacore.lib.xhtml.sanitizer import (UnsupportedMarkup, sanitize,
+    supported)
+
+corpus_path = os.path.join(os.path.dirname(__file__),
+                           'clean_xhtml_corpus.json')
+
+class TestCleanXhtml(TestCase):
+    """Compare the single-pass sanitizer to the Cleaner.
+
+    The corpus holds hand-written and randomly generated descriptions, the
+    output of two Cleaner passes over each of them with BeautifulSoup 3.2.1,
+    and whether the single-pass sanitizer supports them.
+    """
+
+    def setUp(self):
+        if not supported:
+            raise SkipTest('The corpus depends on the BeautifulSoup version')
+        f = open(corpus_path)
+        try:
+            self.corpus = simplejson.load(f)
+        finally:
+            f.close()
+
+    def _fallbacks(self):
+        return cache_stats.snapshot().get('clean_xhtml', {}).get('fallback', 0)
+
+    def test_cleaner(self):
+        """The Cleaner's output hasn't changed since the corpus was made."""
+        for case in self.corpus:
+            output = _clean_xhtml(case['input'], True, cleaner_settings,
+                                  _single_pass=False)
+            assert output == case['output'], repr(case['input'])
+
+    def test_single_pass(self):
+        for case in self.corpus:
+            before = self._fallbacks()
+            output = _clean_xhtml(case['input'], True, cleaner_settings)
+            assert output == case['output'], repr(case['input'])
+            single_pass = self._fallbacks() == before
+            assert single_pass == case['single_pass'], \
+                "Unexpected fallback for %r" % case['input']
+
+    def test_unsupported(self):
+        # The Cleaner fails on these, and should raise its own errors.
+        self.assertRaises(UnsupportedMarkup, sanitize,
+                          u'</\xfcn\xefcode>', cleaner_settings)
+        self.assertRaises(UnsupportedMarkup, sanitize,
+                          u'&#99999999;', cleaner_settings)
+        self.assertRaises(UnsupportedMarkup, sanitize,
+                          'bytes', cleaner_settings)
+        self.assertRaises(UnsupportedMarkup, sanitize, u'x',
+                          dict(cleaner_settings, filters=['wrap_string']))
+        self.assertRaises(UnsupportedMarkup, sanitize, u'x',
+                          dict(cleaner_settings, convert_entities='html'))
@@ -26,9 +26,11 @@ install_requires = [
     'ToscaWidgets == 0.9.9',
     'tw.forms == 0.9.9',
     'MySQL-python >= 1.2.2',
-    'BeautifulSoup == 3.0.7a',
-        # We monkeypatch this version of BeautifulSoup in mediacore.__init__
-        # Patch pending: https://bugs.launchpad.net/beautifulsoup/+bug/397997
+    'BeautifulSoup == 3.2.1',
+        # The single-pass sanitizer in mediacore.lib.xhtml.sanitizer, and its
+        # test corpus, depend on this exact version. 3.2.x fixes
+        # https://bugs.launchpad.net/beautifulsoup/+bug/397997 but we keep
+        # the NavigableString monkeypatch in mediacore.__init__ regardless.
     'PIL == 1.1.6',
         # The original PIL 1.1.6 package won't install via setuptools so this
         # this setup script installs http://dist.repoze.org/PIL-1.1.6.tar.gz
@@ -25,18 +25,27 @@ END;//
 
 -- After Media is Updated
 -- Copies changes to the corresponding Search row
+-- Skipped when no searchable column changed (ie. when only the views,
+-- likes or publication state are updated) so we don't lock the MyISAM table.
 DROP TRIGGER IF EXISTS media_au//
 CREATE TRIGGER media_au
 	AFTER UPDATE ON media FOR EACH ROW
 BEGIN
-	UPDATE media_fulltext
-		SET `media_id` = NEW.`id`,
-		    `title` = NEW.`title`,
-		    `subtitle` = NEW.`subtitle`,
-		    `description_plain` = NEW.`description_plain`,
-		    `notes` = NEW.`notes`,
-		    `author_name` = NEW.`author_name`
-		WHERE media_id = OLD.id;
+	IF NOT (NEW.`id` <=> OLD.`id`
+		AND NEW.`title` <=> OLD.`title`
+		AND NEW.`subtitle` <=> OLD.`subtitle`
+		AND NEW.`description_plain` <=> OLD.`description_plain`
+		AND NEW.`notes` <=> OLD.`notes`
+		AND NEW.`author_name` <=> OLD.`author_name`) THEN
+		UPDATE media_fulltext
+			SET `media_id` = NEW.`id`,
+			    `title` = NEW.`title`,
+			    `subtitle` = NEW.`subtitle`,
+			    `description_plain` = NEW.`description_plain`,
+			    `notes` = NEW.`notes`,
+			    `author_name` = NEW.`author_name`
+			WHERE media_id = OLD.id;
+	END IF;
 END;//
 
 -- 